@@ -0,0 +1,69 @@
+"""
+ages.py converts the route ages at ingest.
+
+The devices show the age of a route in one of three formats, depending on how old it is:
+    10h49m31s   less than a day
+    25d20h48m   less than some hundred days
+    0241d11h    older routes
+The string is kept as the device showed it, and the age is also stored in seconds together
+with the time the route was (re)installed, the checkpoint timestamp minus the age, so the
+routes installed in a time window are an index range scan instead of parsing every age.
+
+Checkpoint timestamps (YYYY-MM-DD_HH:MM) have no timezone, they are converted to epoch
+seconds as if they were UTC. Only the differences between install times are meaningful.
+The ages lose the precision of their format, a route of 0241d11h was installed within that hour.
+"""
+
+import calendar
+import functools
+import re
+import time
+
+TIMESTAMP_FORMAT = "%Y-%m-%d_%H:%M"
+
+_age_regex = re.compile(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?")
+
+
+def age_to_seconds(age: str) -> int:
+    """Returns the seconds of an age like 10h49m31s, 25d20h48m or 0241d11h, None if it isn't an age"""
+    if age.__class__ is int:
+        return age
+    if not age:
+        return None
+    match = _age_regex.fullmatch(age)
+    if match is None:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return int(days or 0) * 86400 + int(hours or 0) * 3600 + int(minutes or 0) * 60 + int(seconds or 0)
+
+
+@functools.lru_cache(maxsize=1024)
+def timestamp_to_epoch(timestamp: str) -> int:
+    """Returns the epoch seconds of a checkpoint timestamp, None if it isn't in TIMESTAMP_FORMAT"""
+    try:
+        return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return None
+
+
+def epoch_to_timestamp(epoch: int) -> str:
+    """Formats epoch seconds as a checkpoint timestamp, with the seconds: YYYY-MM-DD_HH:MM:SS"""
+    return time.strftime(TIMESTAMP_FORMAT + ":%S", time.gmtime(epoch))
+
+
+def install_time(age: str, timestamp: str) -> tuple:
+    """Returns (age_seconds, installed_at) of a route of age seen in the checkpoint timestamp"""
+    age_seconds = age_to_seconds(age)
+    epoch = timestamp_to_epoch(timestamp)
+    if age_seconds is None or epoch is None:
+        return age_seconds, None
+    return age_seconds, epoch - age_seconds
+
+
+def normalize_routes(routes: list, timestamp: str) -> list:
+    """Sets in place age_seconds and installed_at of a batch of RouteRecord seen in the checkpoint timestamp"""
+    epoch = timestamp_to_epoch(timestamp)
+    for route in routes:
+        route.age_seconds = age_seconds = age_to_seconds(route.age)
+        route.installed_at = None if age_seconds is None or epoch is None else epoch - age_seconds
+    return routes
@@ -0,0 +1,206 @@
+"""
+backoff.py decides when the devices that fail to connect are tried again.
+
+    BackoffPolicy   the attempts of a device in a run and the wait before each retry: exponential
+                    (base_delay * multiplier ** retry, up to max_delay) with full jitter, a random
+                    wait between 0 and that delay, so the devices behind a flapping proxy don't retry
+                    in lockstep
+    RetryBudget     the retries of the whole run, when a large share of the fleet fails (e.g. a
+                    proxy is down) the run doesn't multiply its connections by the number of attempts
+    CircuitBreaker  the consecutive failures of every device (one per run) and every proxy (one per
+                    device that couldn't reach it), kept in the database across runs
+                    (storage.get_circuit_states). After threshold failures the circuit
+                    is open: the device, or every device behind the proxy, is skipped until a cooldown
+                    that doubles with every failure, then probed with a single attempt. A success
+                    closes the circuit.
+
+The collector (collector.py) waits the backoff of a device without holding its thread nor its
+concurrency slots, the retries go back to the queue of devices waiting for a slot.
+Authentication failures are not retried, retrying them can lock the account.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# errors of network_interface.connect_device that aren't solved by retrying
+NOT_RETRYABLE_ERRORS = ("AuthenticationFailed", "ProxyAuthenticationError", "JumpHostAuthenticationError")
+# errors of network_interface.connect_device caused by the proxy, not by the device
+PROXY_ERRORS = ("ProxyConnectionError", "ProxyAuthenticationError", "ProxyTimeout", "SOCKS5Error",
+                "JumpHostConnectionError", "JumpHostAuthenticationError")
+# errors of network_interface.connect_device that say nothing about the device nor its proxy, the
+# jump host had no free channel (bastions.py)
+BUSY_ERRORS = ("JumpHostBusy", "MaximumNumberRetriesReached")
+
+
+def is_connect_failure(response: dict) -> bool:
+    """True if the device of the response couldn't be connected, the connected devices have the timing of their commands"""
+    return bool(response.get("error")) and "timing" not in response
+
+
+def is_retryable(response: dict) -> bool:
+    error = response.get("error", "")
+    return is_connect_failure(response) and not any(code in error for code in NOT_RETRYABLE_ERRORS)
+
+
+class BackoffPolicy:
+    """The attempts of a device and the jittered exponential wait before each retry"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, multiplier: float = 2.0, max_delay: float = 60.0,
+                 randomizer: random.Random = None):
+        """
+        :param max_attempts: Attempts to connect a device in a run, at least 1.
+        :raises ValueError: If max_attempts is lower than 1.
+        """
+        if max_attempts < 1:
+            raise ValueError(f"A device needs at least 1 attempt, not {max_attempts}")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.randomizer = randomizer or random.Random()
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the retry (0 for the first retry, after the first attempt)"""
+        return self.randomizer.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** retry))
+
+
+class RetryBudget:
+    """The retries allowed in a run, minimum plus ratio of the devices"""
+
+    def __init__(self, devices: int, ratio: float = 0.2, minimum: int = 10):
+        self.allowed = minimum + int(devices * ratio)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.used >= self.allowed:
+                return False
+            self.used += 1
+            if self.used == self.allowed:
+                logger.warning(f"Retry budget of {self.allowed} retries used, the devices that fail aren't retried anymore")
+            return True
+
+
+def device_key(device: dict) -> str:
+    return f"device:{device.get('hostname')}"
+
+
+def proxy_key(device: dict) -> str:
+    proxy = device.get("proxy")
+    if proxy:
+        return f"proxy:{proxy.get('addr')}:{proxy.get('port')}"
+    jump_host = device.get("jump_host")
+    if jump_host:
+        return f"jump_host:{jump_host.get('host')}:{jump_host.get('port', 22)}"
+    return None
+
+
+class CircuitState:
+    __slots__ = ("failures", "last_failure", "last_error")
+
+    def __init__(self, failures: int = 0, last_failure: float = None, last_error: str = None):
+        self.failures = failures
+        self.last_failure = last_failure
+        self.last_error = last_error
+
+
+class CircuitBreaker:
+    """The consecutive failures of the devices and proxies, see the module documentation"""
+
+    ALLOW = "allow"
+    PROBE = "probe"
+    SKIP = "skip"
+
+    def __init__(self, states: dict = None, threshold: int = 3, cooldown: float = 900.0, max_cooldown: float = 86400.0,
+                 clock=time.time):
+        """
+        :param states: {key: (failures, last_failure, last_error)}, e.g. storage.get_circuit_states().
+        :param threshold: Consecutive failures that open the circuit.
+        :param cooldown: Seconds an open circuit skips the device before the first probe, doubled on every failed probe.
+        """
+        self.states = {key: CircuitState(*state) for key, state in (states or {}).items()}
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.changed = set()
+        self._lock = threading.Lock()
+
+    def _decision(self, key: str) -> str:
+        state = self.states.get(key)
+        if key is None or state is None or state.failures < self.threshold:
+            return self.ALLOW
+        cooldown = min(self.max_cooldown, self.cooldown * 2 ** (state.failures - self.threshold))
+        if self.clock() - state.last_failure < cooldown:
+            return self.SKIP
+        return self.PROBE
+
+    def check(self, device: dict) -> tuple:
+        """(decision, reason) for a device, ALLOW, PROBE with a single attempt or SKIP"""
+        with self._lock:
+            decisions = [(self._decision(key), key) for key in (proxy_key(device), device_key(device))]
+        for decision in (self.SKIP, self.PROBE):
+            for key_decision, key in decisions:
+                if key_decision == decision:
+                    return decision, key
+        return self.ALLOW, None
+
+    def record(self, device: dict, response: dict):
+        """
+        Counts the failure of a device that couldn't be connected, or resets the device and its proxy.
+        A device that only waited for a busy jump host isn't counted.
+        """
+        keys = [device_key(device), proxy_key(device)]
+        error = response.get("error", "")
+        if is_connect_failure(response) and all(code in BUSY_ERRORS for code in error.split(",") if code):
+            return
+        with self._lock:
+            if not is_connect_failure(response):
+                for key in keys:
+                    if key is not None and key in self.states:
+                        del self.states[key]
+                        self.changed.add(key)
+                return
+            key = keys[1] if keys[1] is not None and any(code in error for code in PROXY_ERRORS) else keys[0]
+            state = self.states.setdefault(key, CircuitState())
+            state.failures += 1
+            state.last_failure = self.clock()
+            state.last_error = error
+            self.changed.add(key)
+            if state.failures == self.threshold:
+                logger.warning(f"{key} failed {state.failures} times in a row, it is skipped for the next {self.cooldown:.0f} seconds")
+
+    def __getstate__(self):
+        # the breaker is sent to the shard processes (sharding.py), without its lock
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["states"] = {key: (value.failures, value.last_failure, value.last_error) for key, value in self.states.items()}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.states = {key: CircuitState(*value) for key, value in self.states.items()}
+        self._lock = threading.Lock()
+
+    def update(self, states: dict):
+        """Applies the changed_states of another breaker, e.g. the one of a shard process"""
+        with self._lock:
+            for key, state in states.items():
+                if state is None:
+                    self.states.pop(key, None)
+                else:
+                    self.states[key] = CircuitState(*state)
+                self.changed.add(key)
+
+    def changed_states(self) -> dict:
+        """{key: (failures, last_failure, last_error), None for the closed circuits} of the keys changed"""
+        with self._lock:
+            return {
+                key: (self.states[key].failures, self.states[key].last_failure, self.states[key].last_error) if key in self.states else None
+                for key in self.changed
+            }
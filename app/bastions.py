@@ -0,0 +1,225 @@
+"""
+bastions.py shares the SSH connections to the jump hosts between the devices behind them.
+
+A device with a "jump_host" in the inventory is reached through an SSH direct-tcpip channel
+opened on a connection to the jump host, netmiko runs its own SSH session inside the channel
+(the "sock" of ConnectHandler). Connecting every device to the jump host means a TCP connection,
+an SSH handshake and an authentication on the jump host per device. A BastionPool keeps a few
+authenticated transports per jump host and opens the channels of all the devices on them:
+    - transports_per_bastion   SSH connections kept to every jump host
+    - channels_per_transport   devices connected at the same time through the same transport,
+                               keep it under the MaxSessions of the jump host (10 for OpenSSH)
+    - max_opening              channels and transports being opened at the same time on a jump
+                               host, the handshakes are what loads the jump host
+A device waits for a free channel when all of them are in use, up to wait_timeout seconds.
+The channel is freed when the session of the device is closed, the transports stay open (with an
+SSH keepalive) for the next devices and the next collections.
+
+The jump host of a device:
+    jump_host:
+      host: 192.0.2.250
+      port: 22
+      username: user
+      password: ENV.JUMP_PASSWORD
+      key_filename: ~/.ssh/id_ed25519
+"""
+
+import logging
+import threading
+import time
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS_PER_BASTION = 2
+CHANNELS_PER_TRANSPORT = 8
+MAX_OPENING = 4
+WAIT_TIMEOUT = 60.0
+CONNECT_TIMEOUT = 10.0
+KEEPALIVE_SECONDS = 30
+
+
+class BastionError(Exception):
+    """The jump host can't be used, error is the error code of the response of the device"""
+
+    def __init__(self, error: str, message: str):
+        super().__init__(message)
+        self.error = error
+
+
+def bastion_key(jump_host: dict) -> tuple:
+    return jump_host.get("host"), jump_host.get("port", 22), jump_host.get("username")
+
+
+def connect_transport(jump_host: dict, timeout: float = CONNECT_TIMEOUT, keepalive: int = KEEPALIVE_SECONDS):
+    """
+    Opens an authenticated SSH transport to a jump host.
+    :param jump_host: The jump host, see the module documentation.
+    :return: The paramiko.Transport.
+    :raises BastionError: If the jump host can't be connected or authenticated.
+    """
+    logger.debug("connect_transport")
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    key_filename = jump_host.get("key_filename")
+    try:
+        client.connect(jump_host.get("host"), port=jump_host.get("port", 22), username=jump_host.get("username"),
+                       password=jump_host.get("password") or None, key_filename=key_filename,
+                       look_for_keys=bool(key_filename), allow_agent=False, timeout=timeout, banner_timeout=timeout,
+                       auth_timeout=timeout)
+    except paramiko.AuthenticationException as exc:
+        client.close()
+        raise BastionError("JumpHostAuthenticationError", f"Authentication failed on the jump host {jump_host.get('host')}") from exc
+    except Exception as exc:
+        client.close()
+        raise BastionError("JumpHostConnectionError", f"Error connecting to the jump host {jump_host.get('host')}: {exc}") from exc
+    transport = client.get_transport()
+    if keepalive:
+        transport.set_keepalive(keepalive)
+    return transport
+
+
+class _Transport:
+    __slots__ = ("transport", "channels")
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.channels = []
+
+    def open_channels(self) -> int:
+        # a channel is freed when netmiko closes the session of the device
+        self.channels = [channel for channel in self.channels if not channel.closed]
+        return len(self.channels)
+
+
+class _Bastion:
+    def __init__(self, max_opening: int):
+        self.transports = []
+        self.connecting = 0
+        self.opening = threading.BoundedSemaphore(max_opening)
+
+
+class BastionPool:
+    """The transports to the jump hosts, see the module documentation"""
+
+    def __init__(self, transports_per_bastion: int = TRANSPORTS_PER_BASTION, channels_per_transport: int = CHANNELS_PER_TRANSPORT,
+                 max_opening: int = MAX_OPENING, wait_timeout: float = WAIT_TIMEOUT, connect_function=connect_transport):
+        """
+        :param connect_function: Opens a transport to a jump host, (jump_host) -> paramiko.Transport.
+        """
+        self.transports_per_bastion = transports_per_bastion
+        self.channels_per_transport = channels_per_transport
+        self.max_opening = max_opening
+        self.wait_timeout = wait_timeout
+        self.connect_function = connect_function
+        self._bastions = {}
+        self._condition = threading.Condition()
+        self.transports_opened = 0
+        self.channels_opened = 0
+
+    def _bastion(self, jump_host: dict) -> _Bastion:
+        return self._bastions.setdefault(bastion_key(jump_host), _Bastion(self.max_opening))
+
+    def _reserve(self, bastion: _Bastion):
+        """
+        A transport with a free channel, None if a new transport must be connected.
+        The caller holds the condition, the channel is counted when it is opened.
+        """
+        bastion.transports = [entry for entry in bastion.transports if entry.transport.is_active()]
+        available = [entry for entry in bastion.transports if entry.open_channels() < self.channels_per_transport]
+        if available:
+            return min(available, key=lambda entry: len(entry.channels))
+        return None
+
+    def open_channel(self, jump_host: dict, ip: str, port: int = 22, timeout: float = CONNECT_TIMEOUT):
+        """
+        Opens a direct-tcpip channel to a device through its jump host, to be used as the sock of ConnectHandler.
+        :raises BastionError: If the jump host can't be used, or the device can't be reached from it ("JumpHostChannelError").
+        """
+        logger.debug("open_channel")
+        deadline = time.monotonic() + self.wait_timeout
+        # the channel takes its place on the transport before it is opened so the transport isn't overbooked
+        pending = _PendingChannel()
+        with self._condition:
+            bastion = self._bastion(jump_host)
+            while True:
+                entry = self._reserve(bastion)
+                if entry is not None:
+                    entry.channels.append(pending)
+                    break
+                if len(bastion.transports) + bastion.connecting < self.transports_per_bastion:
+                    bastion.connecting += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BastionError("JumpHostBusy", f"No free channel on the jump host {jump_host.get('host')} "
+                                                       f"after {self.wait_timeout} seconds")
+                # the channels closed by netmiko don't notify the pool, they are checked again periodically
+                self._condition.wait(min(remaining, 0.5))
+
+        with bastion.opening:
+            if entry is None:
+                entry = self._connect(bastion, jump_host, pending)
+            try:
+                channel = entry.transport.open_channel("direct-tcpip", (ip, port), ("127.0.0.1", 0), timeout=timeout)
+            except Exception as exc:
+                with self._condition:
+                    entry.channels.remove(pending)
+                    self._condition.notify_all()
+                raise BastionError("JumpHostChannelError",
+                                   f"The jump host {jump_host.get('host')} can't reach {ip}:{port}: {exc}") from exc
+        with self._condition:
+            entry.channels[entry.channels.index(pending)] = channel
+            self.channels_opened += 1
+        return channel
+
+    def _connect(self, bastion: _Bastion, jump_host: dict, pending) -> _Transport:
+        try:
+            transport = self.connect_function(jump_host)
+        except BaseException:
+            with self._condition:
+                bastion.connecting -= 1
+                self._condition.notify_all()
+            raise
+        entry = _Transport(transport)
+        entry.channels.append(pending)
+        with self._condition:
+            bastion.connecting -= 1
+            bastion.transports.append(entry)
+            self.transports_opened += 1
+            self._condition.notify_all()
+        logger.info(f"Connected to the jump host {jump_host.get('host')}, {len(bastion.transports)} transports open")
+        return entry
+
+    def close(self):
+        """Closes the transports to the jump hosts, and the channels on them"""
+        with self._condition:
+            entries = [entry for bastion in self._bastions.values() for entry in bastion.transports]
+            self._bastions.clear()
+        for entry in entries:
+            try:
+                entry.transport.close()
+            except Exception as exc:
+                logger.debug("Error closing a jump host transport", exc_info=exc)
+        if entries:
+            logger.info(f"Closed {len(entries)} jump host transports")
+
+
+class _PendingChannel:
+    """A channel being opened, it takes its place on the transport"""
+
+    closed = False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_bastion_pool() -> BastionPool:
+    """The pool shared by all the connections of the process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BastionPool()
+        return _pool
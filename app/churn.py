@@ -0,0 +1,155 @@
+"""
+churn.py finds the unstable routes of a device and service over its checkpoint history.
+
+compare_routes looks at two checkpoints. Comparing every pair of consecutive checkpoints of a
+month of history reloads each checkpoint twice and rebuilds its indexes every time. The churn
+analysis streams the history once (storage.iter_route_history) and keeps a small state per
+prefix, each checkpoint is compared against that state, so the work is proportional to the
+number of stored routes and only one checkpoint is in memory.
+
+Per prefix it counts:
+    changes                 next hops, metrics or protocols changed, the route was withdrawn or came back
+    withdrawals             the route was missing from a checkpoint after being seen
+    next_hop_oscillations   the next hops went back to the ones they had before the last change (A -> B -> A)
+    age_resets              the route was in both checkpoints but was reinstalled in between,
+                            a flap the checkpoints didn't catch, see ages.py
+"""
+
+import logging
+
+import ages
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ("changes", "withdrawals", "next_hop_oscillations", "age_resets")
+
+
+class PrefixState:
+    """What the last checkpoints showed of a prefix"""
+
+    __slots__ = ("entries", "next_hops", "previous_next_hops", "installed_at", "present", "first_seen", "last_seen") + COUNTERS
+
+    def __init__(self, entries: frozenset, next_hops: frozenset, installed_at: int, timestamp: str):
+        # (next_hop, metric, route_protocol) of every entry of the prefix (more than one with ECMP)
+        self.entries = entries
+        self.next_hops = next_hops
+        self.previous_next_hops = None
+        self.installed_at = installed_at
+        self.present = True
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.changes = 0
+        self.withdrawals = 0
+        self.next_hop_oscillations = 0
+        self.age_resets = 0
+
+
+class ChurnTracker:
+    """Incremental churn state of a device and service, add the checkpoints in order with add_checkpoint"""
+
+    def __init__(self):
+        self.prefixes = {}
+        self.checkpoints = []
+
+    def add_checkpoint(self, timestamp: str, rows):
+        """
+        Updates the state of every prefix with a checkpoint.
+        :param timestamp: The timestamp of the checkpoint, newer than the ones already added.
+        :param rows: (route, next_hop, metric, route_protocol, installed_at) of the routes of the checkpoint.
+        """
+        logger.debug("add_checkpoint")
+        entries_by_route = {}
+        installed_at_by_route = {}
+        for route, next_hop, metric, route_protocol, installed_at in rows:
+            entries = entries_by_route.get(route)
+            if entries is None:
+                entries_by_route[route] = [(next_hop, metric, route_protocol)]
+            else:
+                entries.append((next_hop, metric, route_protocol))
+            if installed_at is not None and installed_at > installed_at_by_route.get(route, -1):
+                installed_at_by_route[route] = installed_at
+
+        # a route reinstalled after the previous checkpoint was taken was reset in between
+        previous_epoch = ages.timestamp_to_epoch(self.checkpoints[-1]) if self.checkpoints else None
+        prefixes = self.prefixes
+        for route, entries in entries_by_route.items():
+            entries = frozenset(entries)
+            installed_at = installed_at_by_route.get(route)
+            state = prefixes.get(route)
+            if state is None:
+                prefixes[route] = PrefixState(entries, frozenset(entry[0] for entry in entries), installed_at, timestamp)
+                continue
+            state.last_seen = timestamp
+            if not state.present:
+                state.present = True
+                state.changes += 1
+            elif (installed_at is not None and previous_epoch is not None and installed_at > previous_epoch
+                  and installed_at != state.installed_at):
+                state.age_resets += 1
+            state.installed_at = installed_at
+            if entries == state.entries:
+                continue
+            state.changes += 1
+            state.entries = entries
+            next_hops = frozenset(entry[0] for entry in entries)
+            if next_hops != state.next_hops:
+                if next_hops == state.previous_next_hops:
+                    state.next_hop_oscillations += 1
+                state.previous_next_hops = state.next_hops
+                state.next_hops = next_hops
+
+        if len(entries_by_route) != len(prefixes):
+            for route, state in prefixes.items():
+                if state.present and route not in entries_by_route:
+                    state.present = False
+                    state.changes += 1
+                    state.withdrawals += 1
+        self.checkpoints.append(timestamp)
+
+    def report(self, min_count: int) -> dict:
+        """
+        The unstable prefixes, the ones with a counter over min_count, the most unstable first:
+        {"checkpoints": [timestamps], "flapping": [...], "oscillating": [...], "age_resets": [...]}
+        flapping are the prefixes with more than min_count changes.
+        """
+        logger.debug("report")
+        unstable = {"flapping": [], "oscillating": [], "age_resets": []}
+        for route, state in self.prefixes.items():
+            if state.changes <= min_count and state.next_hop_oscillations <= min_count and state.age_resets <= min_count:
+                continue
+            summary = {
+                "route": route,
+                "changes": state.changes,
+                "withdrawals": state.withdrawals,
+                "next_hop_oscillations": state.next_hop_oscillations,
+                "age_resets": state.age_resets,
+                "next_hops": sorted(next_hop for next_hop in state.next_hops if next_hop is not None),
+                "present": state.present,
+                "first_seen": state.first_seen,
+                "last_seen": state.last_seen,
+            }
+            if state.changes > min_count:
+                unstable["flapping"].append(summary)
+            if state.next_hop_oscillations > min_count:
+                unstable["oscillating"].append(summary)
+            if state.age_resets > min_count:
+                unstable["age_resets"].append(summary)
+        unstable["flapping"].sort(key=lambda summary: (-summary["changes"], summary["route"]))
+        unstable["oscillating"].sort(key=lambda summary: (-summary["next_hop_oscillations"], summary["route"]))
+        unstable["age_resets"].sort(key=lambda summary: (-summary["age_resets"], summary["route"]))
+        return {"checkpoints": list(self.checkpoints), **unstable}
+
+
+def route_churn(history, min_count: int = 2) -> dict:
+    """
+    Churn report of a checkpoint history.
+    :param history: (timestamp, rows) per checkpoint from the oldest, as storage.iter_route_history yields them.
+    :param min_count: Prefixes are reported when a counter goes over this value.
+    :return: ChurnTracker.report
+    """
+    logger.debug("route_churn")
+    tracker = ChurnTracker()
+    for timestamp, rows in history:
+        tracker.add_checkpoint(timestamp, rows)
+    logger.info(f"Churn analysis of {len(tracker.checkpoints)} checkpoints and {len(tracker.prefixes)} prefixes")
+    return tracker.report(min_count)
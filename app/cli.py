@@ -1,7 +1,9 @@
 import argparse
+import json
 import ipaddress as ipa
 import os
 import re
+import sys
 
 import logging
 
@@ -13,6 +15,7 @@ logger = logging.getLogger()
 
 import orchestrator as orchestrator
 import formatter
+import ages
 
 
 def validate_timestamp(timestamp):
@@ -24,6 +27,14 @@ def validate_timestamp(timestamp):
     return True
 
 
+def attempts(value):
+    """argparse type of --retries, a device is tried at least once"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {number}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(description="Networks tools. Compare and Scrape")
     # main options, valid for more than one command
@@ -81,6 +92,59 @@ def main():
         help="Simulate scrape without connecting",
     )
 
+    parser_scrape.add_argument(
+        "--concurrency",
+        type=int,
+        help="Maximum number of devices scraped at the same time. Defaults to 256",
+    )
+    parser_scrape.add_argument(
+        "--per-proxy",
+        type=int,
+        help="Maximum number of devices scraped at the same time through the same proxy",
+    )
+    parser_scrape.add_argument(
+        "--per-site",
+        type=int,
+        help="Maximum number of devices scraped at the same time in the same site",
+    )
+    parser_scrape.add_argument(
+        "--stream-to",
+        metavar="DIRECTORY",
+        help="Write the outputs to a file per device in DIRECTORY while they are read, instead of keeping them in memory until the scrape ends",
+    )
+    parser_scrape.add_argument(
+        "--compress",
+        choices=["gzip", "xz", "bz2", "zstd"],
+        help="Compress the files written with --stream-to",
+    )
+    parser_scrape.add_argument(
+        "--retries",
+        type=attempts,
+        default=3,
+        help="Attempts to connect to a device, with a jittered exponential wait between them. Defaults to 3",
+    )
+    parser_scrape.add_argument(
+        "--retry-delay",
+        type=float,
+        default=5.0,
+        help="Maximum wait in seconds before the first retry, doubled for every retry. Defaults to 5",
+    )
+    parser_scrape.add_argument(
+        "--ignore-breaker",
+        action="store_true",
+        help="Connect to the devices and proxies that failed in the previous runs, they are skipped until their cooldown ends by default",
+    )
+    parser_scrape.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write the connect, prompt and command times of every device and their percentiles to FILE as JSON",
+    )
+    parser_scrape.add_argument(
+        "--shards",
+        type=int,
+        help="Collect the devices with SHARDS processes sharing the concurrency, balanced with the collection times of the previous runs",
+    )
+
     # Compare Command
     parser_compare = subparsers.add_parser("compare", help="Compare outputs")
     parser_compare.add_argument(
@@ -98,6 +162,30 @@ def main():
         metavar=("HOSTNAME", "SERVICE", "TIMESTAMP1", "TIMESTAMP2"),
         help="Compare routes between two timestamps",
     )
+    compare_group.add_argument(
+        "--recent",
+        nargs=3,
+        metavar=("HOSTNAME", "TIMESTAMP", "MINUTES"),
+        help="List the routes of a checkpoint (re)installed in the minutes before it",
+    )
+    compare_group.add_argument(
+        "--churn",
+        nargs=2,
+        metavar=("HOSTNAME", "SERVICE"),
+        help="Find the routes that flap, oscillate or are reinstalled over all the checkpoints (or --start/--end)",
+    )
+    compare_group.add_argument(
+        "--matrix",
+        nargs="+",
+        metavar="HOSTNAME SERVICE TIMESTAMP",
+        help="Compare the routes of two or more timestamps side by side: HOSTNAME SERVICE TIMESTAMP1 TIMESTAMP2 [TIMESTAMP ...]",
+    )
+    compare_group.add_argument(
+        "--consistency",
+        nargs="+",
+        metavar="SERVICE [TIMESTAMP]",
+        help="Compare the routes of a service across devices, at their latest checkpoint (at or before TIMESTAMP)",
+    )
     # compare_group.add_argument(
     #     "--load-file",
     #     nargs=4,
@@ -118,6 +206,39 @@ def main():
         type=str,
     )
 
+    parser_compare.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="--matrix only shows the routes that changed",
+    )
+    parser_compare.add_argument(
+        "--min-share",
+        type=float,
+        default=0.5,
+        help="--consistency expects a route on every device when this share of the devices has it. Defaults to 0.5",
+    )
+    parser_compare.add_argument(
+        "--ignore-next-hops",
+        action="store_true",
+        help="--consistency only compares the protocols of the routes",
+    )
+    parser_compare.add_argument(
+        "--start",
+        metavar="TIMESTAMP",
+        help="First checkpoint of the --churn analysis",
+    )
+    parser_compare.add_argument(
+        "--end",
+        metavar="TIMESTAMP",
+        help="Last checkpoint of the --churn analysis",
+    )
+    parser_compare.add_argument(
+        "--min-changes",
+        type=int,
+        default=2,
+        help="--churn reports the routes that changed more than this number of times. Defaults to 2",
+    )
+
     parser_checkpoint = subparsers.add_parser("checkpoint", help="Save a route table from device or file")
 
     checkpoint_group = (
@@ -132,8 +253,10 @@ def main():
     )
     checkpoint_group.add_argument(
         "--fetch",
-        action="store_true",
-        help="Fetch routes from a device (IP address) or a file of devices",
+        nargs="?",
+        const="all",
+        metavar="IP_ADDRESS",
+        help="Fetch routes from a device (IP address) or from all the devices of the inventory file, they are parsed and saved while the slower devices are still being scraped",
     )
     checkpoint_group.add_argument(
         "--remove",
@@ -141,6 +264,64 @@ def main():
         metavar=("HOSTNAME", "TIMESTAMP"),
         help="Remove specific compare checkpoints from the database",
     )
+    parser_checkpoint.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to parse uncompressed text files with --load-file, or the outputs of the devices with --fetch. Defaults to 1",
+    )
+    parser_checkpoint.add_argument(
+        "--timestamp",
+        help="Timestamp of the --fetch checkpoint, YYYY-MM-DD_HH:MM. Defaults to the current time",
+    )
+    parser_checkpoint.add_argument(
+        "--keep-captures",
+        metavar="DIRECTORY",
+        help="Keep the outputs of the devices of --fetch in DIRECTORY, a file per device",
+    )
+    parser_checkpoint.add_argument(
+        "--compress",
+        choices=["gzip", "xz", "bz2", "zstd"],
+        help="Compress the files of --keep-captures",
+    )
+    parser_checkpoint.add_argument(
+        "--concurrency",
+        type=int,
+        help="Maximum number of devices scraped at the same time with --fetch. Defaults to 256",
+    )
+    parser_checkpoint.add_argument(
+        "--every",
+        type=float,
+        metavar="MINUTES",
+        help="Run as a daemon, fetch a checkpoint of the inventory every MINUTES keeping the SSH sessions open between them",
+    )
+    parser_checkpoint.add_argument(
+        "--cycles",
+        type=int,
+        help="Stop the --every daemon after this number of checkpoints. Runs until interrupted by default",
+    )
+    parser_checkpoint.add_argument(
+        "--retries",
+        type=attempts,
+        default=3,
+        help="Attempts to connect to a device with --fetch, with a jittered exponential wait between them. Defaults to 3",
+    )
+    parser_checkpoint.add_argument(
+        "--retry-delay",
+        type=float,
+        default=5.0,
+        help="Maximum wait in seconds before the first retry, doubled for every retry. Defaults to 5",
+    )
+    parser_checkpoint.add_argument(
+        "--ignore-breaker",
+        action="store_true",
+        help="Connect to the devices and proxies that failed in the previous runs, they are skipped until their cooldown ends by default",
+    )
+    parser_checkpoint.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write the connect, prompt and command times of every device of --fetch and their percentiles to FILE as JSON, rewritten every --every cycle",
+    )
     # Logging options
     logging_group = parser.add_mutually_exclusive_group()
     logging_group.add_argument(
@@ -179,6 +360,16 @@ def main():
             args.commands_file,
             args.device_filter,
             args.dry_run,
+            args.concurrency,
+            args.per_proxy,
+            args.per_site,
+            args.stream_to,
+            args.compress,
+            args.retries,
+            args.retry_delay,
+            not args.ignore_breaker,
+            args.metrics,
+            args.shards,
         )
         if args.dry_run:
             exit()
@@ -191,6 +382,12 @@ def main():
             f"Commands executed on devices: {' '.join(devices_executed)} devices"
         )
 
+        if args.stream_to:
+            for device in output_list:
+                if device.get("capture"):
+                    logger.info(f"{device.get('hostname')} outputs written to {device['capture'].get('file')}")
+            exit()
+
         output_formatter = formatter.scrape_formatter_function.get(args.scrape_output)
         tuples_list = output_formatter(output_list)
         for filename, output in tuples_list:
@@ -204,6 +401,10 @@ def main():
         if (
             not args.list
             and not args.query
+            and not args.recent
+            and not args.churn
+            and not args.matrix
+            and not args.consistency
         ):
             args.list = "all"
 
@@ -253,6 +454,105 @@ def main():
             )
             exit()
 
+        if args.recent:
+            logger.info("Listing recently installed routes")
+            hostname, timestamp, minutes = args.recent
+            if not validate_timestamp(timestamp):
+                logger.error(
+                    f"{timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
+                )
+                return
+            if not minutes.isdigit():
+                logger.error(f"{minutes} is not a number of minutes")
+                return
+            routes = orchestrator.recent_routes(hostname, timestamp, int(minutes))
+            if not routes:
+                logger.warning("No routes found")
+                return
+            for route in routes:
+                print(f"{ages.epoch_to_timestamp(route.installed_at)} {route.service} {route.route} {route.route_protocol} {route.next_hop}")
+            exit()
+
+        if args.churn:
+            logger.info("Analyzing route churn")
+            hostname, service = args.churn
+            for timestamp in (args.start, args.end):
+                if timestamp is not None and not validate_timestamp(timestamp):
+                    logger.error(
+                        f"{timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
+                    )
+                    return
+            churn_report = orchestrator.route_churn(hostname, service, args.min_changes, args.start, args.end)
+            if not churn_report["checkpoints"]:
+                logger.warning("No checkpoints found")
+                return
+            if args.compare_output == "json":
+                print(json.dumps(churn_report, indent=4))
+                exit()
+            print(f"{len(churn_report['checkpoints'])} checkpoints from {churn_report['checkpoints'][0]} to {churn_report['checkpoints'][-1]}")
+            for kind, counter in (("flapping", "changes"), ("oscillating", "next_hop_oscillations"), ("age_resets", "age_resets")):
+                print(f"{kind}: {len(churn_report[kind])} routes")
+                for summary in churn_report[kind]:
+                    print(f"    {summary['route']} {counter}={summary[counter]} next_hops={','.join(summary['next_hops'])} last_seen={summary['last_seen']}")
+            exit()
+
+        if args.matrix:
+            logger.info("Comparing routes between timestamps")
+            if len(args.matrix) < 4:
+                logger.error("--matrix needs HOSTNAME SERVICE and at least two timestamps")
+                return
+            hostname, service, *timestamps = args.matrix
+            for timestamp in timestamps:
+                if not validate_timestamp(timestamp):
+                    logger.error(
+                        f"{timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
+                    )
+                    return
+            timestamps_found, rows = orchestrator.route_matrix(hostname, service, timestamps, args.changed_only)
+            missing = set(timestamps) - set(timestamps_found)
+            if missing:
+                logger.warning(f"No routes found for {', '.join(sorted(missing))}")
+            if not timestamps_found:
+                return
+            output_formatter = formatter.matrix_formatter_function.get(args.compare_output)
+            if output_formatter is None:
+                logger.warning(f"{args.compare_output} output isn't supported by --matrix, using text")
+                output_formatter = formatter.iter_matrix_text
+            for line in output_formatter(timestamps_found, rows, hostname, service):
+                sys.stdout.write(line)
+            exit()
+
+        if args.consistency:
+            logger.info("Comparing routes across devices")
+            if len(args.consistency) > 2:
+                logger.error("--consistency needs SERVICE and optionally a TIMESTAMP")
+                return
+            service, timestamp = (args.consistency + [None])[:2]
+            if timestamp is not None and not validate_timestamp(timestamp):
+                logger.error(
+                    f"{timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
+                )
+                return
+            consistency_report = orchestrator.service_consistency(service, timestamp, args.min_share, not args.ignore_next_hops)
+            if not consistency_report["checkpoints"]:
+                logger.warning("No routes found")
+                return
+            if args.compare_output == "json":
+                print(json.dumps(consistency_report, indent=4))
+                exit()
+            print(f"SERVICE: {service}")
+            for hostname, checkpoint in consistency_report["checkpoints"].items():
+                print(f"{hostname} {checkpoint}")
+            print(f"missing: {len(consistency_report['missing'])} routes")
+            for entry in consistency_report["missing"]:
+                print(f"    {entry['route']} present on {entry['present_on']}, missing on {','.join(entry['missing_on'])}")
+            print(f"disagreements: {len(consistency_report['disagreements'])} routes")
+            for entry in consistency_report["disagreements"]:
+                print(f"    {entry['route']} {entry['majority']} on {entry['majority_devices']} devices")
+                for hostname, state in entry["differing"].items():
+                    print(f"        {hostname}: {state}")
+            exit()
+
         if args.remove:
             logger.info("Removing routes")
             hostname, timestamp = args.remove
@@ -278,10 +578,48 @@ def main():
                     f"{timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
                 )
                 return
-            orchestrator.load_routes_from_file(filename, hostname, timestamp, vendor)
+            orchestrator.load_routes_from_file(filename, hostname, timestamp, vendor, args.workers)
             logger.info(f"Loaded routes from {filename} at {timestamp}")
             exit()
 
+        if args.fetch:
+            if args.timestamp and not validate_timestamp(args.timestamp):
+                logger.error(
+                    f"{args.timestamp} is not a valid timestamp. format is YYYY-MM-DD_HH:MM"
+                )
+                return
+            fetch_options = dict(
+                timestamp=args.timestamp,
+                workers=args.workers,
+                output_directory=args.keep_captures,
+                compression=args.compress,
+                concurrency=args.concurrency,
+                retries=args.retries,
+                retry_delay=args.retry_delay,
+                use_breaker=not args.ignore_breaker,
+                metrics_file=args.metrics,
+            )
+            if args.every:
+                fetch_options.pop("timestamp")
+                ip_address = None if args.fetch == "all" else args.fetch
+                cycles = orchestrator.fetch_daemon(args.inventory_file, args.commands_file, args.every, args.cycles,
+                                                   ip_address=ip_address, **fetch_options)
+                logger.info(f"Ran {cycles} checkpoints")
+                exit()
+            if args.fetch == "all":
+                result = orchestrator.fetch_devices_from_file(args.inventory_file, args.commands_file, **fetch_options)
+            else:
+                result = orchestrator.fetch_single_device(args.fetch, args.inventory_file, args.commands_file, **fetch_options)
+            if not result:
+                logger.error("No devices fetched")
+                exit()
+            for hostname, device in result["devices"].items():
+                status = device["error"] or "OK"
+                print(f"{hostname} {device['routes']} routes {status}")
+            print(f"Checkpoint {result['timestamp']}: {result['routes']} routes of {len(result['devices'])} devices "
+                  f"in {result['total_seconds']} seconds")
+            exit()
+
 
     exit()
 
@@ -0,0 +1,195 @@
+"""
+collector.py collects the outputs of many devices with asyncio and bounded concurrency.
+
+network_interface.execute_devices_commands runs at most os.cpu_count() * 4 devices at a time,
+the sessions spend almost all their time waiting on the network, so a few thousand devices
+take many times the duration of the slowest one. The collector starts a task per device and
+limits how many run at the same time with semaphores:
+    concurrency     devices collected at the same time
+    per_proxy       devices collected at the same time through the same SOCKS proxy or jump host,
+                    without it the devices behind a jump host are limited to the channels of the
+                    bastion pool (bastions.py), the others would wait on the jump host holding slots
+    per_site        devices collected at the same time in the same site (the "site" of the device)
+A device waits for its proxy and site slots before taking a global slot, so the devices
+waiting on a busy proxy don't hold global slots other devices could use.
+
+With a backoff policy (backoff.py) the devices that fail to connect are retried by the collector,
+a single attempt at a time: the device gives back its thread and its slots while it waits its
+jittered backoff, then waits for slots again like any other device, a dead device doesn't hold a
+slot the live ones could use. A circuit breaker skips, or probes with a single attempt, the devices
+and proxies that failed in the previous runs.
+
+netmiko is blocking, each device runs network_interface.collect_device in a thread of a pool
+sized to the concurrency limit, the event loop only schedules them. The responses have the
+same format as the ones of network_interface (hostname, ip, output, error), in the order
+the devices finish. With an output sink (output_sinks.py) the outputs are streamed to it as they
+are read and the responses only have their metadata, the memory doesn't grow with the fleet.
+"""
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import logging
+import time
+
+import backoff
+import bastions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 256
+
+
+def _proxy_key(device: dict):
+    proxy = device.get("proxy")
+    if proxy:
+        return proxy.get("addr"), proxy.get("port")
+    jump_host = device.get("jump_host")
+    if jump_host:
+        return jump_host.get("host"), jump_host.get("port", 22)
+    return None
+
+
+class ConcurrencyLimits:
+    """The semaphores limiting the devices collected at the same time, globally, per proxy and per site"""
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, per_proxy: int = None, per_site: int = None):
+        self.concurrency = concurrency
+        self.per_proxy = per_proxy
+        self.per_site = per_site
+        self._global = asyncio.Semaphore(concurrency)
+        self._proxies = {}
+        self._sites = {}
+
+    def semaphores(self, device: dict) -> list:
+        """The semaphores a device must acquire, in the order they must be acquired"""
+        semaphores = []
+        proxy = _proxy_key(device)
+        per_proxy = self.per_proxy
+        if not per_proxy and device.get("jump_host"):
+            pool = bastions.get_bastion_pool()
+            per_proxy = pool.transports_per_bastion * pool.channels_per_transport
+        if per_proxy and proxy is not None:
+            semaphores.append(self._proxies.setdefault(proxy, asyncio.Semaphore(per_proxy)))
+        site = device.get("site")
+        if self.per_site and site is not None:
+            semaphores.append(self._sites.setdefault(site, asyncio.Semaphore(self.per_site)))
+        semaphores.append(self._global)
+        return semaphores
+
+
+def _error_response(device: dict, error: str) -> dict:
+    return {"hostname": device.get("hostname"), "ip": device.get("ip"), "output": {}, "error": error}
+
+
+async def collect_devices_async(devices: list, concurrency: int = DEFAULT_CONCURRENCY, per_proxy: int = None,
+                                per_site: int = None, collect_function=None, sink=None, on_response=None,
+                                backoff_policy: backoff.BackoffPolicy = None, circuit_breaker: backoff.CircuitBreaker = None) -> list:
+    """
+    Collects the devices, see collect_devices
+    """
+    logger.debug("collect_devices_async")
+    if collect_function is None:
+        import network_interface
+        collect_function = network_interface.collect_device
+    if sink is not None:
+        collect_function = functools.partial(collect_function, sink=sink)
+    loop = asyncio.get_running_loop()
+    limits = ConcurrencyLimits(concurrency, per_proxy, per_site)
+    retry_budget = backoff.RetryBudget(len(devices))
+
+    async def collect_once(executor, device):
+        """(response, seconds waiting for the concurrency slots)"""
+        queued = time.perf_counter()
+        async with contextlib.AsyncExitStack() as stack:
+            for semaphore in limits.semaphores(device):
+                await stack.enter_async_context(semaphore)
+            queue_seconds = time.perf_counter() - queued
+            device_dict = dict(device)
+            device_dict.pop("site", None)
+            if backoff_policy is not None:
+                device_dict["connect_attempts"] = 1
+            try:
+                return await loop.run_in_executor(executor, collect_function, device_dict), queue_seconds
+            except Exception as exc:
+                logger.error(f"hostname: {device.get('hostname')}, ip: {device.get('ip')}, Unknown error collecting the device")
+                logger.debug(f"hostname: {device.get('hostname')}, ip: {device.get('ip')}, Unknown error collecting the device", exc_info=exc)
+                return _error_response(device, "UnknownError"), queue_seconds
+
+    async def collect_device(executor, device):
+        attempts = backoff_policy.max_attempts if backoff_policy is not None else 1
+        if circuit_breaker is not None:
+            decision, key = circuit_breaker.check(device)
+            if decision == circuit_breaker.SKIP:
+                logger.warning(f"hostname: {device.get('hostname')}, ip: {device.get('ip')}, skipped, the circuit of {key} is open")
+                return _error_response(device, f"CircuitOpen:{key}")
+            if decision == circuit_breaker.PROBE:
+                logger.info(f"hostname: {device.get('hostname')}, ip: {device.get('ip')}, probing {key} with a single attempt")
+                attempts = 1
+        # the metrics of the attempts are added up in the metrics of the response (see metrics.py)
+        connect_metrics = []
+        seconds = {"total_seconds": 0.0, "queue_seconds": 0.0, "backoff_seconds": 0.0}
+        for attempt in range(attempts):
+            if attempt:
+                delay = backoff_policy.delay(attempt - 1)
+                logger.info(f"hostname: {device.get('hostname')}, ip: {device.get('ip')}, retry {attempt} in {delay:.1f} seconds")
+                seconds["backoff_seconds"] += delay
+                await asyncio.sleep(delay)
+            response, queue_seconds = await collect_once(executor, device)
+            seconds["queue_seconds"] += queue_seconds
+            metrics = (response or {}).get("metrics")
+            if metrics is not None:
+                connect_metrics.extend(metrics.get("connect", []))
+                seconds["total_seconds"] += metrics.get("total_seconds", 0.0)
+            if response is None or not backoff.is_retryable(response) or attempt == attempts - 1 or not retry_budget.take():
+                break
+        if metrics is not None:
+            for number, attempt_metrics in enumerate(connect_metrics):
+                attempt_metrics["attempt"] = number
+            metrics["connect"] = connect_metrics
+            metrics["collector_attempts"] = attempt + 1
+            metrics.update((name, round(value, 3)) for name, value in seconds.items())
+        if circuit_breaker is not None and response is not None:
+            circuit_breaker.record(device, response)
+        return response
+
+    responses = []
+    if not devices:
+        return responses
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(concurrency, len(devices))) as executor:
+        tasks = [asyncio.create_task(collect_device(executor, device)) for device in devices]
+        for task in asyncio.as_completed(tasks):
+            response = await task
+            if response is not None:
+                responses.append(response)
+                if on_response is not None:
+                    on_response(response)
+    return responses
+
+
+def collect_devices(devices: list, concurrency: int = DEFAULT_CONCURRENCY, per_proxy: int = None,
+                    per_site: int = None, collect_function=None, sink=None, on_response=None,
+                    backoff_policy: backoff.BackoffPolicy = None, circuit_breaker: backoff.CircuitBreaker = None) -> list:
+    """
+    Connects to the devices and sends their commands, with bounded concurrency.
+    :param devices: The device dictionaries, in the format of network_interface, optionally with a "site".
+    :param concurrency: Maximum number of devices collected at the same time.
+    :param per_proxy: Maximum number of devices collected at the same time through the same proxy, no limit when None
+        but the channels of the bastion pool for the jump hosts.
+    :param per_site: Maximum number of devices collected at the same time in the same site, no limit when None.
+    :param collect_function: Collects a device and returns its response, network_interface.collect_device when None.
+    :param sink: An output_sinks.OutputSink the outputs are streamed to, passed to collect_function.
+    :param on_response: Called with every response as soon as its device is collected, from the event loop.
+    :param backoff_policy: The attempts to connect a device and the waits between them, the collector retries
+        the devices. When None a single attempt is made, collect_function makes its own retries.
+    :param circuit_breaker: Skips or probes the devices and proxies that failed before, counts the failures.
+    :return: The list of response dictionaries.
+    """
+    logger.debug("collect_devices")
+    start = time.perf_counter()
+    responses = asyncio.run(collect_devices_async(devices, concurrency, per_proxy, per_site, collect_function, sink, on_response,
+                                                    backoff_policy, circuit_breaker))
+    logger.info(f"Collected {len(responses)} devices in {time.perf_counter() - start:.2f} seconds "
+                f"(concurrency {concurrency}, per proxy {per_proxy}, per site {per_site})")
+    return responses
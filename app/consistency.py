@@ -0,0 +1,125 @@
+"""
+consistency.py compares the routes of a service across the devices that carry it.
+
+In an L3VPN every PE of a service should have about the same remote prefixes. The check takes
+one checkpoint per device (storage.get_latest_checkpoints) and reports:
+    missing         prefixes most devices have (min_share of them) but some don't
+    disagreements   prefixes with different protocols or next hops on some devices than on most of them
+
+Prefixes are compared by their binary prefix_key (see prefixes.py), the routes that have no key
+(e.g. BGP route distinguisher prefixes) by their text. Hundreds of devices with tens of thousands
+of routes each don't fit in memory as per device tables, so the devices are read one at a time
+and compared against a reference, the state each prefix had on the first device that had it.
+Only the differences are kept, computed with set operations (run in C) over the prefixes and the
+(prefix, state) items of each device:
+    absent      prefixes known before the device was read that the device doesn't have; the
+                prefixes first seen later are missing on every device read before them
+    deviations  prefixes whose state isn't the reference one
+"""
+
+import logging
+
+import prefixes
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("route", "prefix_key", "route_protocol", "next_hop")
+
+
+def _route_name(key) -> str:
+    return prefixes.prefix_from_key(key) if key.__class__ is bytes else key
+
+
+def _device_states(rows, compare_next_hops: bool) -> dict:
+    """
+    {prefix key: state} of the routes of a device, the state is (route_protocol, next_hop),
+    or a sorted tuple of them with ECMP
+    """
+    states = {}
+    ecmp = {}
+    for route, prefix_key, route_protocol, next_hop in rows:
+        key = route if prefix_key is None else prefix_key
+        state = (route_protocol, next_hop if compare_next_hops else None)
+        if key in states:
+            ecmp.setdefault(key, {states[key]}).add(state)
+        else:
+            states[key] = state
+    for key, entries in ecmp.items():
+        states[key] = entries.pop() if len(entries) == 1 else tuple(sorted(entries, key=str))
+    return states
+
+
+def format_state(state: tuple) -> str:
+    entries = state if state[0].__class__ is tuple else (state,)
+    return ";".join(" ".join(str(value) for value in entry if value is not None) for entry in entries)
+
+
+def service_consistency(devices, min_share: float = 0.5, compare_next_hops: bool = True) -> dict:
+    """
+    Compares the routes of a service across devices.
+    :param devices: (hostname, rows) per device, the rows are tuples of FIELDS.
+    :param min_share: A prefix is expected on every device when at least this share of the devices has it.
+    :param compare_next_hops: Compare the next hops as well as the protocols.
+    :return: {"devices": [hostnames], "missing": [...], "disagreements": [...]}, the prefixes missing on
+        more devices and the ones with more disagreeing devices first.
+    """
+    logger.debug("service_consistency")
+    hostnames = []
+    # prefix key: state on the first device that had it
+    reference = {}
+    # prefix key: index of the first device that had it
+    first_device = {}
+    # prefix key: [indexes of the devices], for the prefixes known when the device was read
+    absent_on = {}
+    # prefix key: {index of the device: state}
+    deviations = {}
+    for index, (hostname, rows) in enumerate(devices):
+        hostnames.append(hostname)
+        states = _device_states(rows, compare_next_hops)
+        for key in reference.keys() - states.keys():
+            absent_on.setdefault(key, []).append(index)
+        for key, state in states.items() - reference.items():
+            if key in reference:
+                deviations.setdefault(key, {})[index] = state
+            else:
+                reference[key] = state
+                first_device[key] = index
+    logger.info(f"Consistency of {len(hostnames)} devices and {len(reference)} prefixes")
+
+    def missing_devices(key):
+        return list(range(first_device[key])) + absent_on.get(key, [])
+
+    missing = []
+    for key in reference:
+        if not first_device[key] and key not in absent_on:
+            continue
+        devices_missing = missing_devices(key)
+        present_on = len(hostnames) - len(devices_missing)
+        if present_on >= min_share * len(hostnames):
+            missing.append({
+                "route": _route_name(key),
+                "present_on": present_on,
+                "missing_on": sorted(hostnames[device] for device in devices_missing),
+            })
+    missing.sort(key=lambda entry: (-len(entry["missing_on"]), entry["route"]))
+
+    disagreements = []
+    for key, deviating in deviations.items():
+        devices_by_state = {}
+        for device, state in deviating.items():
+            devices_by_state.setdefault(state, []).append(device)
+        not_reference = set(deviating).union(missing_devices(key))
+        devices_by_state[reference[key]] = [device for device in range(len(hostnames)) if device not in not_reference]
+        majority_state, majority_devices = max(devices_by_state.items(), key=lambda item: (len(item[1]), format_state(item[0])))
+        disagreements.append({
+            "route": _route_name(key),
+            "majority": format_state(majority_state),
+            "majority_devices": len(majority_devices),
+            "differing": {
+                hostnames[device]: format_state(state)
+                for state, devices in devices_by_state.items() if state != majority_state
+                for device in sorted(devices)
+            },
+        })
+    disagreements.sort(key=lambda entry: (-len(entry["differing"]), entry["route"]))
+    return {"devices": hostnames, "missing": missing, "disagreements": disagreements}
@@ -0,0 +1,202 @@
+"""
+fetch.py takes a checkpoint of many devices in one run: scrape, parse and save as a pipeline.
+
+    collector (thread) -> capture per device -> parse worker processes -> writer (calling thread): save
+
+The devices are collected by collector.py, their outputs are streamed to a capture file per device
+(output_sinks.FileSink). As soon as a device is collected its capture is handed to a pool of parse
+processes, and as soon as a capture is parsed its routes are saved by the writer, the only one
+using the database (the SQLite connection can only be used by the thread that created it). The
+first devices are parsed and saved while the slow ones are still sending their outputs, the run
+takes about the time of the slowest device plus the parse and save of its routes.
+
+All the routes are saved with the same checkpoint timestamp, taken when the run starts.
+The devices whose route table output was cut short (a read timeout or a disconnect) aren't saved,
+a partial table would be compared as a checkpoint where the routes not read were withdrawn.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import queue
+import tempfile
+import threading
+import time
+
+import ages
+
+logger = logging.getLogger(__name__)
+
+_END_OF_RESULTS = None
+
+
+def parser_vendor(device_type: str) -> str:
+    """The netparser vendor of a netmiko device_type (e.g. nokia for nokia_sros), None if there is no parser"""
+    import netparser
+
+    if not device_type:
+        return None
+    for vendor in (device_type, device_type.split("_")[0]):
+        if netparser.VENDOR_PARSERS.get(vendor.lower()):
+            return vendor
+    return None
+
+
+def _parse_capture(vendor: str, filename: str, hostname: str, timestamp: str) -> tuple:
+    """Runs in a parse worker process, returns (routes, parse statistics) of the capture of a device"""
+    import file_operations
+    import netparser
+
+    stats = netparser.ParseStats()
+    with file_operations.open_capture(filename) as stream:
+        routes = [
+            route
+            for batch in netparser.iter_parse_sections(vendor, stream, hostname, timestamp, stats=stats)
+            for route in batch
+        ]
+    return routes, stats
+
+
+def _parsed_commands(vendor: str, commands: list) -> list:
+    """The commands of a device whose outputs are parsed"""
+    import netparser
+
+    if vendor is None:
+        return []
+    return [command for command in commands or [] if netparser.get_parser_entry(vendor, command=command) is not None]
+
+
+def _incomplete_commands(response: dict, commands: list) -> list:
+    """The parsed commands whose output was cut short (ReadTimeout:<command>, Disconnected:<command>) or never read"""
+    error = response.get("error", "")
+    characters = response.get("capture", {}).get("characters", {})
+    return [command for command in commands if f":{command}," in error or command not in characters]
+
+
+def _device_result(response: dict) -> dict:
+    return {"error": response.get("error", ""), "file": response.get("capture", {}).get("file"), "routes": 0}
+
+
+def fetch_checkpoint(devices: list, save_routes, save_parse_stats=None, timestamp: str = None, output_directory: str = None,
+                     compression: str = None, workers: int = 1, concurrency: int = None, per_proxy: int = None,
+                     per_site: int = None, collect_function=None, backoff_policy=None, circuit_breaker=None) -> dict:
+    """
+    Collects the devices and saves their routes as a single checkpoint.
+    :param devices: The device dictionaries, see yaml_operations.generate_device_list.
+    :param save_routes: Called with (timestamp, routes) for the routes of every device, e.g. storage.save_routes.
+    :param save_parse_stats: Called with (hostname, timestamp, stats, source) for every device parsed.
+    :param timestamp: The checkpoint timestamp, the current time when None.
+    :param output_directory: The captures of the devices are kept in this directory, in a temporary one when None.
+    :param compression: Compression of the captures, gzip, xz, bz2 or zstd.
+    :param workers: Number of parse processes.
+    :param concurrency: Maximum number of devices collected at the same time, collector.DEFAULT_CONCURRENCY when None.
+    :param per_proxy: Maximum number of devices collected at the same time through the same proxy.
+    :param per_site: Maximum number of devices collected at the same time in the same site.
+    :param collect_function: Collects a device, network_interface.collect_device when None.
+    :param backoff_policy: The retries of the devices that fail to connect, see collector.collect_devices.
+    :param circuit_breaker: Skips or probes the devices and proxies that failed before, see collector.collect_devices.
+    :return: {"timestamp": timestamp, "devices": {hostname: {"error", "file", "routes"}}, "routes": n,
+        "collect_seconds": n, "total_seconds": n, "metrics": summary of the collection (see metrics.summarize)}
+    """
+    logger.debug("fetch_checkpoint")
+    import collector
+    import metrics
+    import output_sinks
+
+    timestamp = timestamp or time.strftime(ages.TIMESTAMP_FORMAT)
+    vendors = {device.get("hostname"): parser_vendor(device.get("device_type")) for device in devices}
+    # collect_device removes the commands from the device dictionaries
+    parsed_commands = {device.get("hostname"): _parsed_commands(vendors[device.get("hostname")], device.get("commands"))
+                       for device in devices}
+    temporary_directory = None
+    if output_directory is None:
+        temporary_directory = tempfile.TemporaryDirectory(prefix="checkpoint-")
+        output_directory = temporary_directory.name
+    sink = output_sinks.FileSink(output_directory, compression)
+
+    results = queue.Queue()
+    device_results = {}
+    responses = []
+    collect_seconds = None
+    collect_error = None
+    start_time = time.perf_counter()
+    # the parse processes are spawned, forking while the collector threads run could copy their held locks
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def on_response(response):
+        hostname = response.get("hostname")
+        responses.append(response)
+        device_results[hostname] = _device_result(response)
+        filename = device_results[hostname]["file"]
+        if filename is None:
+            logger.error(f"hostname: {hostname}, nothing to parse, error: {response.get('error')}")
+            return
+        if vendors.get(hostname) is None:
+            logger.error(f"hostname: {hostname}, no parser for its device type")
+            device_results[hostname]["error"] += "UnsupportedVendor,"
+            return
+        incomplete = _incomplete_commands(response, parsed_commands[hostname])
+        if incomplete:
+            # a route table cut short would be saved as a checkpoint without the routes that weren't read
+            logger.error(f"hostname: {hostname}, the output of {', '.join(incomplete)} is incomplete, its routes aren't saved")
+            device_results[hostname]["error"] += "IncompleteOutput,"
+            return
+        future = executor.submit(_parse_capture, vendors[hostname], filename, hostname, timestamp)
+        future.add_done_callback(lambda future: results.put((hostname, filename, future)))
+
+    def collect():
+        nonlocal collect_seconds, collect_error
+        try:
+            collector.collect_devices(devices, concurrency or collector.DEFAULT_CONCURRENCY, per_proxy, per_site,
+                                      collect_function, sink, on_response, backoff_policy, circuit_breaker)
+            collect_seconds = time.perf_counter() - start_time
+        except Exception as exc:
+            collect_error = exc
+        finally:
+            # the callbacks of the parse jobs have run when the executor is shut down
+            executor.shutdown(wait=True)
+            results.put(_END_OF_RESULTS)
+
+    collector_thread = threading.Thread(target=collect, name="fetch-collector", daemon=True)
+    collector_thread.start()
+    total_routes = 0
+    try:
+        while True:
+            result = results.get()
+            if result is _END_OF_RESULTS:
+                break
+            hostname, filename, future = result
+            try:
+                routes, stats = future.result()
+            except Exception as exc:
+                logger.error(f"hostname: {hostname}, error parsing {filename}: {exc}")
+                logger.debug(f"hostname: {hostname}, error parsing {filename}", exc_info=exc)
+                device_results[hostname]["error"] += "ParseError,"
+                continue
+            if routes:
+                save_routes(timestamp, routes)
+            else:
+                logger.warning(f"hostname: {hostname}, no routes in {filename}")
+            if save_parse_stats is not None:
+                save_parse_stats(hostname, timestamp, stats.to_dict(), filename)
+            device_results[hostname]["routes"] = len(routes)
+            total_routes += len(routes)
+            logger.info(f"hostname: {hostname}, saved {len(routes)} routes at {timestamp}")
+    finally:
+        collector_thread.join()
+        if temporary_directory is not None:
+            temporary_directory.cleanup()
+    if collect_error is not None:
+        raise collect_error
+    total_seconds = time.perf_counter() - start_time
+
+    logger.info(f"Checkpoint {timestamp}: {total_routes} routes of {len(device_results)} devices saved in {total_seconds:.2f} seconds, "
+                f"devices collected in {collect_seconds:.2f} seconds")
+    return {
+        "timestamp": timestamp,
+        "devices": device_results,
+        "routes": total_routes,
+        "collect_seconds": round(collect_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "metrics": metrics.summarize(responses, collect_seconds),
+    }
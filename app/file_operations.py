@@ -1,5 +1,8 @@
+import io
+import itertools
 import os
 import re
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,3 +26,265 @@ def load_file_content(filename: str):
 
     logger.debug(f"File {filename} loaded successfully")
     return content
+
+
+# Compressed captures are recognized by their magic bytes, the extension is only used to warn about mismatches
+COMPRESSION_MAGIC_BYTES = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"BZh", "bz2"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+]
+COMPRESSION_EXTENSIONS = {
+    ".gz": "gzip",
+    ".xz": "xz",
+    ".bz2": "bz2",
+    ".zst": "zstd",
+}
+
+
+def detect_compression(filename: str) -> str:
+    """Returns gzip, xz, bz2 or zstd for compressed files, None for plain files"""
+    with open(filename, "rb") as f:
+        magic_bytes = f.read(6)
+    for magic, compression in COMPRESSION_MAGIC_BYTES:
+        if magic_bytes.startswith(magic):
+            return compression
+    extension = os.path.splitext(filename)[1].lower()
+    if magic_bytes and extension in COMPRESSION_EXTENSIONS:
+        logger.warning(f"File {filename} is not compressed with {COMPRESSION_EXTENSIONS[extension]}, reading it as plain text")
+    return None
+
+
+def _open_zstd(filename: str):
+    # zstd is not in the standard library before python 3.14, zstandard is an optional dependency
+    try:
+        from compression import zstd
+    except ImportError:
+        zstd = None
+    if zstd is not None:
+        return zstd.open(filename, "rt", encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError:
+        logger.error(f"File {filename} is compressed with zstd, install the zstandard package to read it")
+        raise ValueError(f"File {filename} is compressed with zstd, install the zstandard package to read it")
+    binary_file = open(filename, "rb")
+    return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(binary_file, closefd=True), encoding="utf-8")
+
+
+def open_capture(filename: str):
+    """
+    Opens a capture (scraped output) file to be read as a stream of lines.
+    Contrary to load_file_content there is no size limit, the file is never read in full.
+    gzip, xz, bz2 and zstd captures are decompressed on the fly as the stream is read,
+    they are never inflated in full, neither in memory nor on disk.
+    """
+    logger.debug("open_capture")
+
+    if not os.path.exists(filename):
+        logger.error(f"File {filename} does not exist")
+        raise FileNotFoundError(f"File {filename} does not exist")
+
+    compression = detect_compression(filename)
+    if compression is None:
+        return open(filename, "r", encoding="utf-8")
+
+    logger.debug(f"File {filename} is compressed with {compression}")
+    if compression == "gzip":
+        import gzip
+        return gzip.open(filename, "rt", encoding="utf-8")
+    if compression == "xz":
+        import lzma
+        return lzma.open(filename, "rt", encoding="utf-8")
+    if compression == "bz2":
+        import bz2
+        return bz2.open(filename, "rt", encoding="utf-8")
+    return _open_zstd(filename)
+
+
+def is_json_capture(filename: str) -> bool:
+    """Returns True if the capture contains structured (JSON) output instead of CLI text"""
+    with open_capture(filename) as f:
+        head = f.read(4096).lstrip()
+    return head[:1] in ("{", "[")
+
+
+# formatter.scrape_output_per_device writes this line before the output of every command
+COMMAND_PREFIX = "COMMAND:"
+
+
+def iter_command_sections(lines):
+    """
+    Splits a scrape capture with the outputs of several commands, yields (command, lines)
+    for the output of every command. Lines before the first COMMAND: line (or all of them
+    in a capture of a single output) are yielded with command None.
+    The sections share the underlying stream, the lines of a section are only valid until
+    the next section is requested.
+    """
+    command = None
+
+    def section_command(line):
+        nonlocal command
+        if line.startswith(COMMAND_PREFIX):
+            command = line[len(COMMAND_PREFIX):].strip()
+        return command
+
+    for section_command_name, section_lines in itertools.groupby(lines, key=section_command):
+        yield section_command_name, (line for line in section_lines if not line.startswith(COMMAND_PREFIX))
+
+
+def is_scrape_capture(filename: str) -> bool:
+    """Returns True if the capture has the outputs of several commands, separated by COMMAND: lines"""
+    with open_capture(filename) as f:
+        head = f.read(4096).lstrip()
+    return head.startswith(COMMAND_PREFIX)
+
+
+def iter_json_list_items(stream, key_pattern: str, chunk_size: int = 1024 * 1024, on_skip=None):
+    """
+    Yields one by one the items of the JSON lists whose key matches key_pattern, e.g. with
+    key_pattern "route" the items of every "route": [...] or "nokia-state:route": [...] list.
+    The stream is read chunk_size characters at a time and only the current item is decoded,
+    so memory stays bounded no matter the size of the file.
+    The text skipped while searching for a list is passed to on_skip(text), when given, in pieces that
+    end after a delimiter (",", a bracket, a brace or a line break) whenever the skipped text has one.
+    """
+    decoder = json.JSONDecoder()
+    list_start = re.compile(r'"(?:[\w\-]+:)?(?:' + key_pattern + r')"\s*:\s*\[')
+    buffer = ""
+    position = 0
+    in_list = False
+    eof = False
+
+    while True:
+        if not in_list:
+            match = list_start.search(buffer, position)
+            if match is None:
+                if eof:
+                    return
+                # keep the tail of the buffer, the key can be split between two reads, and from its last
+                # delimiter on, the text given to on_skip doesn't end in the middle of a key or a value
+                keep = max(position, len(buffer) - 256)
+                boundary = max(buffer.rfind(delimiter, position, keep) for delimiter in ",{}[]\n")
+                if boundary >= position:
+                    keep = boundary + 1
+                if on_skip:
+                    on_skip(buffer[position:keep])
+                position = keep
+            else:
+                if on_skip:
+                    on_skip(buffer[position:match.start()])
+                position = match.end()
+                in_list = True
+                continue
+        else:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                if buffer[position] == "]":
+                    position += 1
+                    in_list = False
+                    continue
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # the item is incomplete, read more from the stream and try again
+                    if eof:
+                        raise
+                else:
+                    yield item
+                    continue
+            elif eof:
+                return
+
+        data = stream.read(chunk_size)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
+
+
+class MappedCapture:
+    """
+    Memory mapped view of an uncompressed capture, to be used as a context manager:
+
+        with MappedCapture(filename) as capture:
+            for line in capture.iter_lines():
+                ...
+
+    The file is never copied into a python string, pages are loaded by the OS as they are read
+    and lines are decoded lazily, a chunk at a time, straight from the mapped pages through a
+    memoryview (slicing the mmap would copy every chunk into a bytes object first). Parallel parse workers can each map the same
+    file and read their own slice, given by split_offsets, instead of receiving a copy of it.
+    """
+
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._file = None
+        self.buffer = b""
+
+    def __enter__(self):
+        import mmap
+
+        if not os.path.exists(self.filename):
+            logger.error(f"File {self.filename} does not exist")
+            raise FileNotFoundError(f"File {self.filename} does not exist")
+        if detect_compression(self.filename):
+            raise ValueError(f"File {self.filename} is compressed and can't be memory mapped, use open_capture")
+        self._file = open(self.filename, "rb")
+        if os.path.getsize(self.filename) > 0:
+            self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, *exc_info):
+        if not isinstance(self.buffer, bytes):
+            self.buffer.close()
+        self.buffer = b""
+        self._file.close()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def iter_lines(self, start: int = 0, end: int = None):
+        """Yields the decoded lines between the offsets start and end"""
+        buffer = self.buffer
+        end = len(buffer) if end is None else end
+        position = start
+        while position < end:
+            chunk_end = min(position + self.CHUNK_SIZE, end)
+            if chunk_end < end:
+                # extend the chunk to the end of the line
+                newline = buffer.find(b"\n", chunk_end, end)
+                chunk_end = end if newline == -1 else newline + 1
+            # the view is released before the lines are yielded, the mmap can be closed by __exit__
+            # even when the caller stops iterating early
+            with memoryview(buffer) as view:
+                text = str(view[position:chunk_end], "utf-8")
+            yield from text.splitlines(keepends=True)
+            position = chunk_end
+
+    def split_offsets(self, parts: int) -> list:
+        """
+        Splits the capture in about parts slices of the same size, returns a list of (start, end) offsets.
+        Slices are cut before a line that doesn't start with a space, table entries continue
+        on lines that start with spaces so an entry is never split between two slices.
+        """
+        buffer = self.buffer
+        size = len(buffer)
+        offsets = [0]
+        for part in range(1, parts):
+            position = max(size * part // parts, offsets[-1])
+            while position < size:
+                newline = buffer.find(b"\n", position)
+                if newline == -1:
+                    position = size
+                    break
+                position = newline + 1
+                if buffer[position:position + 1] not in (b" ", b"\t"):
+                    break
+            if position > offsets[-1]:
+                offsets.append(position)
+        offsets.append(size)
+        return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
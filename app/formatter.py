@@ -71,6 +71,10 @@ def output_csv(route_result, hostname, service, timestamp1, timestamp2):
     print("",file=stream)
     return stream.getvalue()
 
+def _plain_route_result(route_result):
+    """Converts the routes (RouteRecord or dict) of a compare result into plain dictionaries"""
+    return {key: [dict(route) for route in routes] for key, routes in route_result.items()}
+
 def output_json(route_result, hostname, service, timestamp1, timestamp2):
     logger.debug("output_json")
     import json
@@ -79,7 +83,7 @@ def output_json(route_result, hostname, service, timestamp1, timestamp2):
         stream = io.StringIO("No routes found")
         return stream.getvalue()
     
-    print(json.dumps(route_result, indent=4),file=stream)
+    print(json.dumps(_plain_route_result(route_result), indent=4),file=stream)
     return stream.getvalue()
 
 def output_yaml(route_result, hostname, service, timestamp1, timestamp2):
@@ -90,7 +94,7 @@ def output_yaml(route_result, hostname, service, timestamp1, timestamp2):
         stream = io.StringIO("No routes found")
         return stream.getvalue()
 
-    print(yaml.safe_dump(route_result, default_flow_style=False),file=stream)
+    print(yaml.safe_dump(_plain_route_result(route_result), default_flow_style=False),file=stream)
     return stream.getvalue()
 
 
@@ -152,6 +156,51 @@ def scrape_output_single_file(output_list):
 
 
 
+def iter_matrix_text(timestamps, rows, hostname, service):
+    """Lines of a route matrix, a column per checkpoint with the change markers in between"""
+    logger.debug("iter_matrix_text")
+    import route_matrix
+    yield f"HOSTNAME: {hostname}\n"
+    yield f"SERVICE: {service}\n"
+    yield "route | " + " | ".join(timestamps) + "\n"
+    for row in rows:
+        columns = [route_matrix.format_state(row["states"][0]) or "-"]
+        for marker, state in zip(row["changes"], row["states"][1:]):
+            columns.append(f"{marker} {route_matrix.format_state(state) or '-'}")
+        yield f"{row['route']} | " + " | ".join(columns) + "\n"
+
+
+def iter_matrix_csv(timestamps, rows, hostname, service):
+    logger.debug("iter_matrix_csv")
+    import csv
+    import route_matrix
+    stream = io.StringIO()
+    writer = csv.writer(stream)
+    header = ["hostname", "service", "route", timestamps[0]]
+    for timestamp1, timestamp2 in zip(timestamps, timestamps[1:]):
+        header += [f"{timestamp1} -> {timestamp2}", timestamp2]
+    writer.writerow(header)
+    for row in rows:
+        columns = [hostname, service, row["route"], route_matrix.format_state(row["states"][0])]
+        for marker, state in zip(row["changes"], row["states"][1:]):
+            columns += [marker, route_matrix.format_state(state)]
+        writer.writerow(columns)
+        yield stream.getvalue()
+        stream.seek(0)
+        stream.truncate()
+
+
+def iter_matrix_json(timestamps, rows, hostname, service):
+    """JSON lines, the checkpoints first and then a line per prefix"""
+    logger.debug("iter_matrix_json")
+    import json
+    import route_matrix
+    yield json.dumps({"hostname": hostname, "service": service, "timestamps": timestamps}) + "\n"
+    for row in rows:
+        states = [route_matrix.format_state(state) if state is not None else None for state in row["states"]]
+        yield json.dumps({"route": row["route"], "states": states, "changes": row["changes"]}) + "\n"
+
+
 fommatter_function = {
     "text": output_text,
     "csv": output_csv,
@@ -164,4 +213,10 @@ scrape_formatter_function = {
     "per-device": scrape_output_per_device,
     "per-command": scrape_output_per_command,
     "single-file": scrape_output_single_file,
-}
\ No newline at end of file
+}
+
+matrix_formatter_function = {
+    "text": iter_matrix_text,
+    "csv": iter_matrix_csv,
+    "json": iter_matrix_json,
+}
@@ -0,0 +1,171 @@
+"""
+metrics.py summarizes the timings of a collection.
+
+Every response of network_interface.collect_device has the "metrics" of the device:
+{
+    "connect": [ {"attempt": n, "seconds": s, "error": error code or ""}, ... ] every attempt to connect,
+        the retries of the collector included,
+    "proxy_seconds": seconds to connect the SOCKS proxy, "jump_host_seconds": seconds to open the channel
+        through the jump host (only for the devices behind them),
+    "connect_seconds": TCP connection, SSH handshake and authentication of the attempt that connected,
+    "prompt_seconds": prompt detection and session preparation (paging, terminal width),
+    "reused": True when the session was taken from a sessions.SessionPool, there is no connect then,
+    "commands": { command: {"seconds": s, "first_byte_seconds": s, "characters": n, "error": error code or ""} },
+    "collector_attempts": attempts of the collector, "backoff_seconds": seconds waited between them,
+    "queue_seconds": seconds waiting for the concurrency slots of the collector (collector.py),
+    "total_seconds": seconds collecting the device, the attempts added up,
+}
+summarize aggregates the responses of a run into a JSON serializable summary: the devices per
+error class, the percentiles of the device, connect, prompt and command times, the characters read
+and the slowest devices, to tune the concurrency and find the slow routers.
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.5, 0.9, 0.99)
+SLOWEST_DEVICES = 10
+
+# (error class, codes of the error field), the first class with a code in the error is the class of the error
+ERROR_CLASSES = (
+    ("circuit_open", ("CircuitOpen",)),
+    ("auth", ("AuthenticationFailed",)),
+    ("jump_host", ("JumpHost",)),
+    ("proxy", ("Proxy", "SOCKS5Error")),
+    ("disconnected", ("Disconnected:",)),
+    ("read_timeout", ("ReadTimeout:",)),
+    ("connect_timeout", ("Timeout",)),
+    ("connect", ("ConnectionNotAlive", "MaximumNumberRetriesReached")),
+    ("parse", ("UnsupportedVendor", "ParseError")),
+    ("shard", ("ShardFailed",)),
+)
+
+
+def classify_error(error: str) -> str:
+    """The class of the error field of a response, "ok" when there is no error"""
+    if not error:
+        return "ok"
+    for error_class, codes in ERROR_CLASSES:
+        if any(code in error for code in codes):
+            return error_class
+    return "unknown"
+
+
+def percentile(values: list, share: float) -> float:
+    """Nearest rank percentile of the values, None when there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(share * len(ordered))) - 1))]
+
+
+def distribution(values: list) -> dict:
+    """{"count", "p50", "p90", "p99", "max"} of the values"""
+    result = {"count": len(values)}
+    for share in PERCENTILES:
+        value = percentile(values, share)
+        result[f"p{int(share * 100)}"] = round(value, 3) if value is not None else None
+    result["max"] = round(max(values), 3) if values else None
+    return result
+
+
+def summarize(responses: list, wall_seconds: float = None, slowest: int = SLOWEST_DEVICES) -> dict:
+    """
+    Summary of the metrics of the responses of a collection.
+    :param responses: The responses of network_interface.collect_device (or collector.collect_devices).
+    :param wall_seconds: Duration of the collection, for the devices per second.
+    :param slowest: Number of slowest devices reported.
+    :return: The summary, see the module documentation.
+    """
+    logger.debug("summarize")
+    errors = {}
+    device_seconds = []
+    connect_seconds = []
+    prompt_seconds = []
+    queue_seconds = []
+    connect_attempts = 0
+    retried = 0
+    reused = 0
+    commands = {}
+    devices = []
+    for response in responses:
+        error_class = classify_error(response.get("error", ""))
+        errors[error_class] = errors.get(error_class, 0) + 1
+        metrics = response.get("metrics") or {}
+        if "total_seconds" in metrics:
+            device_seconds.append(metrics["total_seconds"])
+        if "connect_seconds" in metrics:
+            connect_seconds.append(metrics["connect_seconds"])
+        if "prompt_seconds" in metrics:
+            prompt_seconds.append(metrics["prompt_seconds"])
+        if "queue_seconds" in metrics:
+            queue_seconds.append(metrics["queue_seconds"])
+        attempts = len(metrics.get("connect", []))
+        connect_attempts += attempts
+        retried += attempts > 1
+        reused += bool(metrics.get("reused"))
+        for command, command_metrics in metrics.get("commands", {}).items():
+            command_summary = commands.setdefault(command, {"seconds": [], "first_byte_seconds": [], "characters": 0, "errors": 0})
+            command_summary["seconds"].append(command_metrics.get("seconds", 0.0))
+            if command_metrics.get("first_byte_seconds") is not None:
+                command_summary["first_byte_seconds"].append(command_metrics["first_byte_seconds"])
+            command_summary["characters"] += command_metrics.get("characters", 0)
+            command_summary["errors"] += bool(command_metrics.get("error"))
+        devices.append({
+            "hostname": response.get("hostname"),
+            "error_class": error_class,
+            "total_seconds": metrics.get("total_seconds"),
+            "connect_seconds": metrics.get("connect_seconds"),
+            "prompt_seconds": metrics.get("prompt_seconds"),
+            "connect_attempts": attempts,
+            "commands": {command: command_metrics.get("seconds") for command, command_metrics in metrics.get("commands", {}).items()},
+        })
+
+    command_summaries = {}
+    for command, command_summary in commands.items():
+        seconds = sum(command_summary["seconds"])
+        command_summaries[command] = {
+            "seconds": distribution(command_summary["seconds"]),
+            "first_byte_seconds": distribution(command_summary["first_byte_seconds"]),
+            "characters": command_summary["characters"],
+            "characters_per_second": round(command_summary["characters"] / seconds, 1) if seconds else None,
+            "errors": command_summary["errors"],
+        }
+    devices.sort(key=lambda device: device["total_seconds"] or 0.0, reverse=True)
+    summary = {
+        "devices": len(responses),
+        "wall_seconds": round(wall_seconds, 3) if wall_seconds is not None else None,
+        "devices_per_second": round(len(responses) / wall_seconds, 3) if wall_seconds else None,
+        "errors": errors,
+        "connect_attempts": connect_attempts,
+        "retried_devices": retried,
+        "reused_sessions": reused,
+        "device_seconds": distribution(device_seconds),
+        "connect_seconds": distribution(connect_seconds),
+        "prompt_seconds": distribution(prompt_seconds),
+        "queue_seconds": distribution(queue_seconds),
+        "characters": sum(command_summary["characters"] for command_summary in commands.values()),
+        "commands": command_summaries,
+        "slowest_devices": devices[:slowest],
+    }
+    return summary
+
+
+def format_summary(summary: dict) -> str:
+    """One line of the summary for the logs"""
+    device_seconds = summary["device_seconds"]
+    errors = ", ".join(f"{error_class} {count}" for error_class, count in sorted(summary["errors"].items()))
+    slowest = summary["slowest_devices"][0]["hostname"] if summary["slowest_devices"] else None
+    return (f"{summary['devices']} devices ({errors}), device time p50 {device_seconds['p50']}s p99 {device_seconds['p99']}s "
+            f"max {device_seconds['max']}s (slowest {slowest}), {summary['connect_attempts']} connect attempts")
+
+
+def write_summary(summary: dict, filename: str):
+    """Writes the summary as JSON"""
+    logger.debug("write_summary")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4)
+        f.write("\n")
+    logger.info(f"Metrics of the collection written to {filename}")
@@ -1,32 +1,350 @@
 """
 Module to parse network unstructured output.
 This is the interface to the grammar files.
+
+Vendor parsers are registered with register_parser, by vendor name and by the commands
+they handle. Only the name of the parser module is registered, the module is imported
+(and its grammar built) the first time the parser is used, so registering more vendors
+doesn't add startup time to the runs that don't use them.
+
+Each parser declares the modes it supports:
+    streaming: the module has an iter_* function that parses an iterable of lines in chunks
+    parallel: independent chunks of the output can be parsed in different processes
+
+Parsers receive a ParseStats object and count in it the lines they scanned, matched and
+skipped, so a route the grammar doesn't know is reported instead of silently dropped.
+
+The prefixes of the records are normalized as they are created (see prefixes.py), and
+their ages converted to seconds and install times (see ages.py).
 """
 
-import nokia.grammar as nokia_parser
+import importlib
+import logging
+import re
+
+import ages
+import prefixes
+from route_record import RouteRecord
+
+logger = logging.getLogger(__name__)
+
+
+class ParseStats:
+    """Coverage of a parse, how many lines were scanned and what happened to them"""
+
+    __slots__ = ("lines_scanned", "entries_matched", "skipped_in_table", "skipped_outside_table",
+                 "rejected", "rejected_samples", "titles")
+
+    MAX_REJECTED_SAMPLES = 10
+
+    def __init__(self):
+        self.lines_scanned = 0
+        self.entries_matched = 0
+        # lines inside table bodies the entry grammar didn't match
+        self.skipped_in_table = 0
+        # banners, legends, headers, footers and separators
+        self.skipped_outside_table = 0
+        # skipped table lines that start an entry, likely a route the grammar doesn't know
+        self.rejected = 0
+        self.rejected_samples = []
+        # title lines of the tables, they are in the table text but aren't entries
+        self.titles = set()
+
+    def add_rejected(self, line: str):
+        self.rejected += 1
+        if len(self.rejected_samples) < self.MAX_REJECTED_SAMPLES:
+            self.rejected_samples.append(line.rstrip())
+
+    def merge(self, other: "ParseStats"):
+        self.lines_scanned += other.lines_scanned
+        self.entries_matched += other.entries_matched
+        self.skipped_in_table += other.skipped_in_table
+        self.skipped_outside_table += other.skipped_outside_table
+        self.rejected += other.rejected
+        self.rejected_samples.extend(other.rejected_samples[:self.MAX_REJECTED_SAMPLES - len(self.rejected_samples)])
+        self.titles |= other.titles
+
+    def to_dict(self) -> dict:
+        return {
+            "lines_scanned": self.lines_scanned,
+            "entries_matched": self.entries_matched,
+            "skipped_in_table": self.skipped_in_table,
+            "skipped_outside_table": self.skipped_outside_table,
+            "rejected": self.rejected,
+            "rejected_samples": list(self.rejected_samples),
+        }
+
+    def __str__(self):
+        return (
+            f"parse coverage: {self.lines_scanned} lines scanned, {self.entries_matched} entries matched, "
+            f"{self.skipped_in_table} lines skipped in tables, {self.skipped_outside_table} outside tables, "
+            f"{self.rejected} rejected"
+        )
+
+
+class ParserEntry:
+    """A registered parser, the parser module is imported the first time it is used"""
+
+    __slots__ = ("vendor", "module_name", "commands", "table", "streaming", "parallel",
+                 "input_format", "parse_function", "iter_function", "_module")
+
+    def __init__(
+        self,
+        vendor: str,
+        module_name: str,
+        commands: list = (),
+        table: str = "route",
+        streaming: bool = False,
+        parallel: bool = False,
+        input_format: str = "text",
+        parse_function: str = "parse_output",
+        iter_function: str = "iter_parse_output",
+    ):
+        self.vendor = vendor
+        self.module_name = module_name
+        self.commands = [re.compile(command, re.IGNORECASE) for command in commands]
+        self.table = table
+        self.streaming = streaming
+        self.parallel = parallel
+        self.input_format = input_format
+        self.parse_function = parse_function
+        self.iter_function = iter_function
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            # Parser modules are named relative to this module, e.g. "nokia.grammar"
+            module_name = f"{__package__}.{self.module_name}" if __package__ else self.module_name
+            logger.debug(f"Loading parser module {module_name} for vendor {self.vendor}")
+            self._module = importlib.import_module(module_name)
+        return self._module
+
+    def handles(self, command: str) -> bool:
+        command = " ".join(command.split())
+        return any(pattern.match(command) for pattern in self.commands)
+
+    def parse(self, raw_output: str, **kwargs):
+        return getattr(self.module, self.parse_function)(raw_output, **kwargs)
+
+    def iter_parse(self, lines, *args, **kwargs):
+        if not self.streaming:
+            raise ValueError(f"Parser {self.module_name} for {self.vendor} doesn't support streaming")
+        return getattr(self.module, self.iter_function)(lines, *args, **kwargs)
+
+    def parse_service(self, raw_output: str):
+        return self.module.parse_service(raw_output)
+
+    def table_states(self, buffer, offsets: list) -> list:
+        """Region of the output at each offset, for parsers that find table regions before parsing"""
+        table_states = getattr(self.module, "table_states", None)
+        return table_states(buffer, offsets) if table_states else [None] * len(offsets)
+
+    def __repr__(self):
+        return f"ParserEntry({self.vendor}, {self.module_name}, table={self.table}, input_format={self.input_format})"
 
 
-VENDOR_PARSERS = {
-    "nokia": nokia_parser,
-    # "cisco_xe": cisco_xe_parser,
-    # "cisco_xr": cisco_xr_parser,
-}
+# vendor -> list of ParserEntry, the first entry registered for a table is the default for that table
+VENDOR_PARSERS = {}
 
-def select_parser(vendor_name):
-    return VENDOR_PARSERS.get(vendor_name.lower())
 
-def parse(vendor_name, raw_output, hostname, timestamp):
-    parser = select_parser(vendor_name)
-    if not parser:
-        raise ValueError(f"Unsupported vendor: {vendor_name}") 
+def register_parser(
+    vendor: str,
+    module_name: str,
+    commands: list = (),
+    table: str = "route",
+    streaming: bool = False,
+    parallel: bool = False,
+    input_format: str = "text",
+    **kwargs,
+) -> ParserEntry:
+    """
+    Registers a parser module for a vendor.
+    :param vendor: vendor name, as used in the inventory and the CLI (e.g. nokia)
+    :param module_name: module with the parser functions, relative to the app directory (e.g. nokia.grammar)
+    :param commands: regular expressions of the commands this parser handles
+    :param table: route or bgp, the table the parser generates
+    :param streaming: the module supports parsing an iterable of lines
+    :param parallel: chunks of the output can be parsed in separate processes
+    :param input_format: text for CLI output, json for structured output
+    :return: the ParserEntry registered
+    """
+    entry = ParserEntry(vendor.lower(), module_name, commands, table, streaming, parallel, input_format, **kwargs)
+    VENDOR_PARSERS.setdefault(entry.vendor, []).append(entry)
+    return entry
 
-    routes = parser.parse_output(raw_output)
-    service_list = parser.parse_service(raw_output)
+
+register_parser(
+    "nokia", "nokia.grammar",
+    commands=[r"show router (\S+ )?route-table"],
+    table="route", streaming=True, parallel=True,
+)
+register_parser(
+    "nokia", "nokia.grammar",
+    commands=[r"show router (\S+ )?bgp routes vpn-ipv4"],
+    table="bgp", streaming=True, parallel=False,
+    parse_function="parse_bgp_output", iter_function="iter_parse_bgp_output",
+)
+register_parser(
+    "nokia", "nokia.structured",
+    commands=[r"info json"],
+    table="route", streaming=True, parallel=False, input_format="json",
+)
+# register_parser("cisco_xr", "cisco.xr_grammar", commands=[r"show route( vrf \S+)?"], table="route")
+
+
+def get_parser_entry(vendor_name: str, command: str = None, table: str = "route", input_format: str = "text") -> ParserEntry:
+    """
+    Returns the parser registered for vendor_name.
+    If command is given the parser handling that command is returned, else the parser for table and input_format.
+    Returns None if there is no parser registered.
+    """
+    for entry in VENDOR_PARSERS.get(vendor_name.lower(), []):
+        if command is not None:
+            if entry.handles(command):
+                return entry
+        elif entry.table == table and entry.input_format == input_format:
+            return entry
+    return None
+
+
+def select_parser(vendor_name, command=None):
+    entry = get_parser_entry(vendor_name, command)
+    return entry.module if entry else None
+
+
+def _to_records(entries, hostname, service, timestamp):
+    """RouteRecords of the entries of a parser, with their prefixes and ages normalized"""
+    records = [
+        RouteRecord.from_parse_results(route, hostname=hostname, service=service, timestamp=timestamp)
+        for route in entries
+    ]
+    prefixes.normalize_routes(records)
+    return ages.normalize_routes(records, timestamp)
+
+
+def parse(vendor_name, raw_output, hostname, timestamp, command=None, input_format="text", stats=None):
+    entry = get_parser_entry(vendor_name, command, input_format=input_format)
+    if not entry:
+        raise ValueError(f"Unsupported vendor: {vendor_name}")
+
+    service_list = entry.parse_service(raw_output)
     service = service_list[0].get('service_name') if service_list else None
 
-    for route in routes:
-        route['hostname'] = hostname
-        route['service'] = service
-        route['timestamp'] = timestamp
+    return _to_records(entry.parse(raw_output, stats=stats), hostname, service, timestamp)
+
+
+def iter_parse(vendor_name, lines, hostname, timestamp, command=None, input_format="text", **kwargs):
+    """
+    Streaming version of parse, lines is an iterable of lines (e.g. an open file).
+    Yields lists of RouteRecord, one list for every chunk parsed.
+    The keyword arguments are passed to the parser, e.g. stats=ParseStats().
+    """
+    entry = get_parser_entry(vendor_name, command, input_format=input_format)
+    if not entry:
+        raise ValueError(f"Unsupported vendor: {vendor_name}")
+
+    for service, entries in entry.iter_parse(lines, **kwargs):
+        yield _to_records(entries, hostname, service, timestamp)
+
+
+def iter_parse_sections(vendor_name, lines, hostname, timestamp, tables=("route",), **kwargs):
+    """
+    Streaming parse of a scrape capture with the outputs of several commands (see
+    file_operations.iter_command_sections), in a single pass every output is parsed by
+    the parser registered for its command. Outputs of commands without a text parser for
+    one of tables are skipped. A capture without COMMAND: lines is parsed as iter_parse does.
+    Yields lists of RouteRecord, one list for every chunk parsed.
+    """
+    import file_operations
+
+    if not VENDOR_PARSERS.get(vendor_name.lower()):
+        raise ValueError(f"Unsupported vendor: {vendor_name}")
+
+    for command, section_lines in file_operations.iter_command_sections(lines):
+        entry = get_parser_entry(vendor_name, command)
+        if entry is None or entry.table not in tables or entry.input_format != "text" or not entry.streaming:
+            logger.info(f"Skipping output of '{command}', no {'/'.join(tables)} parser for {vendor_name}")
+            continue
+        logger.debug(f"Parsing output of '{command}' with {entry}")
+        for service, entries in entry.iter_parse(section_lines, **kwargs):
+            yield _to_records(entries, hostname, service, timestamp)
+
+
+def _parse_capture_slice(vendor_name, table, filename, start, end, table_state):
+    """Runs in a worker process, parses a slice of a memory mapped capture, returns (results, stats)"""
+    import file_operations
+
+    entry = get_parser_entry(vendor_name, table=table)
+    results = []
+    stats = ParseStats()
+    with file_operations.MappedCapture(filename) as capture:
+        lines = capture.iter_lines(start, end)
+        for service, entries in entry.iter_parse(lines, table_state=table_state, stats=stats):
+            results.append((
+                service,
+                [
+                    prefixes.normalize_prefix(route.get("route")) + (
+                        ages.age_to_seconds(route.get("age")),
+                        route.get("flags"), route.get("route_type"), route.get("route_protocol"),
+                        route.get("age"), route.get("preference"), route.get("next_hop"),
+                        route.get("interface_next_hop"), route.get("metric"))
+                    for route in entries
+                ],
+            ))
+    return results, stats
+
+
+def iter_parse_parallel(vendor_name, filename, hostname, timestamp, workers, table="route", slices_per_worker=4, stats=None):
+    """
+    Parallel version of iter_parse for uncompressed text captures of route tables, the
+    workers send back the fields of the route table entries only.
+    The capture is memory mapped and split on entry boundaries, every worker process maps
+    the same file and parses its slice, starting in the table region found for its offset.
+    Yields lists of RouteRecord in the order of the file, at most 2 slices per worker are
+    parsed ahead of the consumer. The statistics of the workers are merged in stats.
+    """
+    import collections
+    import concurrent.futures
+    import file_operations
+
+    if table != "route":
+        raise ValueError(f"Parallel parsing is only supported for route tables, not {table}")
+    entry = get_parser_entry(vendor_name, table=table)
+    if not entry:
+        raise ValueError(f"Unsupported vendor: {vendor_name}")
+    if not entry.parallel:
+        raise ValueError(f"Parser {entry.module_name} for {vendor_name} doesn't support parallel parsing")
+
+    with file_operations.MappedCapture(filename) as capture:
+        slices = capture.split_offsets(workers * slices_per_worker)
+        table_states = entry.table_states(capture.buffer, [start for start, _ in slices])
+    logger.debug(f"Parsing {filename} in {len(slices)} slices with {workers} workers")
+
+    # The service name is only in the header of the table, slices without it use the one of the previous slice
+    service = None
+    epoch = ages.timestamp_to_epoch(timestamp)
+
+    def to_records(slice_results):
+        nonlocal service
+        slice_results, slice_stats = slice_results
+        if stats is not None:
+            stats.merge(slice_stats)
+        for slice_service, routes in slice_results:
+            service = slice_service or service
+            yield [
+                RouteRecord(
+                    route, *fields, hostname=hostname, service=service, timestamp=timestamp, prefix_key=prefix_key,
+                    age_seconds=age_seconds, installed_at=None if age_seconds is None or epoch is None else epoch - age_seconds,
+                )
+                for route, prefix_key, age_seconds, *fields in routes
+            ]
 
-    return routes
\ No newline at end of file
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for (start, end), table_state in zip(slices, table_states):
+            pending.append(executor.submit(_parse_capture_slice, vendor_name, table, filename, start, end, table_state))
+            if len(pending) >= workers * 2:
+                yield from to_records(pending.popleft().result())
+        while pending:
+            yield from to_records(pending.popleft().result())
@@ -8,10 +8,17 @@ the script receives a list of devices with the following format:
     "username": username, 
     "password": password, 
     "proxy: : (optional) proxy to use, 
+    "jump_host": (optional) SSH jump host the device is reached through, see bastions.py,
     "commands": [ list of commands to send to the device in order of execution ], 
+    "command_options": (optional) { command: { "expect_string": regex, "read_timeout": seconds, "mode": "prompt" or "timing" } },
+    "connect_attempts": (optional) attempts to connect, 3 by default, the collector makes a single attempt and retries later,
     other arguments for netmiko : value,
 }
 
+The output of a command is read until the prompt of the device (or the expect_string of the command)
+shows up at the end of the output, only the tail of the output is searched so large outputs are read
+as fast as they arrive. Commands with "mode": "timing" are read until the output goes quiet instead.
+
 
 the script will generate a thread and on each thread will try to connect to the device and send the commands.
 the result of each thread is put into another queue and the format of the response dictionary is as follows:
@@ -20,7 +27,12 @@ the result of each thread is put into another queue and the format of the respon
     "ip" : ip address of the device,
     "output" : { comand1: output of command1, command2: output of command2, ... }
     "error" : error message if there was an error, if not then an empty string "",
+    "timing" : { command1: seconds to read the output of command1, ... }
+    "capture" : (only with an output sink) metadata of the outputs streamed to the sink, see output_sinks.py
+    "metrics" : timings of the connection and of every command, and the characters read, see metrics.py
 }
+With an output sink (output_sinks.py) the outputs are streamed to disk and/or to the parser as they
+are read, and "output" is empty.
 
 The idea of the script is to be callable from another module. 
 This script tries not to process the output in any way.
@@ -37,170 +49,449 @@ import logging
 logger = logging.getLogger(__name__)
 logger.debug(f"Starting {os.path.basename(__file__)}",)
 
-from time import sleep
-from random import random
+from time import sleep, perf_counter
 import re
 
+import paramiko
 import socks 
-from netmiko.exceptions import NetMikoAuthenticationException, NetMikoTimeoutException
+import backoff
+import bastions
+from netmiko.exceptions import NetMikoAuthenticationException, NetMikoTimeoutException, ReadTimeout
+import netmiko
 from netmiko import ConnectHandler
 
 
-# producer task
-def producer_task(devices_queue, output_queue):
-    def get_output(connection_handler, command):
-        timeout = 360
+DEFAULT_READ_TIMEOUT = 360
+CONNECT_ATTEMPTS = 3
+# wait between the attempts to connect made by connect_device, up to 5 and 10 seconds
+CONNECT_BACKOFF_DELAY = 5.0
+# wait between reads of the channel when there was no data
+READ_LOOP_DELAY = 0.01
+# characters of the previous reads searched with the new data, a prompt split between two reads is still found
+PROMPT_SEARCH_OVERLAP = 512
+# open_connection runs the steps of netmiko BaseConnection._open one by one to time them. They are
+# private methods of netmiko, checked against this version, the pin of requirements.txt is required:
+# test_network_interface fails on another netmiko until the steps are checked and the version updated.
+NETMIKO_VERSION = "4.3.0"
+NETMIKO_OPEN_STEPS = ("_modify_connection_params", "establish_connection", "_try_session_preparation")
+
+
+def _is_closed(connection_handler):
+    """True if the device closed the SSH channel of the connection, nothing else will be read"""
+    channel = getattr(connection_handler, "remote_conn", None)
+    if not isinstance(channel, paramiko.Channel):
+        return False
+    return channel.closed or (channel.eof_received and not channel.recv_ready())
+
+
+def read_until_prompt(connection_handler, command, expect_string=None, read_timeout=DEFAULT_READ_TIMEOUT, write=None, stats=None):
+    """
+    Sends a command and reads its output until the prompt, or expect_string, is at the end of it.
+    Unlike send_command, the pattern is searched in the data just read (and a few previous characters),
+    not in the whole output, and the reads don't wait when there is data, outputs of hundreds of MB
+    are read at the speed they arrive.
+    The command echo (the line with the command) and the trailing prompt (the last line, when it has the prompt
+    of the device) are stripped as the output is read, the last line is held back until the end.
+    :param connection_handler: The netmiko connection.
+    :param command: The command to send.
+    :param expect_string: Regex of the end of the output, the prompt of the device when None.
+    :param read_timeout: Seconds to wait for the end of the output, raises netmiko ReadTimeout after them.
+    :param write: Called with every piece of the output as it is read (e.g. DeviceOutput.write of
+        output_sinks), the output isn't kept in memory then.
+    :param stats: Dictionary the characters read (the echo and the prompt included) and the seconds to the
+        first character of the output ("first_byte_seconds") are set in.
+    :return: The output without the command echo and the trailing prompt, None when write is given.
+    :raises EOFError: If the device closes the connection before the end of the output.
+    """
+    if expect_string is None:
+        expect_string = re.escape(connection_handler.base_prompt)
+    pattern = re.compile(expect_string)
+    response_return = connection_handler.RESPONSE_RETURN
+    chunks = None
+    if write is None:
+        chunks = []
+        write = chunks.append
+    connection_handler.write_channel(command + connection_handler.RETURN)
+    start = perf_counter()
+    echo = ""
+    # the output from the last line break, it is written when the next line break is read
+    pending = None
+    tail = ""
+    stats = stats if stats is not None else {}
+    stats["characters"] = 0
+    stats["first_byte_seconds"] = None
+    while True:
+        new_data = connection_handler.read_channel()
+        if new_data:
+            stats["characters"] += len(new_data)
+            # the echo of the command is skipped, it could match a short expect_string, and so is what came
+            # before it, a prompt left in the channel by the session preparation isn't the end of the output
+            if pending is None:
+                echo += new_data
+                new_data = ""
+                echo_start = echo.find(command)
+                if echo_start >= 0 and response_return in echo[echo_start:]:
+                    new_data = echo[echo_start:].split(response_return, 1)[1]
+                    pending = echo = ""
+            if new_data:
+                if stats["first_byte_seconds"] is None:
+                    stats["first_byte_seconds"] = round(perf_counter() - start, 3)
+                pending += new_data
+                last_line = pending.rfind(response_return)
+                if last_line > 0:
+                    write(pending[:last_line])
+                    pending = pending[last_line:]
+                tail = tail[-PROMPT_SEARCH_OVERLAP:] + new_data
+                if pattern.search(tail):
+                    break
+        elif _is_closed(connection_handler):
+            raise EOFError(f"The connection was closed while reading the output of {command!r}")
+        else:
+            sleep(READ_LOOP_DELAY)
+        if perf_counter() - start > read_timeout:
+            raise ReadTimeout(f"Pattern not detected: {expect_string!r} in the output of {command!r} after {read_timeout} seconds")
+    if connection_handler.base_prompt not in pending.rsplit(response_return, 1)[-1]:
+        write(pending)
+    if chunks is not None:
+        return "".join(chunks)
+    return None
+
+
+def get_output(connection_handler, command, options=None, write=None, stats=None):
+    """
+    Sends a command and returns its output.
+    :param options: The options of the command, expect_string, read_timeout and mode ("prompt" or "timing").
+    :param write: Called with the output as it is read instead of returning it, see read_until_prompt.
+    :param stats: Dictionary the characters read are set in, see read_until_prompt.
+    """
+    options = options or {}
+    timeout = options.get("read_timeout", DEFAULT_READ_TIMEOUT)
+    if options.get("mode") == "timing":
         output = connection_handler.send_command_timing(command, read_timeout=timeout)
-        return output
-   
-    def is_connected(net_connect, ip):
+        if stats is not None:
+            stats.update(characters=len(output), first_byte_seconds=None)
+        if write is None:
+            return output
+        write(output)
+        return None
+    return read_until_prompt(connection_handler, command, options.get("expect_string"), timeout, write, stats)
+
+
+def is_connected(net_connect, ip):
+    try:
+        net_connect.is_alive()
+    except:
+        print(">Producer: is {} alive -> {}".format(ip, False ))
+        return False
+    
+    if net_connect.is_alive():
+        print(">Producer: is {} alive -> {}".format(ip, True ))
+        return True
+    else:
+        print(">Producer: is {} alive -> {}".format(ip, False ))
+        return False
+
+
+def open_connection(device_dict, metrics):
+    """
+    ConnectHandler with the steps of netmiko BaseConnection._open timed separately, the TCP connection,
+    SSH handshake and authentication (metrics["connect_seconds"]) and the prompt detection and session
+    preparation (metrics["prompt_seconds"]).
+    A netmiko without those steps (see NETMIKO_OPEN_STEPS) is connected by ConnectHandler, with the
+    sock of the proxy or the jump host as is, and the whole connection is timed as connect_seconds.
+    """
+    net_connect = ConnectHandler(**device_dict, auto_connect=False)
+    start = perf_counter()
+    if not all(callable(getattr(net_connect, step, None)) for step in NETMIKO_OPEN_STEPS):
+        logger.debug(f"netmiko {getattr(netmiko, '__version__', None)} doesn't have the steps of netmiko {NETMIKO_VERSION}, "
+                     f"the prompt detection isn't timed")
+        net_connect = ConnectHandler(**device_dict)
+        metrics["connect_seconds"] = round(perf_counter() - start, 3)
+        return net_connect
+    net_connect._modify_connection_params()
+    net_connect.establish_connection()
+    metrics["connect_seconds"] = round(perf_counter() - start, 3)
+    start = perf_counter()
+    net_connect._try_session_preparation()
+    metrics["prompt_seconds"] = round(perf_counter() - start, 3)
+    return net_connect
+
+
+def connect_device(hostname, device_dict, attempts=CONNECT_ATTEMPTS, bastion_pool=None, metrics=None):
+    """
+    Connects to a device, through its proxy or its jump host if it has one.
+    :param hostname: The hostname of the device.
+    :param device_dict: The arguments of ConnectHandler, with an optional "proxy" or "jump_host". It is modified.
+    :param attempts: Attempts to connect, with a jittered exponential wait between them (see backoff.py).
+    :param bastion_pool: The bastions.BastionPool the channels to the jump hosts are opened on, the pool
+        shared by the process when None.
+    :param metrics: Dictionary the timings of the connection are added to, see metrics.py.
+    :return: (connection, None) or (None, error response dictionary) if the device can't be connected.
+    """
+    metrics = metrics if metrics is not None else {}
+    attempt_metrics = metrics.setdefault("connect", [])
+    proxy_info = device_dict.get("proxy")
+    jump_host = device_dict.pop("jump_host", None)
+    # PROXY
+    # For device_dict to use a proxy, it must contain a "proxy" keyword
+    # The value of the "proxy" keyword must contain a dictionary with all arguments to set a socks object
+    NO_RESPONSE_DICT = {"output": {}}
+    if device_dict.get("proxy"):
+        logger.info(f">Producer {get_native_id()}. Device:{hostname} IP:{device_dict.get('ip')} has a proxy: {proxy_info}")
+        sock = socks.socksocket()
+        sock.set_proxy(
+            **device_dict.get('proxy')
+        )
+
+        # If something goes wrong when connecting to the proxy, then return an error dictionary
+        NO_RESPONSE_DICT["hostname"] = hostname
+        NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
         try:
-            net_connect.is_alive()
-        except:
-            print(">Producer: is {} alive -> {}".format(ip, False ))
-            return False
-        
-        if net_connect.is_alive():
-            print(">Producer: is {} alive -> {}".format(ip, True ))
-            return True
+            start = perf_counter()
+            sock.connect((device_dict.get('ip'), device_dict.get('port', 22)))
+            metrics["proxy_seconds"] = round(perf_counter() - start, 3)
+        except (socks.GeneralProxyError, socks.ProxyConnectionError) as exc:
+            NO_RESPONSE_DICT["error"] = "ProxyConnectionError"
+            # send a debug message to inform the exception, and send an error message to the user to explain what went wrong with this device
+            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}",exc_info = exc)
+            return None, NO_RESPONSE_DICT
+        except (socks.ProxyAuthenticationError, socks.SOCKS5AuthError) as exc:
+            NO_RESPONSE_DICT["error"] = "ProxyAuthenticationError"
+            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
+            return None, NO_RESPONSE_DICT
+        except socks.ProxyTimeoutError as exc:
+            NO_RESPONSE_DICT["error"] = "ProxyTimeout"
+            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
+            return None, NO_RESPONSE_DICT
+        except socks.SOCKS5Error as exc:
+            NO_RESPONSE_DICT["error"] = "SOCKS5Error"
+            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
+            return None, NO_RESPONSE_DICT
+        except Exception as exc:
+            NO_RESPONSE_DICT["error"] = "UnknownError"
+            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
+            return None, NO_RESPONSE_DICT
+        # Proxy connected and key 'proxy' can now be removed for later usage in 'ConnectHandler'
+        device_dict['sock'] = sock
+        del device_dict["proxy"]
+        logger.info(f"hostname: {hostname}, ip: {device_dict.get('ip')}: Sock connected")
+
+    NO_RESPONSE_DICT["error"] = ""
+    backoff_policy = backoff.BackoffPolicy(attempts, CONNECT_BACKOFF_DELAY)
+    for retry in range(0, attempts):
+        if retry:
+            sleep(backoff_policy.delay(retry - 1))
+        attempt_start = perf_counter()
+        attempt_metrics.append({"attempt": len(attempt_metrics), "seconds": 0.0, "error": ""})
+        errors_before = len(NO_RESPONSE_DICT["error"])
+
+        # JUMP HOST
+        # Every attempt opens a new channel to the device, on the transports shared by the devices behind the jump host
+        if jump_host:
+            try:
+                device_dict["sock"] = (bastion_pool or bastions.get_bastion_pool()).open_channel(
+                    jump_host, device_dict.get('ip'), device_dict.get('port', 22))
+                metrics["jump_host_seconds"] = round(perf_counter() - attempt_start, 3)
+            except bastions.BastionError as exc:
+                logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} {exc}. retry {retry}")
+                NO_RESPONSE_DICT["error"] += f"{exc.error},"
+                attempt_metrics[-1].update(seconds=round(perf_counter() - attempt_start, 3), error=exc.error)
+                if exc.error in ("JumpHostConnectionError", "JumpHostAuthenticationError"):
+                    # the jump host is down, the other devices behind it will find out by themselves
+                    NO_RESPONSE_DICT["hostname"] = hostname
+                    NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
+                    return None, NO_RESPONSE_DICT
+                continue
+
+        # Connect to the device, and print out auth or timeout errors
+        try:
+            logger.info(f">Producer {get_native_id()}: Connecting to hostname {hostname} ip {device_dict.get('ip')} retry {retry}")
+            net_connect_generic_pe = open_connection(device_dict, metrics)
+        except NetMikoTimeoutException as exc:
+            logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Connection timeout. retry {retry}")
+            NO_RESPONSE_DICT["error"] += "Timeout,"
+        except NetMikoAuthenticationException as exc:
+            logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Authentication failed. retry {retry}")
+            NO_RESPONSE_DICT["error"] += "AuthenticationFailed,"
+        except Exception as err:
+            logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Unkown exception. retry {retry}")
+            logger.debug(f"hostname {hostname} ip {device_dict.get('ip')} Unkown exception. retry {retry}",exc_info = err)
+            NO_RESPONSE_DICT["error"] += "UnknownError,"
         else:
-            print(">Producer: is {} alive -> {}".format(ip, False ))
-            return False
+            if jump_host:
+                logger.info(f"hostname: {hostname}, ip: {device_dict.get('ip')}: connected through the jump host {jump_host.get('host')}")
+            logger.info("{}: SUCCESS: Authentication OK for {}.".format(hostname, device_dict.get('ip')))
+            attempt_metrics[-1]["seconds"] = round(perf_counter() - attempt_start, 3)
+            break # device is connected, break 'for loop', no need to retry
+        attempt_metrics[-1].update(seconds=round(perf_counter() - attempt_start, 3),
+                                   error=NO_RESPONSE_DICT["error"][errors_before:].rstrip(","))
+        if jump_host:
+            # gives the channel back to the jump host for the next attempt or the next devices
+            device_dict.pop("sock").close()
+    else:
+        #number of retries reached, can't connect to device
+        logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Maximum number of retries reached")
+        NO_RESPONSE_DICT["hostname"] = hostname
+        NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
+        NO_RESPONSE_DICT["output"] = {}
+        NO_RESPONSE_DICT["error"] += "MaximumNumberRetriesReached"
+        return None, NO_RESPONSE_DICT
     
+    if net_connect_generic_pe and not is_connected(net_connect_generic_pe, device_dict.get("ip")):
+        # Device connection is not alive, return the error
+        NO_RESPONSE_DICT["hostname"] = hostname
+        NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
+        NO_RESPONSE_DICT["output"] = {}
+        NO_RESPONSE_DICT["error"] = "ConnectionNotAlive"
+        return None, NO_RESPONSE_DICT
+    return net_connect_generic_pe, None
+
+
+def run_commands(net_connect_generic_pe, hostname, ip, commands, command_options=None, sink=None, metrics=None):
+    """
+    Sends the commands to a connected device and reads their outputs.
+    :param command_options: { command: options } of the commands, see get_output.
+    :param sink: An output_sinks.OutputSink the outputs are streamed to, see collect_device.
+    :param metrics: Dictionary the timings and characters of the commands are added to, see metrics.py.
+    :return: The response dictionary.
+    """
+    command_options = command_options or {}
+    command_metrics = (metrics if metrics is not None else {}).setdefault("commands", {})
+    RESPONSE_DICT = {}
+    RESPONSE_DICT["hostname"] = hostname
+    RESPONSE_DICT["ip"] = ip
+    RESPONSE_DICT["output"] = {}
+    RESPONSE_DICT["error"] = ""
+    RESPONSE_DICT["timing"] = {}
+
+    device_output = sink.open_device(hostname) if sink is not None else None
+    complete = False
+    try:
+        for command in commands:
+            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {ip}, command: {command}")
+            logger.info(f"Executing {command} on hostname: {hostname}")
+            start = perf_counter()
+            stats = command_metrics[command] = {"seconds": 0.0, "first_byte_seconds": None, "characters": 0, "error": ""}
+            try:
+                if device_output is None:
+                    RESPONSE_DICT["output"][command] = get_output(net_connect_generic_pe, command, command_options.get(command),
+                                                                  stats=stats)
+                else:
+                    device_output.start_command(command)
+                    try:
+                        get_output(net_connect_generic_pe, command, command_options.get(command), device_output.write, stats)
+                    finally:
+                        device_output.end_command()
+            except ReadTimeout as exc:
+                logger.error(f"hostname: {hostname}, ip: {ip}, command: {command} timed out")
+                logger.debug(f"hostname: {hostname}, ip: {ip}, command: {command} timed out", exc_info=exc)
+                RESPONSE_DICT["error"] += f"ReadTimeout:{command},"
+                stats["error"] = "ReadTimeout"
+            except EOFError as exc:
+                logger.error(f"hostname: {hostname}, ip: {ip}, the connection was closed while reading {command}")
+                logger.debug(f"hostname: {hostname}, ip: {ip}, the connection was closed while reading {command}", exc_info=exc)
+                RESPONSE_DICT["error"] += f"Disconnected:{command},"
+                stats["error"] = "Disconnected"
+            RESPONSE_DICT["timing"][command] = stats["seconds"] = round(perf_counter() - start, 3)
+            if stats["error"] == "Disconnected":
+                # the remaining commands can't be sent
+                break
+            logger.info(f"hostname: {hostname}, command: {command} read in {RESPONSE_DICT['timing'][command]} seconds")
+        complete = not RESPONSE_DICT["error"]
+    finally:
+        if device_output is not None:
+            RESPONSE_DICT["capture"] = device_output.close(complete)
+    return RESPONSE_DICT
+
+
+def disconnect_device(hostname, net_connect):
+    """
+    Closes the session of a device, and with it its channel on the jump host (see bastions.py).
+    The errors are logged, the outputs were already read.
+    """
+    try:
+        net_connect.disconnect()
+    except Exception as exc:
+        logger.debug(f">Producer {get_native_id()} hostname: {hostname}, error disconnecting", exc_info=exc)
+
+
+def collect_device(device_dict, sink=None, session_pool=None):
+    """
+    Connects to a device and sends its commands, blocking until done.
+    :param device_dict: The device, in the format described at the top of the module. It is modified.
+    :param sink: An output_sinks.OutputSink the outputs are streamed to as they are read, the response
+        has then the metadata of the capture under "capture" instead of the outputs.
+    :param session_pool: A sessions.SessionPool the connection is taken from and given back to, the
+        device is connected and disconnected when None.
+    :return: The response dictionary, with the "metrics" of the device (see metrics.py), None if the device
+        dictionary is malformed.
+    """
+    start = perf_counter()
+    logger.debug(f">Entering Producer {get_native_id()}, device:{device_dict.get('hostname')} ip: {device_dict.get('ip')}")
+
+    # Save some values from the device_dict that later will be removed to acommodate the dictionary for 'ConnectHandler'
+    hostname = device_dict.get("hostname")
+    commands = device_dict.get("commands")
+    del device_dict["commands"]
+    command_options = device_dict.pop("command_options", None) or {}
+    connect_attempts = device_dict.pop("connect_attempts", CONNECT_ATTEMPTS)
+
+    if device_dict.get("hostname"):
+        # Remove hostname key from dictionary because 'ConnectHandler' doesn't use it
+        del device_dict["hostname"]
+    else:
+        # Malformed dictionary, continue with next device in the queue
+        logger.error(f">Producer {get_native_id()} malformed dictionary doesn't contain the 'hostname' key: {device_dict}")
+        return None
+
+    metrics = {"connect": [], "commands": {}}
+    if session_pool is not None:
+        net_connect_generic_pe, error_response = session_pool.acquire(hostname, device_dict, connect_attempts, metrics)
+    else:
+        net_connect_generic_pe, error_response = connect_device(hostname, device_dict, connect_attempts, metrics=metrics)
+    if net_connect_generic_pe is None:
+        metrics["total_seconds"] = round(perf_counter() - start, 3)
+        error_response["metrics"] = metrics
+        return error_response
+
+    healthy = False
+    try:
+        RESPONSE_DICT = run_commands(net_connect_generic_pe, hostname, device_dict.get('ip'), commands, command_options, sink,
+                                     metrics)
+        metrics["total_seconds"] = round(perf_counter() - start, 3)
+        RESPONSE_DICT["metrics"] = metrics
+        # after a timeout the channel can still have the rest of the output, the session isn't reused
+        healthy = not RESPONSE_DICT["error"]
+    finally:
+        if session_pool is not None:
+            session_pool.release(hostname, device_dict, net_connect_generic_pe, healthy)
+        else:
+            disconnect_device(hostname, net_connect_generic_pe)
+    logger.debug(f">Producer {get_native_id()} processed commands for hostname: {hostname}, ip: {device_dict.get('ip')}")
+    return RESPONSE_DICT
+
+
+# producer task
+def producer_task(devices_queue, output_queue):
     logger.debug(f"producer_task {get_native_id()} started")    
     while True:
         # Get the dict of the next device to process
         device_dict = devices_queue.get()
-        # Set the basic responde if there is an error in the processing of this device
         logger.debug(f">Producer {get_native_id()} found device: {device_dict}")
 
         if device_dict is None:
             devices_queue.put(None)
             logger.debug(f">Producer {get_native_id()} found no more devices. Shutting down")
             return
-        logger.debug(f">Entering Producer {get_native_id()}, device:{device_dict.get('hostname')} ip: {device_dict.get('ip')}")
-
-        # Save some values from the device_dict that later will be removed to acommodate the dictionary for 'ConnectHandler'
-        hostname = device_dict.get("hostname")
-        proxy_info = device_dict.get("proxy")
-        commands = device_dict.get("commands")
-        del device_dict["commands"]
-
-        if device_dict.get("hostname"):
-            # Remove hostname key from dictionary because 'ConnectHandler' doesn't use it
-            del device_dict["hostname"]
-        else:
-            # Malformed dictionary, continue with next device in the queue
-            logger.error(f">Producer {get_native_id()} malformed dictionary doesn't contain the 'hostname' key: {device_dict}")
-            continue
-       
-        # PROXY
-        # For device_dict to use a proxy, it must contain a "proxy" keyword
-        # The value of the "proxy" keyword must contain a dictionary with all arguments to set a socks object
-        NO_RESPONSE_DICT = {"output": {}}
-        if device_dict.get("proxy"):
-            logger.info(f">Producer {get_native_id()}. Device:{hostname} IP:{device_dict.get('ip')} has a proxy: {proxy_info}")
-            sock = socks.socksocket()
-            sock.set_proxy(
-                **device_dict.get('proxy')
-            )
-
-            # If something goes wrong when connecting to the proxy, then put an error dictionary on the 
-            # output queue and continue with the next device in the queue
-            NO_RESPONSE_DICT["hostname"] = hostname
-            NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
-            try:
-                device_dict.get("sock").connect((device_dict.get('ip'), 22)) 
-            except (socks.GeneralProxyError, socks.ProxyConnectionError) as exc:
-                NO_RESPONSE_DICT["error"] = "ProxyConnectionError"
-                output_queue.put(NO_RESPONSE_DICT)
-                # send a debug message to inform the exception, and send an error message to the user to explain what went wrong with this device
-                logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
-                logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}",exc_info = exc)
-                continue
-            except (socks.ProxyAuthenticationError, socks.SOCKS5AuthError) as exc:
-                NO_RESPONSE_DICT["error"] = "ProxyAuthenticationError"
-                output_queue.put(NO_RESPONSE_DICT)
-                logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
-                logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
-                continue
-            except socks.ProxyTimeoutError as exc:
-                NO_RESPONSE_DICT["error"] = "ProxyTimeout"
-                output_queue.put(NO_RESPONSE_DICT)
-                logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
-                logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
-                continue
-            except socks.SOCKS5Error as exc:
-                NO_RESPONSE_DICT["error"] = "SOCKS5Error"
-                output_queue.put(NO_RESPONSE_DICT)
-                logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
-                logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
-                continue
-            except Exception as exc:
-                NO_RESPONSE_DICT["error"] = "UnknownError"
-                output_queue.put(NO_RESPONSE_DICT)
-                logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}")
-                logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, Error connecting to the proxy {proxy_info}" ,exc_info = exc)
-                continue
-            # Proxy connected and key 'proxy' can now be removed for later usage in 'ConnectHandler'
-            device_dict['sock'] = sock
-            del device_dict["proxy"]
-            logger.info(f"hostname: {hostname}, ip: {device_dict.get('ip')}: Sock connected")
-
-        NO_RESPONSE_DICT["error"] = ""
-        for retry in range(0,3):
-            sleep(random() * retry * 10)
-            
-            # Connect to the device, and print out auth or timeout errors
-            try:
-                logger.info(f">Producer {get_native_id()}: Connecting to hostname {hostname} ip {device_dict.get('ip')} retry {retry}")
-                net_connect_generic_pe = ConnectHandler(**device_dict) 
-            except NetMikoTimeoutException as exc:
-                logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Connection timeout. retry {retry}")
-                NO_RESPONSE_DICT["error"] += "Timeout,"
-            except NetMikoAuthenticationException as exc:
-                logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Authentication failed. retry {retry}")
-                NO_RESPONSE_DICT["error"] += "AuthenticationFailed,"
-            except Exception as err:
-                logger.warning(f"hostname {hostname} ip {device_dict.get('ip')} Unkown exception. retry {retry}")
-                logger.debug(f"hostname {hostname} ip {device_dict.get('ip')} Unkown exception. retry {retry}",exc_info = err)
-                NO_RESPONSE_DICT["error"] += "UnknownError,"
-            else:
-                logger.info("{}: SUCCESS: Authentication OK for {}.".format(hostname, device_dict.get('ip')))
-                break # device is connected, break 'for loop', no need to retry
-        else:
-            #number of retries reached, can't connect to device
-            logger.error(f"hostname: {hostname}, ip: {device_dict.get('ip')}, Maximum number of retries reached")
-            NO_RESPONSE_DICT["hostname"] = hostname
-            NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
-            NO_RESPONSE_DICT["output"] = {}
-            NO_RESPONSE_DICT["error"] += "MaximumNumberRetriesReached"
-            output_queue.put(NO_RESPONSE_DICT)
-            continue
-        
-        if net_connect_generic_pe and not is_connected(net_connect_generic_pe, device_dict.get("ip")):
-            # Device connection is not alive, put the error in the output_queue and continue witht he next device in the device_queue
-            NO_RESPONSE_DICT["hostname"] = hostname
-            NO_RESPONSE_DICT["ip"] = device_dict.get('ip')
-            NO_RESPONSE_DICT["output"] = {}
-            NO_RESPONSE_DICT["error"] = "ConnectionNotAlive"
-            output_queue.put(NO_RESPONSE_DICT)
-            continue
 
-        RESPONSE_DICT = {}
-        RESPONSE_DICT["hostname"] = hostname
-        RESPONSE_DICT["ip"] = device_dict.get('ip')
-        RESPONSE_DICT["output"] = {}
-        RESPONSE_DICT["error"] = ""
-
-        for command in commands:
-            logger.debug(f">Producer {get_native_id()} hostname: {hostname}, ip: {device_dict.get('ip')}, command: {command}")
-            logger.info(f"Executing {command} on hostname: {hostname}")
-            RESPONSE_DICT["output"][command] = get_output(net_connect_generic_pe, command)
-        else:
-            logger.debug(f">Producer {get_native_id()} processed commands for hostname: {hostname}, ip: {device_dict.get('ip')}")
-            # logger.debug(f">Producer {get_native_id()} result for hostname: {hostname}, output: {RESPONSE_DICT}")
-            output_queue.put(RESPONSE_DICT)
+        response_dict = collect_device(device_dict)
+        if response_dict is not None:
+            output_queue.put(response_dict)
             
 
 # producer manager task
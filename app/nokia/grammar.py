@@ -1,13 +1,19 @@
+import bisect
+import re
+import threading
+
 import pyparsing as pp
 
 digits = pp.Word(pp.nums)
 ipv4_address = pp.Word(pp.nums + r"." )
+ipv6_address = pp.Regex(r"[0-9a-fA-F]{0,4}(?::[0-9a-fA-F]{0,4}){2,7}")
 
 mask_prefix = pp.Combine(pp.Word("/") + pp.Word(pp.nums))
 mask_quads = pp.Word(pp.nums) + pp.Literal(".") + pp.Word(pp.nums) + pp.Literal(".") + pp.Word(pp.nums) + pp.Literal(".") + pp.Word(pp.nums)
 mask_quads = pp.Combine(mask_quads)
 mask_quads = pp.Word("/") + mask_quads
-mask = mask_prefix | mask_quads
+# mask_quads first, mask_prefix would match the first number of a dotted quad mask
+mask = mask_quads | mask_prefix
 
 subnet = ipv4_address + mask
 
@@ -15,6 +21,9 @@ none_word = pp.Keyword("None")
 one_or_more_spaces = pp.Suppress(pp.ZeroOrMore(pp.Literal(" ")))
 new_line = pp.Suppress(pp.Regex(r"\r?\n"))
 ignore_line = pp.Regex(r".*\r?\n")
+# the lines the entry grammars don't match, counted in the parse statistics,
+# whitespace is kept to tell the first line of an entry from its continuation lines
+skipped_table_line = ignore_line.copy().leave_whitespace()
 
 
 # Router route-table definitions
@@ -44,6 +53,7 @@ the parser will return a pyparsing.ParseResults object with the following attrib
 
 Comands on Nokia that are relevant for this grammar are:
 show router [router_id] route-table
+show router [router_id] route-table ipv6 (IPv6 prefixes, the next hops are read as interface names)
 
 """
 
@@ -58,14 +68,17 @@ age_hms = pp.Combine(digits + pp.Literal("h") + digits + pp.Literal("m") + digit
 age_dhm = pp.Combine(digits + pp.Literal("d") + digits + pp.Literal("h") + digits + pp.Literal("m"))
 age_dh = pp.Combine(digits + pp.Literal("d") + digits + pp.Literal("h"))
 
-route = pp.Combine( ipv4_address + mask )
+route = pp.Combine( ipv4_address + mask ) | pp.Combine( ipv6_address + mask_prefix )
 flags = pp.Word("nBLS")
 route_type = pp.Literal("Remote") | pp.Literal("Local") | pp.Literal("Blackh*")
 route_protocol = pp.Literal("BGP_LABEL") | pp.Literal("ISIS") | pp.Literal("Static") | pp.Literal("BGP VPN") | pp.Literal("BGP") | pp.Literal("Aggr") | pp.Literal("Local")
 age = age_hms | age_dhm | age_dh
 preference = digits
 interface_next_hop = tunneled_bgp |  tunneled_isis_sr | tunneled_rsvp | tunneled_isis_sr_te | tunneled_ldc
-next_hop = ipv4_address | interface_name
+# the addresses must end the word, "fe80::1-\"to-core\"" or "1/1/1" are interface names
+ipv4_next_hop = pp.Regex(r"[\d.]+(?![\w:\-/\"])")
+ipv6_next_hop = pp.Regex(r"[0-9a-fA-F]{0,4}(?::[0-9a-fA-F]{0,4}){2,7}(?![\w\-/\"])")
+next_hop = ipv4_next_hop | ipv6_next_hop | interface_name
 metric = digits
 
 @interface_name.set_parse_action
@@ -92,7 +105,7 @@ route_table_entry = (
 
 igp_grammar = pp.OneOrMore(
         pp.Group(route_table_entry) |
-        pp.Suppress(ignore_line)
+        pp.Suppress(skipped_table_line)
     )
 
 
@@ -172,7 +185,7 @@ bgp_vpn_ipv4_entry = (
 
 bgp_grammar = pp.OneOrMore(
         pp.Group(bgp_vpn_ipv4_entry) | 
-        pp.Suppress(ignore_line)
+        pp.Suppress(skipped_table_line)
     )
 
 
@@ -192,10 +205,219 @@ service_grammar = pp.OneOrMore(
 )
 
 
-def parse_output(raw_output):
-   results = igp_grammar.parse_string(raw_output)
+# Table regions of the output
+"""
+The outputs are tables delimited by separator lines, a title between "=" separators,
+the column headers, and the body between "-" separators:
+
+===============================================================================
+Route Table (Router: Base)                                          <- title
+===============================================================================
+Dest Prefix[Flags]                            Type    Proto     Age  <- headers
+-------------------------------------------------------------------------------
+1.1.1.1/32 [B]                                Remote  BGP_LABEL ...  <- body
+-------------------------------------------------------------------------------
+No. of Routes: 1                                                    <- footer
+===============================================================================
+
+iter_table_lines keeps the title lines (the service name is read from them) and the body
+lines, banners, legends, headers and footers never reach the entry grammars.
+"""
+
+START, TITLE, HEADER, BODY, OUTSIDE = "start", "title", "header", "body", "outside"
+# outputs without any separator in their first lines are passed through whole
+PREAMBLE_LINES = 200
+separator_regex = re.compile(rb"^([=-])\1{9,}[ \t]*\r?$", re.MULTILINE)
+
+def _separator(line):
+   """Returns "=" or "-" for separator lines, None for any other line"""
+   stripped = line.strip()
+   if len(stripped) >= 10 and stripped[0] in "=-" and stripped == stripped[0] * len(stripped):
+      return stripped[0]
+   return None
+
+def _next_state(state, separator, title_lines):
+   if separator == "-":
+      return OUTSIDE if state == BODY else BODY
+   # consecutive "=" separators (the footer of a table and the title of the next) keep the title open
+   if state == TITLE and title_lines:
+      return HEADER
+   return TITLE
+
+def iter_table_lines(lines, state=START, stats=None):
+   """
+   Yields the title and body lines of the tables found in lines, an iterable of lines.
+   state is the region the lines start in, START for the beginning of an output, or the
+   state returned by table_states for a slice of it.
+   From START, if no separator is found in the first PREAMBLE_LINES lines the lines are
+   yielded unchanged, e.g. an output saved without its headers.
+   """
+   lines = iter(lines)
+   title_lines = 0
+   scanned = skipped = 0
+   preamble = [] if state == START else None
+   state = OUTSIDE if state == START else state
+   try:
+      for line in lines:
+         scanned += 1
+         if preamble is not None:
+            if _separator(line) is None:
+               preamble.append(line)
+               if len(preamble) >= PREAMBLE_LINES:
+                  yield from preamble
+                  for line in lines:
+                     scanned += 1
+                     yield line
+                  return
+               continue
+            skipped += len(preamble)
+            preamble = None
+         separator = _separator(line)
+         if separator:
+            if separator == "=" and state != TITLE:
+               title_lines = 0
+            state = _next_state(state, separator, title_lines)
+            skipped += 1
+         elif state == BODY:
+            yield line
+         elif state == TITLE and line.strip():
+            title_lines += 1
+            if stats is not None:
+               stats.titles.add(line if line.endswith("\n") else line + "\n")
+            yield line
+         else:
+            skipped += 1
+      if preamble:
+         yield from preamble
+   finally:
+      if stats is not None:
+         stats.lines_scanned += scanned
+         stats.skipped_outside_table += skipped
+
+def table_states(buffer, offsets):
+   """
+   Returns the region (a state for iter_table_lines) at each offset of buffer, the bytes or
+   memory map of an output, so slices of it can be parsed on their own.
+   Only the separator lines are searched for, the rest of the output is not decoded.
+   Returns None for every offset when the output has no separators.
+   """
+   separators = [(match.start(), match.end(), match.group(1).decode()) for match in separator_regex.finditer(buffer)]
+   if not separators:
+      return [None] * len(offsets)
+   # the state right after every separator
+   starts = []
+   states = []
+   state = OUTSIDE
+   previous_end = 0
+   for start, end, separator in separators:
+      title_lines = 1 if state == TITLE and bytes(buffer[previous_end:start]).strip() else 0
+      state = _next_state(state, separator, title_lines)
+      starts.append(start)
+      states.append(state)
+      previous_end = end
+   return [states[bisect.bisect_left(starts, offset) - 1] if offset > starts[0] else START for offset in offsets]
+
+def _table_text(raw_output, stats=None):
+   return "".join(iter_table_lines(raw_output.splitlines(keepends=True), stats=stats))
+
+
+# Parse statistics
+"""
+The entry grammars suppress any line they don't match, a route line in a format the grammar
+doesn't know would be silently dropped. The lines suppressed inside table regions are
+counted in the ParseStats object (see netparser.ParseStats) of the running parse, and the
+lines that start an entry (don't start with a space) are kept as rejected samples.
+Only suppressed lines reach the parse action, matched entries don't pay for the statistics.
+"""
+
+_parse_context = threading.local()
+
+def _count_skipped_line(s: str, loc: int, tokens: pp.ParseResults):
+   stats = getattr(_parse_context, "stats", None)
+   line = tokens[0]
+   if stats is None or line in stats.titles or not line.strip():
+      return
+   stats.skipped_in_table += 1
+   if line[:1] not in (" ", "\t"):
+      stats.add_rejected(line)
+
+skipped_table_line.add_parse_action(_count_skipped_line)
+
+def _parse_string(grammar, text, stats):
+   if stats is None:
+      return grammar.parse_string(text)
+   _parse_context.stats = stats
+   try:
+      results = grammar.parse_string(text)
+   finally:
+      _parse_context.stats = None
+   stats.entries_matched += len(results)
+   return results
+
+def parse_output(raw_output, stats=None):
+   table_text = _table_text(raw_output, stats)
+   if not table_text.strip():
+      return pp.ParseResults([])
+   results = _parse_string(igp_grammar, table_text, stats)
    return results
 
 def parse_service(raw_output):
    results = service_grammar.parse_string(raw_output)
-   return results
\ No newline at end of file
+   return results
+
+def parse_bgp_output(raw_output, stats=None):
+   table_text = _table_text(raw_output, stats)
+   if not table_text.strip():
+      return pp.ParseResults([])
+   results = _parse_string(bgp_grammar, table_text, stats)
+   return results
+
+
+BATCH_LINES = 4000
+
+def _iter_chunks(lines, batch_lines=BATCH_LINES):
+   """
+   Groups lines in chunks of about batch_lines lines.
+   A chunk is only cut before a line that doesn't start with a space, entries
+   continue on lines that start with spaces so an entry is never split between two chunks.
+   A chunk is always cut before a "Route Table" title, so all the entries of a chunk
+   belong to the same service.
+   """
+   chunk = []
+   for line in lines:
+      if chunk and line[:1] not in (" ", "\t") and (len(chunk) >= batch_lines or line.startswith("Route Table")):
+         yield "".join(chunk)
+         chunk = []
+      chunk.append(line if line.endswith("\n") else line + "\n")
+   if chunk:
+      yield "".join(chunk)
+
+def _iter_parse(grammar, lines, batch_lines, table_state, stats):
+   service_name = None
+   if table_state is not None:
+      lines = iter_table_lines(lines, table_state, stats)
+   for chunk in _iter_chunks(lines, batch_lines):
+      if table_state is None and stats is not None:
+         stats.lines_scanned += chunk.count("\n")
+      if chunk.startswith("Route Table"):
+         service_list = parse_service(chunk)
+         if service_list:
+            service_name = service_list[-1].get("service_name")
+      if not chunk.strip():
+         continue
+      yield service_name, _parse_string(grammar, chunk, stats)
+
+def iter_parse_output(lines, batch_lines=BATCH_LINES, table_state=START, stats=None):
+   """
+   Streaming version of parse_output, receives an iterable of lines (e.g. an open file)
+   and yields (service_name, entries) for every chunk of about batch_lines lines.
+   service_name is the last "Route Table (Service: name)" seen in the stream.
+   table_state is the region the lines start in (see iter_table_lines and table_states),
+   with None every line is handed to the grammar.
+   stats, a netparser.ParseStats, is updated as the chunks are parsed.
+   """
+   return _iter_parse(igp_grammar, lines, batch_lines, table_state, stats)
+
+def iter_parse_bgp_output(lines, batch_lines=BATCH_LINES, table_state=START, stats=None):
+   """Streaming version of parse_bgp_output, same as iter_parse_output"""
+   return _iter_parse(bgp_grammar, lines, batch_lines, table_state, stats)
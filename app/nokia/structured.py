@@ -0,0 +1,185 @@
+"""
+Parser for the structured (JSON) route tables of Nokia SR OS, as an alternative to
+scraping the text of "show router route-table" with the pyparsing grammar.
+
+Two kinds of files are supported, both saved from the state tree route-table context:
+- MD-CLI "info json" output, e.g.
+    state router "Base" route-table unicast ipv4
+    info json
+- gNMI JSON dumps (one notification per line or a list of notifications), where the
+  route lists come in the "val" of the updates.
+
+In both cases the routes are the items of the "route" lists:
+{
+    "nokia-state:route": [
+        {
+            "ipv4-prefix": "1.1.1.1/32",
+            "protocol": "bgp-label",
+            "preference": 170,
+            "metric": 100,
+            "age": 38971,
+            "nexthop": [
+                {"ip-address": "10.20.30.40", "tunnel": {"type": "sr-isis", "tunnel-id": 530001}}
+            ]
+        }
+    ]
+}
+
+Each route (one per next hop) is returned as a dictionary with the same keys as the
+entries of the text grammar, so both inputs end up in the same route records:
+"route": "1.1.1.1/32",
+"flags": None,
+"route_type": "Remote",
+"route_protocol": "BGP_LABEL",
+"age": "10h49m31s",
+"preference": "170",
+"next_hop": "10.20.30.40",
+"interface_next_hop": "tunneled:SR-ISIS:530001",
+"metric": "100"
+
+The service name is taken from the router-name / service-name found before the route
+lists, either as a JSON key ("router-name": "Base") or in a gNMI path ([router-name=Base]).
+"""
+
+import io
+import json
+import re
+
+import file_operations
+
+BATCH_SIZE = 2000
+CHUNK_SIZE = 1024 * 1024
+
+PROTOCOLS = {
+    "bgp-vpn": "BGP VPN",
+    "bgp-label": "BGP_LABEL",
+    "bgp": "BGP",
+    "isis": "ISIS",
+    "ospf": "OSPF",
+    "static": "Static",
+    "local": "Local",
+    "aggregate": "Aggr",
+}
+
+TUNNEL_TYPES = {
+    "sr-isis": "SR-ISIS",
+    "sr-te": "SR-TE",
+    "rsvp": "RSVP",
+    "bgp": "BGP",
+}
+
+service_name_regex = re.compile(r"""(?:router|service)-name["']?\s*[:=]\s*["']?([\w\-.]+)""")
+
+
+def _without_namespace(value):
+    return str(value).split(":")[-1]
+
+
+def _format_age(age):
+    """Formats an age in seconds the way the CLI shows it, 10h49m31s or 25d20h48m"""
+    if not isinstance(age, int):
+        return age
+    days, seconds = divmod(age, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f"{days:02d}d{hours:02d}h{minutes:02d}m"
+    return f"{hours:02d}h{minutes:02d}m{seconds:02d}s"
+
+
+def _interface_next_hop(nexthop):
+    tunnel = nexthop.get("tunnel")
+    if not tunnel:
+        return None
+    tunnel_type = _without_namespace(tunnel.get("type", ""))
+    if tunnel_type not in TUNNEL_TYPES:
+        return "tunneled"
+    tunnel_id = tunnel.get("tunnel-id")
+    if tunnel_id is None:
+        return f"tunneled:{TUNNEL_TYPES[tunnel_type]}"
+    return f"tunneled:{TUNNEL_TYPES[tunnel_type]}:{tunnel_id}"
+
+
+def route_entries(item: dict) -> list:
+    """Translates a route of the JSON route table into route entries, one per next hop"""
+    prefix = item.get("ipv4-prefix") or item.get("ipv6-prefix") or item.get("prefix")
+    protocol = _without_namespace(item.get("protocol", ""))
+    route_protocol = PROTOCOLS.get(protocol, protocol)
+    route_type = item.get("type")
+    if route_type is None:
+        route_type = "Local" if route_protocol == "Local" else "Remote"
+    preference = item.get("preference")
+    metric = item.get("metric")
+    entry = {
+        "route": prefix,
+        "flags": item.get("flags"),
+        "route_type": _without_namespace(route_type).capitalize(),
+        "route_protocol": route_protocol,
+        "age": _format_age(item.get("age")),
+        "preference": None if preference is None else str(preference),
+        "next_hop": None,
+        "interface_next_hop": None,
+        "metric": None if metric is None else str(metric),
+    }
+    nexthops = item.get("nexthop") or item.get("next-hop") or []
+    if not nexthops:
+        return [entry]
+
+    entries = []
+    for nexthop in nexthops:
+        nexthop_entry = dict(entry)
+        nexthop_entry["next_hop"] = nexthop.get("ip-address") or nexthop.get("address") or nexthop.get("interface-name")
+        nexthop_entry["interface_next_hop"] = _interface_next_hop(nexthop)
+        entries.append(nexthop_entry)
+    return entries
+
+
+def iter_parse_output(stream, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE, stats=None):
+    """
+    Streaming parser, stream is a text file object (or anything with a read method).
+    Yields (service_name, entries) for every batch of about batch_size routes.
+    stats, a netparser.ParseStats, counts the routes read and the entries generated,
+    routes without a prefix are rejected.
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+
+    service = {"name": None}
+
+    def find_service_name(skipped_text):
+        matches = service_name_regex.findall(skipped_text)
+        if matches:
+            service["name"] = matches[-1]
+
+    batch = []
+    batch_service = None
+    for item in file_operations.iter_json_list_items(stream, "route", chunk_size, on_skip=find_service_name):
+        if service["name"] != batch_service and batch:
+            yield batch_service, batch
+            batch = []
+        batch_service = service["name"]
+        entries = route_entries(item)
+        if stats is not None:
+            stats.lines_scanned += 1
+        if entries[0]["route"] is None:
+            # a route without a prefix can't be stored
+            if stats is not None:
+                stats.skipped_in_table += 1
+                stats.add_rejected(json.dumps(item))
+            continue
+        if stats is not None:
+            stats.entries_matched += len(entries)
+        batch.extend(entries)
+        if len(batch) >= batch_size:
+            yield batch_service, batch
+            batch = []
+    if batch:
+        yield batch_service, batch
+
+
+def parse_output(raw_output, stats=None):
+    return [entry for _, entries in iter_parse_output(raw_output, stats=stats) for entry in entries]
+
+
+def parse_service(raw_output):
+    return [{"service_name": name} for name in service_name_regex.findall(raw_output)]
@@ -1,54 +1,246 @@
+"""
+orchestrator.py glues the CLI commands to the rest of the modules.
+
+Importing this module must stay cheap, "compare --list" only reads a few rows from the
+database. The modules with heavy dependencies (netmiko, paramiko, socks, pyparsing, yaml)
+are imported inside the functions that use them, and the database is initialized the
+first time a function needs it.
+"""
 import os
 import logging
 
 logger = logging.getLogger(__name__)
 
-import yaml
-
-import storage
 database_url = "routes.sqlite3"
-storage.initialize_database(database_url)
-import netparser
-import file_operations
-import yaml_operations
-import network_interface
+_database_initialized = False
+
+
+def _get_storage():
+    """Imports storage and creates the database tables the first time it is used"""
+    global _database_initialized
+    import storage
+
+    if not _database_initialized:
+        storage.initialize_database(database_url)
+        _database_initialized = True
+    return storage
 
 def list_timestamps(hostname: str = None):
     logger.info("list_timestamps")
+    storage = _get_storage()
     if hostname:
         return storage.get_list_of_timestamps(hostname, )
     return storage.get_list_of_timestamps()
 
 def remove_routes_for_device(hostname: str, timestamp: str):
     logger.info("remove_route")
+    storage = _get_storage()
     rows_deleted = storage.remove_routes(hostname, timestamp, )
     return rows_deleted
 
-def fetch_single_device(ip_address: str):
-    import network_interface
+def _load_device_list(inventory_filename: str, command_filename: str) -> list:
+    """The device dictionaries of the inventory with their commands, None if the inventory or the commands are empty"""
+    import yaml_operations
+
+    inventory = yaml_operations.load_inventory(inventory_filename)
+    if not inventory:
+        logger.error("No inventory found")
+        return None
+    commands = yaml_operations.load_commands(command_filename)
+    if not commands:
+        logger.error("No commands found")
+        return None
+    return list(yaml_operations.generate_device_list(inventory, commands))
+
+
+def _connection_policy(retries: int, retry_delay: float, use_breaker: bool) -> tuple:
+    """(backoff policy, circuit breaker with the failures of the previous runs, None if not used)"""
+    import backoff
+
+    backoff_policy = backoff.BackoffPolicy(max_attempts=retries, base_delay=retry_delay)
+    circuit_breaker = backoff.CircuitBreaker(_get_storage().get_circuit_states()) if use_breaker else None
+    return backoff_policy, circuit_breaker
+
+
+def _save_circuit_states(circuit_breaker):
+    if circuit_breaker is not None:
+        _get_storage().save_circuit_states(circuit_breaker.changed_states())
+
+
+def _write_metrics(summary: dict, metrics_file: str = None):
+    import metrics
+
+    logger.info(f"Collection: {metrics.format_summary(summary)}")
+    if metrics_file is not None:
+        metrics.write_summary(summary, metrics_file)
+
+
+def _save_device_durations(responses: list):
+    """Keeps the collection time of the devices, sharding.partition balances the next runs with them"""
+    durations = {
+        response["hostname"]: response["metrics"]["total_seconds"]
+        for response in responses if "total_seconds" in response.get("metrics", {})
+    }
+    if durations:
+        _get_storage().save_device_durations(durations)
+
+
+def _fetch_checkpoint(device_list: list, timestamp: str = None, workers: int = 1, output_directory: str = None,
+                      compression: str = None, concurrency: int = None, collect_function=None,
+                      retries: int = 3, retry_delay: float = 5.0, use_breaker: bool = True, metrics_file: str = None):
+    import fetch
+
+    storage = _get_storage()
+    logger.info(f"Fetching the routes of {len(device_list)} devices")
+    backoff_policy, circuit_breaker = _connection_policy(retries, retry_delay, use_breaker)
+    try:
+        result = fetch.fetch_checkpoint(
+            device_list, storage.save_routes, storage.save_parse_stats, timestamp, output_directory, compression,
+            workers, concurrency, collect_function=collect_function, backoff_policy=backoff_policy,
+            circuit_breaker=circuit_breaker,
+        )
+    finally:
+        _save_circuit_states(circuit_breaker)
+    _write_metrics(result["metrics"], metrics_file)
+    return result
+
+
+def _select_device(device_list: list, ip_address: str, inventory_filename: str) -> list:
+    """The device of the list with this management IP address, all of them when ip_address is None"""
+    if not device_list or ip_address is None:
+        return device_list
+    device_list = [device for device in device_list if device.get("ip") == ip_address]
+    if not device_list:
+        logger.error(f"No device with IP address {ip_address} in {inventory_filename}")
+    return device_list
+
+
+def fetch_single_device(ip_address: str, inventory_filename: str, command_filename: str, **kwargs):
+    """
+    Save a checkpoint of the device of the inventory with this management IP address, see fetch_devices_from_file.
+    """
+    logger.debug("fetch_single_device")
+    device_list = _select_device(_load_device_list(inventory_filename, command_filename), ip_address, inventory_filename)
+    if not device_list:
+        return None
+    return _fetch_checkpoint(device_list, **kwargs)
+
+
+def fetch_devices_from_file(inventory_filename: str, command_filename: str, timestamp: str = None, workers: int = 1,
+                            output_directory: str = None, compression: str = None, concurrency: int = None,
+                            retries: int = 3, retry_delay: float = 5.0, use_breaker: bool = True, metrics_file: str = None):
+    """
+    Save a checkpoint of the devices of the inventory: the devices are scraped and, as each one finishes,
+    its outputs are parsed by the worker processes and its routes saved, all with the same timestamp (see fetch.py).
+    :param inventory_filename: The inventory YAML file.
+    :param command_filename: The commands YAML file, the route table commands are parsed, the other outputs are skipped.
+    :param timestamp: The timestamp of the checkpoint, the current time when None.
+    :param workers: Number of parse processes.
+    :param output_directory: Keep the captures of the devices in this directory, they are deleted when None.
+    :param compression: Compression of the captures, gzip, xz, bz2 or zstd.
+    :param concurrency: Maximum number of devices collected at the same time.
+    :param retries: Attempts to connect a device, the waits between them are jittered and exponential (see backoff.py).
+    :param retry_delay: Maximum wait before the first retry, doubled for every retry.
+    :param use_breaker: Skip the devices and proxies that failed in the previous runs until their cooldown ends.
+    :param metrics_file: Write the summary of the timings of the collection to this JSON file (see metrics.py).
+    :return: dict with the timestamp, the result of every device and the timings, None if there are no devices.
+    """
+    logger.debug("fetch_devices_from_file")
+    device_list = _load_device_list(inventory_filename, command_filename)
+    if not device_list:
+        return None
+    return _fetch_checkpoint(device_list, timestamp, workers, output_directory, compression, concurrency,
+                             retries=retries, retry_delay=retry_delay, use_breaker=use_breaker, metrics_file=metrics_file)
+
 
-    pass
+def fetch_daemon(inventory_filename: str, command_filename: str, interval_minutes: float, cycles: int = None,
+                 workers: int = 1, output_directory: str = None, compression: str = None, concurrency: int = None,
+                 retries: int = 3, retry_delay: float = 5.0, use_breaker: bool = True, metrics_file: str = None,
+                 ip_address: str = None):
+    """
+    Save a checkpoint of the devices of the inventory every interval_minutes, keeping the SSH sessions
+    open between checkpoints (see sessions.py). Runs until cycles checkpoints were run or it is interrupted,
+    a checkpoint that fails is logged and the next one runs on time.
+    :param output_directory: Keep the captures of every checkpoint in a subdirectory named after its timestamp.
+    :param metrics_file: Write the summary of the timings of the last checkpoint to this JSON file.
+    :param ip_address: Only the device of the inventory with this management IP address, all of them when None.
+    :return: The number of checkpoints run, None if there are no devices.
+    """
+    logger.debug("fetch_daemon")
+    import sessions
+    import ages
+    import time
 
+    device_list = _select_device(_load_device_list(inventory_filename, command_filename), ip_address, inventory_filename)
+    if not device_list:
+        return None
 
-def fetch_devices_from_file(filename: str):
-    import network_interface
+    def fetch_cycle(cycle):
+        timestamp = time.strftime(ages.TIMESTAMP_FORMAT)
+        cycle_directory = os.path.join(output_directory, timestamp.replace(":", "-")) if output_directory else None
+        _fetch_checkpoint(device_list, timestamp, workers, cycle_directory, compression, concurrency, session_pool.collect_device,
+                          retries, retry_delay, use_breaker, metrics_file)
 
-    pass
+    session_pool = sessions.SessionPool()
+    return sessions.run_daemon(session_pool, fetch_cycle, interval_minutes * 60, cycles)
 
 
-def load_routes_from_file(filename: str, hostname: str, timestamp: str, vendor: str):
+def load_routes_from_file(filename: str, hostname: str, timestamp: str, vendor: str, workers: int = 1):
     """
     Load routes from a file.
+    The file is parsed in a producer thread while the routes already parsed are saved
+    in batches to the database (see pipeline.py), the file is never loaded in full.
+    Scrape files with the outputs of several commands are split by command and every
+    route table output is parsed in the same pass.
+    With workers > 1 uncompressed text captures are memory mapped and parsed by that many processes.
+    The parse statistics (lines matched, skipped and rejected) are logged and saved with the routes.
     :param filename: The file to load from.
     :param timestamp: The timestamp to save to the database.
-    :return: None
+    :param workers: number of parse processes
+    :return: dict with the counters of the parse and write stages and the parse statistics
     """
     logger.debug("load_routes_from_file")
-    content = file_operations.load_file_content(filename)
-    routes = netparser.parse(vendor, content, hostname, timestamp)
-    logger.info(f"Loaded {len(routes)} routes from {filename}")
-    storage.save_routes(timestamp, routes, )
-    logger.info(f"Saved {len(routes)} routes to the database")
+    import file_operations
+    import netparser
+    import pipeline
+
+    storage = _get_storage()
+    input_format = "json" if file_operations.is_json_capture(filename) else "text"
+    parallel = workers > 1 and input_format == "text" and not file_operations.detect_compression(filename)
+    if parallel and file_operations.is_scrape_capture(filename):
+        logger.warning(f"{filename} has the outputs of several commands, using a single process")
+        parallel = False
+    if parallel:
+        entry = netparser.get_parser_entry(vendor)
+        if entry is None:
+            raise ValueError(f"Unsupported vendor: {vendor}")
+        if not entry.parallel:
+            logger.warning(f"Parser for {vendor} doesn't support parallel parsing, using a single process")
+            parallel = False
+    logger.info(f"Loading {input_format} routes from {filename}" + (f" with {workers} workers" if parallel else ""))
+
+    save_batch = lambda routes: storage.save_routes(timestamp, routes, )
+    stats = netparser.ParseStats()
+    if parallel:
+        batches = netparser.iter_parse_parallel(vendor, filename, hostname, timestamp, workers, stats=stats)
+        counters = pipeline.ingest(batches, save_batch)
+    else:
+        with file_operations.open_capture(filename) as stream:
+            if input_format == "text":
+                batches = netparser.iter_parse_sections(vendor, stream, hostname, timestamp, stats=stats)
+            else:
+                batches = netparser.iter_parse(vendor, stream, hostname, timestamp, input_format=input_format, stats=stats)
+            counters = pipeline.ingest(batches, save_batch)
+    logger.info(f"Saved {counters['write']['routes']} routes from {filename} to the database")
+
+    logger.info(str(stats))
+    if stats.rejected:
+        logger.warning(f"{stats.rejected} lines of {filename} look like routes but weren't parsed, e.g.:")
+        for sample in stats.rejected_samples:
+            logger.warning(f"    {sample}")
+    counters["parse_stats"] = stats.to_dict()
+    storage.save_parse_stats(hostname, timestamp, counters["parse_stats"], source=filename)
+    return counters
 
 
 def compare_routes(hostname: str, service: str, timestamp1: str, timestamp2: str):
@@ -61,20 +253,108 @@ def compare_routes(hostname: str, service: str, timestamp1: str, timestamp2: str
     :return: A dictionary containing the added, deleted, and changed routes.
     """
     logger.info("compare_routes")
+    storage = _get_storage()
     return storage.compare_routes(
         hostname, service, timestamp1, timestamp2, 
     )
 
 
-def remote_command_execution(inventory_filename: str, command_filename: str, device_filter: str="all", dry_run_flag: bool = False,):
+def recent_routes(hostname: str, timestamp: str, minutes: int, service: str = None):
+    """
+    Routes of a checkpoint (re)installed in the minutes before it was taken.
+    :param hostname: The hostname of the device.
+    :param timestamp: The timestamp of the checkpoint.
+    :param minutes: The size of the time window.
+    :param service: The service name, all the services when None.
+    :return: A list of RouteRecord, the newest first.
+    """
+    logger.debug("recent_routes")
+    storage = _get_storage()
+    return storage.get_recently_installed_routes(hostname, timestamp, minutes * 60, service)
+
+
+def route_churn(hostname: str, service: str, min_changes: int = 2, start: str = None, end: str = None):
+    """
+    Unstable routes of a device and service over its checkpoints, in a single pass over the history.
+    :param hostname: The hostname of the device.
+    :param service: The service name.
+    :param min_changes: Routes are reported when they changed more than this number of times.
+    :param start: The first timestamp of the window, from the oldest checkpoint when None.
+    :param end: The last timestamp of the window, up to the newest checkpoint when None.
+    :return: A dictionary with the checkpoints analyzed and the flapping, oscillating and age_resets routes.
+    """
+    logger.debug("route_churn")
+    import churn
+    storage = _get_storage()
+    return churn.route_churn(storage.iter_route_history(hostname, service, start, end), min_changes)
+
+
+def route_matrix(hostname: str, service: str, timestamps: list, changed_only: bool = False):
+    """
+    Compare the routes of any number of checkpoints, each checkpoint is loaded once.
+    :param hostname: The hostname of the device.
+    :param service: The service name.
+    :param timestamps: The timestamps of the checkpoints.
+    :param changed_only: Only the routes that changed in any of the checkpoints.
+    :return: The timestamps found, from the oldest, and an iterator of the rows of the matrix.
+    """
+    logger.debug("route_matrix")
+    import route_matrix
+    storage = _get_storage()
+    snapshots = storage.iter_route_history(hostname, service, fields=route_matrix.FIELDS, timestamps=timestamps)
+    return route_matrix.iter_route_matrix(snapshots, changed_only)
+
+
+def service_consistency(service: str, timestamp: str = None, min_share: float = 0.5, compare_next_hops: bool = True):
+    """
+    Compare the routes of a service across the devices that carry it.
+    :param service: The service name.
+    :param timestamp: Each device is compared with its latest checkpoint at or before it, the latest when None.
+    :param min_share: A route is expected on every device when at least this share of the devices has it.
+    :param compare_next_hops: Compare the next hops as well as the protocols.
+    :return: A dictionary with the checkpoints compared and the missing and disagreeing routes.
+    """
+    logger.debug("service_consistency")
+    import consistency
+    storage = _get_storage()
+    checkpoints = storage.get_latest_checkpoints(service, timestamp)
+
+    def iter_devices():
+        for hostname, checkpoint in checkpoints.items():
+            for _, rows in storage.iter_route_history(hostname, service, fields=consistency.FIELDS, timestamps=[checkpoint]):
+                yield hostname, rows
+
+    report = consistency.service_consistency(iter_devices(), min_share, compare_next_hops)
+    report["checkpoints"] = checkpoints
+    return report
+
+
+def remote_command_execution(inventory_filename: str, command_filename: str, device_filter: str="all", dry_run_flag: bool = False,
+                             concurrency: int = None, per_proxy: int = None, per_site: int = None,
+                             output_directory: str = None, compression: str = None,
+                             retries: int = 3, retry_delay: float = 5.0, use_breaker: bool = True, metrics_file: str = None,
+                             shards: int = None):
     """
     Gather inventory of devices from a file.
     :param filename: The file to load from.
     :param device_filter: from the inventory file only run it on filtered devices.
     :param dry_run_flag: A flag to enable dry run mode.
+    :param concurrency: Maximum number of devices collected at the same time, collector.DEFAULT_CONCURRENCY when None.
+    :param per_proxy: Maximum number of devices collected at the same time through the same proxy.
+    :param per_site: Maximum number of devices collected at the same time in the same site.
+    :param output_directory: Stream the outputs to a file per device in this directory as they are read,
+        the responses only have the metadata of the files. The outputs are kept in memory when None.
+    :param compression: Compression of the files in output_directory, gzip, xz, bz2 or zstd.
+    :param retries: Attempts to connect a device, the waits between them are jittered and exponential (see backoff.py).
+    :param retry_delay: Maximum wait before the first retry, doubled for every retry.
+    :param use_breaker: Skip the devices and proxies that failed in the previous runs until their cooldown ends.
+    :param metrics_file: Write the summary of the timings of the collection to this JSON file (see metrics.py).
+    :param shards: Collect the devices with this number of processes, balanced with the collection times of the
+        previous runs (see sharding.py). A single process when None or 1.
     :return: None
     """
     logger.debug("remote_command_execution")
+    import yaml_operations
     if device_filter == "all":
         logger.warning("Device filter not yet implemented")
         logger.info("Running on all devices")
@@ -103,6 +383,38 @@ def remote_command_execution(inventory_filename: str, command_filename: str, dev
         logger.info("Dry run mode finished")
         return
 
-    output_list = network_interface.execute_devices_commands(device_list)
+    import collector
+
+    sink = None
+    if output_directory is not None:
+        import output_sinks
+        sink = output_sinks.FileSink(output_directory, compression)
+
+    import metrics
+    import time
+
+    backoff_policy, circuit_breaker = _connection_policy(retries, retry_delay, use_breaker)
+    shard_metrics = None
+    start = time.perf_counter()
+    try:
+        if shards and shards > 1:
+            import sharding
+
+            output_list, shard_metrics = sharding.collect_sharded(
+                device_list, shards, _get_storage().get_device_durations(), concurrency or collector.DEFAULT_CONCURRENCY,
+                per_proxy, per_site, output_directory, compression, backoff_policy, circuit_breaker,
+            )
+        else:
+            output_list = collector.collect_devices(
+                device_list, concurrency or collector.DEFAULT_CONCURRENCY, per_proxy, per_site, sink=sink,
+                backoff_policy=backoff_policy, circuit_breaker=circuit_breaker,
+            )
+    finally:
+        _save_circuit_states(circuit_breaker)
+    summary = metrics.summarize(output_list, time.perf_counter() - start)
+    if shard_metrics is not None:
+        summary["shards"] = shard_metrics
+    _write_metrics(summary, metrics_file)
+    _save_device_durations(output_list)
 
     return output_list
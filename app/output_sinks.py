@@ -0,0 +1,267 @@
+"""
+output_sinks.py streams the outputs of the commands somewhere else than memory while they are read.
+
+Without a sink network_interface keeps the output of every command in the response dictionary,
+the collector holds the outputs of the whole fleet until the scrape ends. With a sink the
+output goes, piece by piece as it arrives from the channel, to:
+    FileSink    a per-device capture file, in the format of formatter.scrape_output_per_device,
+                optionally compressed (gzip, xz, bz2 or zstd) as it is written
+    ParserSink  the streaming parser (netparser.iter_parse_sections), the routes are handed
+                to a callback in batches
+    TeeSink     several sinks at the same time
+and only the metadata of the capture (file, characters per command, routes parsed) is put in
+the response, under "capture", so the memory of the collector doesn't depend on the size of
+the outputs nor the number of devices.
+
+A sink opens a DeviceOutput per device, the commands of a device are written one after the other:
+    device_output = sink.open_device(hostname)
+    device_output.start_command(command)
+    device_output.write(data)           # any number of times
+    device_output.end_command()
+    metadata = device_output.close(complete)    # complete is False when an output was cut short
+"""
+
+import logging
+import os
+import queue
+import threading
+
+import file_operations
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_EXTENSION = {compression: extension for extension, compression in file_operations.COMPRESSION_EXTENSIONS.items()}
+
+# pieces of output waiting for the parser of a device, the reads of the channel block when it falls behind
+PARSER_QUEUE_SIZE = 64
+
+_END_OF_OUTPUT = None
+
+
+class DeviceOutput:
+    """The outputs of the commands of a device, written as they are read"""
+
+    def __init__(self, hostname: str):
+        self.hostname = hostname
+        self.command = None
+        # command: characters of its output
+        self.characters = {}
+
+    def start_command(self, command: str):
+        self.command = command
+        self.characters[command] = 0
+
+    def write(self, data: str):
+        self.characters[self.command] += len(data)
+
+    def end_command(self):
+        self.command = None
+
+    def close(self, complete: bool = True) -> dict:
+        """
+        Finishes the capture of the device, returns its metadata.
+        :param complete: False when the outputs were cut short (a timeout, a disconnect or an error).
+        """
+        return {"characters": self.characters, "complete": complete}
+
+
+class OutputSink:
+    """Receives the outputs of the devices, see the module documentation"""
+
+    def open_device(self, hostname: str) -> DeviceOutput:
+        return DeviceOutput(hostname)
+
+
+def _open_compressed(filename: str, compression: str):
+    """Opens a capture file to be written as text, compressed on the fly"""
+    if compression is None:
+        return open(filename, "w", encoding="utf-8")
+    if compression == "gzip":
+        import gzip
+        return gzip.open(filename, "wt", encoding="utf-8")
+    if compression == "xz":
+        import lzma
+        return lzma.open(filename, "wt", encoding="utf-8")
+    if compression == "bz2":
+        import bz2
+        return bz2.open(filename, "wt", encoding="utf-8")
+    # zstd is not in the standard library before python 3.14, zstandard is an optional dependency
+    try:
+        from compression import zstd
+    except ImportError:
+        zstd = None
+    if zstd is not None:
+        return zstd.open(filename, "wt", encoding="utf-8")
+    try:
+        import zstandard
+    except ImportError:
+        logger.error("Writing zstd captures needs the zstandard package")
+        raise ValueError("Writing zstd captures needs the zstandard package")
+    import io
+    return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(filename, "wb"), closefd=True), encoding="utf-8")
+
+
+class FileDeviceOutput(DeviceOutput):
+
+    def __init__(self, hostname: str, filename: str, compression: str):
+        super().__init__(hostname)
+        self.filename = filename
+        # the capture is written under a temporary name, a capture cut short isn't taken for a complete one
+        self.partial_filename = filename + ".part"
+        self.file = _open_compressed(self.partial_filename, compression)
+
+    def start_command(self, command: str):
+        super().start_command(command)
+        self.file.write(file_operations.COMMAND_PREFIX + command + "\n")
+
+    def write(self, data: str):
+        super().write(data)
+        self.file.write(data)
+
+    def end_command(self):
+        super().end_command()
+        self.file.write("\n")
+
+    def close(self, complete: bool = True) -> dict:
+        """An incomplete capture is left under its .part name, the "file" of the metadata"""
+        self.file.close()
+        metadata = super().close(complete)
+        if not complete:
+            logger.warning(f"hostname: {self.hostname}, incomplete outputs left in {self.partial_filename}")
+            metadata["file"] = self.partial_filename
+            return metadata
+        os.replace(self.partial_filename, self.filename)
+        logger.info(f"hostname: {self.hostname}, outputs written to {self.filename}")
+        metadata["file"] = self.filename
+        return metadata
+
+
+class FileSink(OutputSink):
+    """Writes the outputs of every device to <directory>/<hostname>.txt, with the extension of the compression"""
+
+    def __init__(self, directory: str = ".", compression: str = None):
+        if compression is not None and compression not in COMPRESSION_EXTENSION:
+            raise ValueError(f"Unsupported compression: {compression}, use one of {', '.join(COMPRESSION_EXTENSION)}")
+        self.directory = directory
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, hostname: str) -> str:
+        return os.path.join(self.directory, hostname + ".txt" + COMPRESSION_EXTENSION.get(self.compression, ""))
+
+    def open_device(self, hostname: str) -> DeviceOutput:
+        return FileDeviceOutput(hostname, self.filename(hostname), self.compression)
+
+
+def _iter_lines(pieces: queue.Queue):
+    """The lines of the pieces of output put in the queue, until _END_OF_OUTPUT"""
+    remainder = ""
+    while True:
+        piece = pieces.get()
+        if piece is _END_OF_OUTPUT:
+            break
+        lines = (remainder + piece).splitlines(keepends=True)
+        remainder = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+class ParserDeviceOutput(DeviceOutput):
+    """Parses the outputs of a device in a thread while they are read"""
+
+    def __init__(self, hostname: str, vendor: str, timestamp: str, on_routes, tables: tuple):
+        super().__init__(hostname)
+        self.routes = 0
+        self.error = None
+        self.pieces = queue.Queue(PARSER_QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._parse, args=(vendor, timestamp, on_routes, tables), daemon=True)
+        self.thread.start()
+
+    def _parse(self, vendor, timestamp, on_routes, tables):
+        import netparser
+
+        lines = _iter_lines(self.pieces)
+        try:
+            for routes in netparser.iter_parse_sections(vendor, lines, self.hostname, timestamp, tables=tables):
+                self.routes += len(routes)
+                on_routes(self.hostname, routes)
+        except Exception as exc:
+            logger.error(f"hostname: {self.hostname}, error parsing the outputs: {exc}")
+            logger.debug(f"hostname: {self.hostname}, error parsing the outputs", exc_info=exc)
+            self.error = f"{type(exc).__name__}: {exc}"
+            # the rest of the outputs are read and dropped, the writes must not block
+            for _ in lines:
+                pass
+
+    def start_command(self, command: str):
+        super().start_command(command)
+        self.pieces.put(file_operations.COMMAND_PREFIX + command + "\n")
+
+    def write(self, data: str):
+        super().write(data)
+        self.pieces.put(data)
+
+    def end_command(self):
+        super().end_command()
+        self.pieces.put("\n")
+
+    def close(self, complete: bool = True) -> dict:
+        self.pieces.put(_END_OF_OUTPUT)
+        self.thread.join()
+        metadata = super().close(complete)
+        metadata["routes"] = self.routes
+        if self.error:
+            metadata["parse_error"] = self.error
+        return metadata
+
+
+class ParserSink(OutputSink):
+    """
+    Parses the outputs of every device as they are read, on_routes(hostname, routes) is called
+    with every batch of RouteRecord, from the parser thread of the device.
+    """
+
+    def __init__(self, vendor: str, timestamp: str, on_routes, tables: tuple = ("route",)):
+        self.vendor = vendor
+        self.timestamp = timestamp
+        self.on_routes = on_routes
+        self.tables = tables
+
+    def open_device(self, hostname: str) -> DeviceOutput:
+        return ParserDeviceOutput(hostname, self.vendor, self.timestamp, self.on_routes, self.tables)
+
+
+class TeeDeviceOutput(DeviceOutput):
+
+    def __init__(self, hostname: str, device_outputs: list):
+        super().__init__(hostname)
+        self.device_outputs = device_outputs
+
+    def start_command(self, command: str):
+        for device_output in self.device_outputs:
+            device_output.start_command(command)
+
+    def write(self, data: str):
+        for device_output in self.device_outputs:
+            device_output.write(data)
+
+    def end_command(self):
+        for device_output in self.device_outputs:
+            device_output.end_command()
+
+    def close(self, complete: bool = True) -> dict:
+        metadata = {}
+        for device_output in self.device_outputs:
+            metadata.update(device_output.close(complete))
+        return metadata
+
+
+class TeeSink(OutputSink):
+    """Sends the outputs to several sinks, e.g. to disk and to the parser"""
+
+    def __init__(self, *sinks: OutputSink):
+        self.sinks = sinks
+
+    def open_device(self, hostname: str) -> DeviceOutput:
+        return TeeDeviceOutput(hostname, [sink.open_device(hostname) for sink in self.sinks])
@@ -0,0 +1,144 @@
+"""
+pipeline.py runs the ingestion of a capture as a pipeline instead of load, parse and save
+as sequential steps over the whole file.
+
+    producer thread: parse -> fixed size batches -> bounded queue -> writer (calling thread): save
+
+The producer thread consumes the batches generator (the parser), the writer runs in the
+calling thread because the SQLite connection can only be used by the thread that created it.
+The queue is bounded, when the writer falls behind the producer blocks (backpressure), so at
+most queue_size batches are held in memory no matter the size of the capture.
+
+Each stage counts the routes it handled, the time it was busy and the time it waited on
+the other stage, the counters are logged at the end of the load.
+"""
+
+import logging
+import threading
+import time
+from queue import Queue
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+QUEUE_SIZE = 8
+
+_END_OF_BATCHES = None
+
+
+class StageCounters:
+    __slots__ = ("name", "routes", "batches", "busy_seconds", "wait_seconds")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.routes = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    @property
+    def routes_per_second(self) -> float:
+        return self.routes / self.busy_seconds if self.busy_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "routes": self.routes,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "wait_seconds": round(self.wait_seconds, 4),
+            "routes_per_second": round(self.routes_per_second, 1),
+        }
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.routes} routes in {self.batches} batches, busy {self.busy_seconds:.3f}s "
+            f"({self.routes_per_second:.0f} routes/s), waited {self.wait_seconds:.3f}s"
+        )
+
+
+def rebatch(batches, batch_size: int = BATCH_SIZE):
+    """Regroups an iterable of lists into lists of batch_size items, empty lists are dropped"""
+    batch = []
+    for items in batches:
+        batch.extend(items)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+
+def _producer(batches, batch_size, queue, counters, stop):
+    try:
+        iterator = rebatch(batches, batch_size)
+        while not stop.is_set():
+            start = time.perf_counter()
+            batch = next(iterator, _END_OF_BATCHES)
+            counters.busy_seconds += time.perf_counter() - start
+            if batch is _END_OF_BATCHES:
+                break
+            counters.routes += len(batch)
+            counters.batches += 1
+
+            start = time.perf_counter()
+            queue.put(batch)
+            counters.wait_seconds += time.perf_counter() - start
+    except Exception as exc:
+        logger.debug("Pipeline producer failed", exc_info=exc)
+        queue.put(exc)
+        return
+    queue.put(_END_OF_BATCHES)
+
+
+def ingest(batches, save_batch, batch_size: int = BATCH_SIZE, queue_size: int = QUEUE_SIZE) -> dict:
+    """
+    Runs the pipeline.
+    :param batches: iterable of lists of routes, e.g. netparser.iter_parse, consumed in the producer thread
+    :param save_batch: function called with every batch of routes in the calling thread, e.g. storage.save_routes
+    :param batch_size: number of routes of every batch handed to save_batch
+    :param queue_size: maximum number of batches waiting to be saved
+    :return: dict with the counters of each stage, {"parse": {...}, "write": {...}, "total_seconds": n}
+    """
+    logger.debug("ingest")
+    queue = Queue(maxsize=queue_size)
+    stop = threading.Event()
+    parse_counters = StageCounters("parse")
+    write_counters = StageCounters("write")
+
+    start_time = time.perf_counter()
+    producer = threading.Thread(
+        target=_producer, args=(batches, batch_size, queue, parse_counters, stop), name="pipeline-producer", daemon=True
+    )
+    producer.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            batch = queue.get()
+            write_counters.wait_seconds += time.perf_counter() - start
+            if batch is _END_OF_BATCHES:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+
+            start = time.perf_counter()
+            save_batch(batch)
+            write_counters.busy_seconds += time.perf_counter() - start
+            write_counters.routes += len(batch)
+            write_counters.batches += 1
+    finally:
+        # On a writer error stop and unblock the producer so the thread can finish
+        stop.set()
+        while producer.is_alive():
+            while not queue.empty():
+                queue.get_nowait()
+            producer.join(timeout=0.1)
+    total_seconds = time.perf_counter() - start_time
+
+    logger.info(str(parse_counters))
+    logger.info(str(write_counters))
+    logger.info(f"Pipeline finished in {total_seconds:.3f}s, {write_counters.routes / total_seconds if total_seconds else 0:.0f} routes/s")
+    return {
+        "parse": parse_counters.to_dict(),
+        "write": write_counters.to_dict(),
+        "total_seconds": round(total_seconds, 4),
+    }
@@ -0,0 +1,78 @@
+"""
+prefixes.py normalizes the route prefixes at ingest.
+
+The same network can be written in several ways, 10.0.0.0/24, 10.0.0.0/255.255.255.0 or with
+host bits set as 10.0.0.5/24, and IPv6 addresses have several text forms. Routes are compared
+by their prefix string, so every prefix is stored in a canonical form:
+    network address (host bits cleared) / prefix length
+    IPv4 in dotted quad, IPv6 in the compressed form of RFC 5952 (socket.inet_ntop)
+together with a binary key that sorts the prefixes numerically:
+    version (1 byte, 4 or 6) + network address (4 or 16 bytes) + prefix length (1 byte)
+
+Creating an ipaddress.ip_network object per route is slow for tables of millions of routes,
+the prefixes are converted with the socket codecs (implemented in C) and integer masks that
+are precomputed, about four times faster. Strings that aren't an IP prefix (e.g. a BGP route
+distinguisher prefix) are kept as they are, with no key.
+"""
+
+import socket
+
+_IPV4_MASKS = [((1 << 32) - 1) ^ ((1 << (32 - length)) - 1) for length in range(33)]
+_IPV6_MASKS = [((1 << 128) - 1) ^ ((1 << (128 - length)) - 1) for length in range(129)]
+# dotted quad masks, "255.255.255.0": 24, only contiguous masks are valid
+_IPV4_MASK_LENGTHS = {socket.inet_ntoa(mask.to_bytes(4, "big")): length for length, mask in enumerate(_IPV4_MASKS)}
+
+_VERSION_4 = b"\x04"
+_VERSION_6 = b"\x06"
+_LENGTHS = [bytes((length,)) for length in range(129)]
+
+
+def normalize_prefix(prefix: str) -> tuple:
+    """
+    Returns (canonical prefix, key) for prefix, e.g.
+        "10.32.219.5/24" -> ("10.32.219.0/24", b"\\x04\\x0a\\x20\\xdb\\x00\\x18")
+    A prefix without a length is a host route. Anything that isn't an IPv4 or IPv6
+    prefix is returned as (prefix, None).
+    """
+    if not prefix:
+        return prefix, None
+    address, _, length = prefix.partition("/")
+    try:
+        if ":" in address:
+            packed = socket.inet_pton(socket.AF_INET6, address)
+            value = int.from_bytes(packed, "big")
+            length = int(length) if length else 128
+            if not 0 <= length <= 128:
+                return prefix, None
+            value &= _IPV6_MASKS[length]
+            packed = value.to_bytes(16, "big")
+            return f"{socket.inet_ntop(socket.AF_INET6, packed)}/{length}", _VERSION_6 + packed + _LENGTHS[length]
+
+        packed = socket.inet_pton(socket.AF_INET, address)
+        if not length:
+            length = 32
+        elif "." in length:
+            length = _IPV4_MASK_LENGTHS[length]
+        else:
+            length = int(length)
+            if not 0 <= length <= 32:
+                return prefix, None
+        value = int.from_bytes(packed, "big") & _IPV4_MASKS[length]
+        packed = value.to_bytes(4, "big")
+        return f"{socket.inet_ntoa(packed)}/{length}", _VERSION_4 + packed + _LENGTHS[length]
+    except (OSError, ValueError, KeyError):
+        return prefix, None
+
+
+def normalize_routes(routes: list) -> list:
+    """Normalizes in place the prefix of a batch of RouteRecord and sets their prefix_key"""
+    for route in routes:
+        route.route, route.prefix_key = normalize_prefix(route.route)
+    return routes
+
+
+def prefix_from_key(key: bytes) -> str:
+    """Returns the canonical prefix of a key created by normalize_prefix"""
+    if key[:1] == _VERSION_6:
+        return f"{socket.inet_ntop(socket.AF_INET6, key[1:17])}/{key[17]}"
+    return f"{socket.inet_ntoa(key[1:5])}/{key[5]}"
@@ -0,0 +1,90 @@
+"""
+route_matrix.py compares the routes of a device and service across any number of checkpoints.
+
+Reviewing a change needs the routes before, during and after it and the next morning. Chaining
+two way compares loads every checkpoint in the middle twice. The matrix reads the requested
+checkpoints once (storage.iter_route_history, a single query), keeps per prefix the state it
+had in each checkpoint and yields one row per prefix, so the work is proportional to the
+number of routes of the checkpoints and the rows can be written out as they are produced.
+
+The state of a prefix in a checkpoint is the set of its (route_protocol, next_hop, metric)
+entries, more than one with ECMP, None when it isn't in the checkpoint. Between two adjacent
+checkpoints the row has a marker:
+    =   same state
+    ~   changed next hops, metrics or protocols
+    +   added
+    -   removed
+        not in either checkpoint
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("route", "route_protocol", "next_hop", "metric")
+
+SAME = "="
+CHANGED = "~"
+ADDED = "+"
+REMOVED = "-"
+ABSENT = " "
+
+
+def change_marker(before: frozenset, after: frozenset) -> str:
+    """The marker between the states of a prefix in two adjacent checkpoints"""
+    if before is None:
+        return ABSENT if after is None else ADDED
+    if after is None:
+        return REMOVED
+    return SAME if before == after else CHANGED
+
+
+def format_state(state: frozenset) -> str:
+    """Text of a state, the entries as 'protocol next_hop metric' separated by ';'"""
+    if state is None:
+        return ""
+    return ";".join(sorted(" ".join(str(value) for value in entry) for entry in state))
+
+
+def iter_route_matrix(snapshots, changed_only: bool = False):
+    """
+    Compares the routes of the checkpoints.
+    :param snapshots: (timestamp, rows) per checkpoint from the oldest, the rows are tuples of FIELDS,
+        as storage.iter_route_history(..., fields=route_matrix.FIELDS, timestamps=...) yields them.
+    :param changed_only: Skip the prefixes with the same state in all the checkpoints.
+    :return: The timestamps of the checkpoints and an iterator of rows, the prefixes in the order they
+        are first seen: {"route": route, "states": [state per checkpoint], "changes": [marker per pair]}
+    """
+    logger.debug("iter_route_matrix")
+    timestamps = []
+    # route: [state per checkpoint loaded so far], lists shorter than timestamps end with absences
+    states_by_route = {}
+    for column, (timestamp, rows) in enumerate(snapshots):
+        timestamps.append(timestamp)
+        entries_by_route = {}
+        for route, route_protocol, next_hop, metric in rows:
+            entries = entries_by_route.get(route)
+            if entries is None:
+                entries_by_route[route] = [(route_protocol, next_hop, metric)]
+            else:
+                entries.append((route_protocol, next_hop, metric))
+        for route, entries in entries_by_route.items():
+            states = states_by_route.get(route)
+            if states is None:
+                states = states_by_route[route] = [None] * column
+            elif len(states) < column:
+                states.extend([None] * (column - len(states)))
+            states.append(frozenset(entries))
+    logger.info(f"Route matrix of {len(timestamps)} checkpoints and {len(states_by_route)} prefixes")
+
+    def iter_rows():
+        columns = len(timestamps)
+        for route, states in states_by_route.items():
+            if len(states) < columns:
+                states.extend([None] * (columns - len(states)))
+            changes = [change_marker(before, after) for before, after in zip(states, states[1:])]
+            if changed_only and all(marker == SAME for marker in changes):
+                continue
+            yield {"route": route, "states": states, "changes": changes}
+
+    return timestamps, iter_rows()
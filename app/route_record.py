@@ -0,0 +1,187 @@
+"""
+route_record.py defines the record used to carry a single route through parsing,
+storage reads and route comparisons.
+
+A route table can hold millions of entries. Keeping every entry as a dictionary with
+a dozen string keys costs several hundred bytes per route in bookkeeping alone, so
+RouteRecord uses __slots__ (a fixed size object with no per instance dictionary) and
+interns the low cardinality values (hostname, service, timestamp, flags, type,
+protocol, preference, next hops and metrics). A million routes learnt from a handful
+of next hops then share a handful of string objects for those fields.
+
+RouteRecord keeps a small mapping interface so the code written for route
+dictionaries keeps working:
+    route["next_hop"], route.get("metric"), route.keys(), dict(route)
+
+The values computed at ingest, prefix_key (the binary key of the normalized prefix, see
+prefixes.py), age_seconds and installed_at (see ages.py), are attributes of the record
+but not fields, the mapping interface doesn't show them.
+"""
+
+import sys
+
+FIELDS = (
+    "id",
+    "hostname",
+    "service",
+    "timestamp",
+    "route",
+    "flags",
+    "route_type",
+    "route_protocol",
+    "age",
+    "preference",
+    "next_hop",
+    "interface_next_hop",
+    "metric",
+)
+
+# Values repeated over and over in a route table, those are interned when a record is created
+INTERNED_FIELDS = (
+    "hostname",
+    "service",
+    "timestamp",
+    "flags",
+    "route_type",
+    "route_protocol",
+    "preference",
+    "next_hop",
+    "interface_next_hop",
+    "metric",
+)
+
+# Values computed at ingest, stored after FIELDS
+COMPUTED_ATTRIBUTES = (
+    "prefix_key",
+    "age_seconds",
+    "installed_at",
+)
+
+_intern = sys.intern
+
+
+def intern_value(value):
+    """Interns strings, any other value (None, int) is returned as is"""
+    if value.__class__ is str:
+        return _intern(value)
+    return value
+
+
+class RouteRecord:
+    __slots__ = FIELDS + COMPUTED_ATTRIBUTES
+
+    def __init__(
+        self,
+        route=None,
+        flags=None,
+        route_type=None,
+        route_protocol=None,
+        age=None,
+        preference=None,
+        next_hop=None,
+        interface_next_hop=None,
+        metric=None,
+        hostname=None,
+        service=None,
+        timestamp=None,
+        id=None,
+        prefix_key=None,
+        age_seconds=None,
+        installed_at=None,
+    ):
+        self.id = id
+        self.hostname = intern_value(hostname)
+        self.service = intern_value(service)
+        self.timestamp = intern_value(timestamp)
+        self.route = route
+        self.flags = intern_value(flags)
+        self.route_type = intern_value(route_type)
+        self.route_protocol = intern_value(route_protocol)
+        self.age = age
+        self.preference = intern_value(preference)
+        self.next_hop = intern_value(next_hop)
+        self.interface_next_hop = intern_value(interface_next_hop)
+        self.metric = intern_value(metric)
+        self.prefix_key = prefix_key
+        self.age_seconds = age_seconds
+        self.installed_at = installed_at
+
+    @classmethod
+    def from_dict(cls, route_dict: dict):
+        """Creates a record from a route dictionary, unknown keys are ignored"""
+        return cls(**{field: route_dict.get(field) for field in FIELDS})
+
+    @classmethod
+    def from_row(cls, row: tuple):
+        """
+        Creates a record from a database row with the columns in FIELDS order,
+        optionally followed by the COMPUTED_ATTRIBUTES columns
+        """
+        record = cls(*row[4:len(FIELDS)], hostname=row[1], service=row[2], timestamp=row[3], id=row[0])
+        for attribute, value in zip(COMPUTED_ATTRIBUTES, row[len(FIELDS):]):
+            setattr(record, attribute, value)
+        return record
+
+    @classmethod
+    def from_parse_results(cls, entry, hostname=None, service=None, timestamp=None):
+        """Creates a record from a pyparsing.ParseResults group returned by the grammars"""
+        get = entry.get
+        return cls(
+            get("route"),
+            get("flags"),
+            get("route_type"),
+            get("route_protocol"),
+            get("age"),
+            get("preference"),
+            get("next_hop"),
+            get("interface_next_hop"),
+            get("metric"),
+            hostname=hostname,
+            service=service,
+            timestamp=timestamp,
+        )
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in FIELDS}
+
+    # Mapping interface, kept for the code that handles routes as dictionaries
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in FIELDS:
+            raise KeyError(key)
+        if key in INTERNED_FIELDS:
+            value = intern_value(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in FIELDS
+
+    def get(self, key, default=None):
+        """
+        Same as dict.get, a field set to None is considered missing and returns the default.
+        This matches the behaviour of the pyparsing.ParseResults used before RouteRecord.
+        """
+        if key not in FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def keys(self):
+        return FIELDS
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in FIELDS]
+
+    def __eq__(self, other):
+        if not isinstance(other, RouteRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in FIELDS)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"RouteRecord({self.to_dict()})"
@@ -0,0 +1,203 @@
+"""
+sessions.py keeps the SSH sessions of the devices open between collections.
+
+A scrape connects to every device, with the SSH handshake, the authentication and the proxy
+connection, sends the commands and forgets the session. Polling a large fleet every few minutes
+spends most of its time connecting. A SessionPool keeps the authenticated sessions (and the proxy
+sockets under them) and gives them back to the next collection of the same device:
+    - a session is used by one collection at a time, it is taken from the pool and given back
+    - a session idle for more than health_check_seconds is checked (is_alive) before it is used,
+      a dead session is closed and the device connected again
+    - a session that failed a command (e.g. a read timeout) is closed instead of given back,
+      the channel could still have the rest of the output
+    - the sessions are opened with an SSH keepalive so the proxies and firewalls don't drop them
+      between collections
+
+run_daemon collects the fleet every interval with the same pool, e.g. a checkpoint every 15 minutes
+(orchestrator.fetch_daemon).
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_SECONDS = 60
+KEEPALIVE_SECONDS = 30
+
+
+class PooledSession:
+    __slots__ = ("connection", "last_used")
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.last_used = time.monotonic()
+
+
+def _session_key(hostname: str, device_dict: dict) -> tuple:
+    return hostname, device_dict.get("ip"), device_dict.get("port"), device_dict.get("username")
+
+
+def _disconnect(connection):
+    try:
+        connection.disconnect()
+    except Exception as exc:
+        logger.debug("Error closing a session", exc_info=exc)
+
+
+def _is_alive(connection) -> bool:
+    try:
+        return connection.is_alive()
+    except Exception:
+        return False
+
+
+class SessionPool:
+    """The open sessions of the devices, see the module documentation"""
+
+    def __init__(self, connect_function=None, health_check_seconds: float = HEALTH_CHECK_SECONDS,
+                 keepalive_seconds: int = KEEPALIVE_SECONDS):
+        """
+        :param connect_function: Connects a device, (hostname, device_dict, attempts, metrics=None) -> (connection,
+            error response), network_interface.connect_device when None.
+        :param health_check_seconds: Sessions idle for longer are checked before they are used.
+        :param keepalive_seconds: SSH keepalive interval of the sessions opened, none when 0.
+        """
+        if connect_function is None:
+            import network_interface
+            connect_function = network_interface.connect_device
+        self.connect_function = connect_function
+        self.health_check_seconds = health_check_seconds
+        self.keepalive_seconds = keepalive_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.reuses = 0
+        self.reconnects = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _connect(self, hostname: str, device_dict: dict, attempts: int, metrics: dict = None):
+        # the connect function modifies the dictionary (the proxy becomes a socket), a copy is kept for reconnecting
+        connect_arguments = dict(device_dict)
+        if self.keepalive_seconds:
+            connect_arguments.setdefault("keepalive", self.keepalive_seconds)
+        with self._lock:
+            self.connects += 1
+        return self.connect_function(hostname, connect_arguments, attempts, metrics=metrics)
+
+    def acquire(self, hostname: str, device_dict: dict, attempts: int = 3, metrics: dict = None) -> tuple:
+        """
+        Takes the session of a device from the pool, or connects the device.
+        :param device_dict: The arguments of ConnectHandler, see network_interface.connect_device.
+        :param attempts: Attempts to connect the device when there is no session.
+        :param metrics: Dictionary the timings of the connection are added to, "reused" when the session is reused.
+        :return: (connection, None) or (None, error response dictionary) if the device can't be connected.
+        """
+        with self._lock:
+            session = self._sessions.pop(_session_key(hostname, device_dict), None)
+        if session is None:
+            return self._connect(hostname, device_dict, attempts, metrics)
+        if time.monotonic() - session.last_used > self.health_check_seconds and not _is_alive(session.connection):
+            logger.info(f"hostname: {hostname}, session is not alive, connecting again")
+            _disconnect(session.connection)
+            with self._lock:
+                self.reconnects += 1
+            return self._connect(hostname, device_dict, attempts, metrics)
+        with self._lock:
+            self.reuses += 1
+        if metrics is not None:
+            metrics["reused"] = True
+        return session.connection, None
+
+    def release(self, hostname: str, device_dict: dict, connection, healthy: bool = True):
+        """Gives back the session of a device, it is closed if it isn't healthy"""
+        if not healthy:
+            logger.info(f"hostname: {hostname}, closing the session after an error")
+            _disconnect(connection)
+            return
+        key = _session_key(hostname, device_dict)
+        with self._lock:
+            previous = self._sessions.get(key)
+            self._sessions[key] = PooledSession(connection)
+        # the device was collected twice at the same time, only one session is kept
+        if previous is not None:
+            _disconnect(previous.connection)
+
+    def check_sessions(self) -> int:
+        """Checks the idle sessions and closes the dead ones, returns the number of sessions closed"""
+        logger.debug("check_sessions")
+        now = time.monotonic()
+        with self._lock:
+            idle = [(key, session) for key, session in self._sessions.items() if now - session.last_used > self.health_check_seconds]
+        closed = 0
+        for key, session in idle:
+            if _is_alive(session.connection):
+                continue
+            with self._lock:
+                if self._sessions.get(key) is not session:
+                    continue
+                del self._sessions[key]
+            _disconnect(session.connection)
+            closed += 1
+        if closed:
+            logger.info(f"Closed {closed} dead sessions of {len(idle)} idle sessions")
+        return closed
+
+    def close(self):
+        """Closes all the sessions"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            _disconnect(session.connection)
+        logger.info(f"Closed {len(sessions)} sessions")
+
+    def collect_device(self, device_dict: dict, sink=None) -> dict:
+        """network_interface.collect_device with the sessions of the pool"""
+        import network_interface
+        return network_interface.collect_device(device_dict, sink, session_pool=self)
+
+    def execute_devices_commands(self, devices: list, concurrency: int = None, sink=None) -> list:
+        """
+        Collects the devices with the sessions of the pool, the responses have the format of
+        network_interface.execute_devices_commands.
+        """
+        logger.debug("execute_devices_commands")
+        import collector
+        return collector.collect_devices(devices, concurrency or collector.DEFAULT_CONCURRENCY,
+                                         collect_function=self.collect_device, sink=sink)
+
+
+def run_daemon(session_pool: SessionPool, collect_cycle, interval_seconds: float, cycles: int = None, sleep=time.sleep) -> int:
+    """
+    Runs collect_cycle every interval_seconds, until cycles were run or it is interrupted (Ctrl-C).
+    The dead sessions of the pool are closed before every cycle, all of them at the end. A cycle that
+    raises is logged and the daemon goes on with the next one.
+    :param collect_cycle: Called with the number of the cycle, from 0, collects the devices with the pool.
+    :return: The number of cycles run.
+    """
+    logger.debug("run_daemon")
+    cycle = 0
+    try:
+        while cycles is None or cycle < cycles:
+            start = time.monotonic()
+            session_pool.check_sessions()
+            try:
+                collect_cycle(cycle)
+            except Exception as exc:
+                logger.error(f"Cycle {cycle + 1} failed: {type(exc).__name__}: {exc}")
+                logger.debug(f"Cycle {cycle + 1} failed", exc_info=exc)
+            cycle += 1
+            logger.info(f"Cycle {cycle} finished in {time.monotonic() - start:.2f} seconds, {len(session_pool)} sessions open, "
+                        f"{session_pool.connects} connects, {session_pool.reuses} sessions reused, {session_pool.reconnects} reconnects")
+            if cycles is not None and cycle >= cycles:
+                break
+            sleep(max(0.0, interval_seconds - (time.monotonic() - start)))
+    except KeyboardInterrupt:
+        logger.info(f"Daemon interrupted after {cycle} cycles")
+    finally:
+        session_pool.close()
+    return cycle
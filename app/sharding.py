@@ -0,0 +1,156 @@
+"""
+sharding.py collects very large inventories with several processes.
+
+A single process runs the SSH encryption and the decoding of the outputs of every session with
+one CPU, the GIL serializes them, with thousands of devices the collector is CPU bound long before
+the network is busy. collect_sharded partitions the devices in shards, each one collected by
+collector.collect_devices in its own process with its share of the concurrency, and merges the
+responses and the circuit breaker states of the shards in the calling process.
+
+The shards are balanced with the collection times of the previous runs (storage.get_device_durations):
+the longest devices first, each one to the shard with the least estimated time so far. The devices
+without history count as the median of the known ones, every device counts the same on the first run.
+The devices behind the same jump host stay in the same shard, they share its SSH connections
+(bastions.py), and with a per_proxy limit so do the devices behind the same SOCKS proxy, the limit
+is enforced by a single process. The concurrency and the per_site limit are divided between the shards.
+
+The shard processes are spawned, like the parse processes of fetch.py, the responses of a shard
+come back when the whole shard is collected.
+"""
+
+import concurrent.futures
+import heapq
+import logging
+import math
+import multiprocessing
+import statistics
+import time
+
+import backoff
+import collector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS = 1.0
+
+
+def _group_key(device: dict, group_proxies: bool):
+    key = backoff.proxy_key(device)
+    if key is not None and (group_proxies or key.startswith("jump_host:")):
+        return key
+    return None
+
+
+def partition(devices: list, shards: int, durations: dict = None, group_proxies: bool = False) -> list:
+    """
+    Splits the devices in shards of about the same estimated collection time.
+    :param devices: The device dictionaries.
+    :param shards: Maximum number of shards, there are no empty shards.
+    :param durations: {hostname: seconds} collection times of the previous runs.
+    :param group_proxies: Keep the devices behind the same SOCKS proxy in the same shard, the ones
+        behind the same jump host always are.
+    :return: [{"devices": [device, ...], "estimated_seconds": seconds}, ...]
+    """
+    logger.debug("partition")
+    durations = durations or {}
+    known = [durations[device.get("hostname")] for device in devices if device.get("hostname") in durations]
+    default_seconds = statistics.median(known) if known else DEFAULT_SECONDS
+    groups = {}
+    for index, device in enumerate(devices):
+        key = _group_key(device, group_proxies) or index
+        group = groups.setdefault(key, {"devices": [], "estimated_seconds": 0.0})
+        group["devices"].append(device)
+        group["estimated_seconds"] += durations.get(device.get("hostname"), default_seconds)
+
+    result = [{"devices": [], "estimated_seconds": 0.0} for _ in range(max(1, min(shards, len(groups))))]
+    loads = [(0.0, index) for index in range(len(result))]
+    for group in sorted(groups.values(), key=lambda group: group["estimated_seconds"], reverse=True):
+        load, index = heapq.heappop(loads)
+        result[index]["devices"].extend(group["devices"])
+        result[index]["estimated_seconds"] += group["estimated_seconds"]
+        heapq.heappush(loads, (load + group["estimated_seconds"], index))
+    for shard in result:
+        shard["estimated_seconds"] = round(shard["estimated_seconds"], 3)
+    return [shard for shard in result if shard["devices"]]
+
+
+def _collect_shard(devices: list, concurrency: int, per_proxy: int, per_site: int, output_directory: str,
+                   compression: str, backoff_policy: backoff.BackoffPolicy, circuit_breaker: backoff.CircuitBreaker) -> tuple:
+    """Runs in a shard process: (responses, changed circuit states, wall seconds, CPU seconds)"""
+    sink = None
+    if output_directory is not None:
+        import output_sinks
+        sink = output_sinks.FileSink(output_directory, compression)
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    responses = collector.collect_devices(devices, concurrency, per_proxy, per_site, sink=sink,
+                                          backoff_policy=backoff_policy, circuit_breaker=circuit_breaker)
+    changed_states = circuit_breaker.changed_states() if circuit_breaker is not None else {}
+    return responses, changed_states, time.perf_counter() - start, time.process_time() - cpu_start
+
+
+def _merge_states(merged: dict, states: dict):
+    """The state with the most failures wins when several shards changed the same key (a shared proxy)"""
+    for key, state in states.items():
+        current = merged.get(key)
+        if key not in merged or (state is not None and (current is None or state[0] > current[0])):
+            merged[key] = state
+
+
+def collect_sharded(devices: list, shards: int, durations: dict = None, concurrency: int = collector.DEFAULT_CONCURRENCY,
+                    per_proxy: int = None, per_site: int = None, output_directory: str = None, compression: str = None,
+                    backoff_policy: backoff.BackoffPolicy = None, circuit_breaker: backoff.CircuitBreaker = None) -> tuple:
+    """
+    Collects the devices with a process per shard.
+    :param devices: The device dictionaries, see collector.collect_devices.
+    :param shards: Number of shard processes.
+    :param durations: {hostname: seconds} collection times of the previous runs, to balance the shards.
+    :param concurrency: Maximum number of devices collected at the same time by all the shards.
+    :param per_proxy: Maximum number of devices collected at the same time through the same proxy.
+    :param per_site: Maximum number of devices collected at the same time in the same site, by all the shards.
+    :param output_directory: Stream the outputs to a file per device in this directory (output_sinks.FileSink).
+    :param compression: Compression of the files in output_directory.
+    :param backoff_policy: The attempts to connect a device, see collector.collect_devices.
+    :param circuit_breaker: Sent to every shard, the states the shards changed are applied to it.
+    :return: (responses of all the devices, shard by shard, [{"devices", "estimated_seconds", "wall_seconds",
+        "cpu_seconds", "error"} of every shard])
+    """
+    logger.debug("collect_sharded")
+    partitions = partition(devices, shards, durations, group_proxies=per_proxy is not None)
+    shard_concurrency = max(1, math.ceil(concurrency / len(partitions)))
+    shard_per_site = max(1, math.ceil(per_site / len(partitions))) if per_site else per_site
+    logger.info(f"Collecting {len(devices)} devices in {len(partitions)} shards of "
+                f"{[len(shard['devices']) for shard in partitions]} devices, concurrency {shard_concurrency} each")
+
+    responses = []
+    shard_metrics = []
+    changed_states = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(partitions), mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(_collect_shard, shard["devices"], shard_concurrency, per_proxy, shard_per_site,
+                            output_directory, compression, backoff_policy, circuit_breaker)
+            for shard in partitions
+        ]
+        for index, (shard, future) in enumerate(zip(partitions, futures)):
+            metrics = {"devices": len(shard["devices"]), "estimated_seconds": shard["estimated_seconds"],
+                       "wall_seconds": None, "cpu_seconds": None, "error": ""}
+            try:
+                shard_responses, states, wall_seconds, cpu_seconds = future.result()
+            except Exception as exc:
+                logger.error(f"Shard {index} failed, its {len(shard['devices'])} devices weren't collected: {exc}")
+                logger.debug(f"Shard {index} failed", exc_info=exc)
+                metrics["error"] = type(exc).__name__
+                shard_responses = [{"hostname": device.get("hostname"), "ip": device.get("ip"), "output": {}, "error": "ShardFailed,"}
+                                   for device in shard["devices"]]
+                states = {}
+            else:
+                metrics["wall_seconds"] = round(wall_seconds, 3)
+                metrics["cpu_seconds"] = round(cpu_seconds, 3)
+                logger.info(f"Shard {index}: {len(shard_responses)} devices in {wall_seconds:.2f} seconds "
+                            f"({cpu_seconds:.2f} CPU seconds, {shard['estimated_seconds']:.2f} estimated device seconds)")
+            responses.extend(shard_responses)
+            shard_metrics.append(metrics)
+            _merge_states(changed_states, states)
+    if circuit_breaker is not None:
+        circuit_breaker.update(changed_states)
+    return responses, shard_metrics
@@ -37,9 +37,16 @@ the comparison timestamps are user selectable.
 
 import sqlite3
 import datetime
+import itertools
+import json
+import operator
 import logging
 logger = logging.getLogger(__name__)  # Get a logger for the 'storage' module
 
+import ages
+import prefixes
+from route_record import RouteRecord, FIELDS as ROUTE_FIELDS, COMPUTED_ATTRIBUTES
+
 database_url = "routes.sqlite3"
 
 class DatabaseConnection:
@@ -79,9 +86,33 @@ class DatabaseConnection:
             if database_connection is not None:
                 cursor = database_connection.cursor()
                 cursor.execute("DROP TABLE IF EXISTS igp_routes")
+                cursor.execute("DROP TABLE IF EXISTS parse_stats")
+                cursor.execute("DROP TABLE IF EXISTS circuit_breaker")
+                cursor.execute("DROP TABLE IF EXISTS device_durations")
                 database_connection.commit()
         DatabaseConnection.__instance = None
 
+def _migrate_igp_routes(cursor):
+    """Databases created by older versions, adds the columns computed at ingest and fills them for the stored routes"""
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(igp_routes)")]
+    if "prefix_key" not in columns:
+        logger.info("Adding the prefix_key column to igp_routes and normalizing the stored prefixes")
+        cursor.execute("ALTER TABLE igp_routes ADD COLUMN prefix_key BLOB")
+        rows = cursor.execute("SELECT id, route FROM igp_routes").fetchall()
+        cursor.executemany(
+            "UPDATE igp_routes SET route=?, prefix_key=? WHERE id=?",
+            [prefixes.normalize_prefix(route) + (id,) for id, route in rows],
+        )
+    if "installed_at" not in columns:
+        logger.info("Adding the age_seconds and installed_at columns to igp_routes")
+        cursor.execute("ALTER TABLE igp_routes ADD COLUMN age_seconds INTEGER")
+        cursor.execute("ALTER TABLE igp_routes ADD COLUMN installed_at INTEGER")
+        rows = cursor.execute("SELECT id, age, timestamp FROM igp_routes").fetchall()
+        cursor.executemany(
+            "UPDATE igp_routes SET age_seconds=?, installed_at=? WHERE id=?",
+            [ages.install_time(age, timestamp) + (id,) for id, age, timestamp in rows],
+        )
+
 # Function to initialize the database
 def initialize_database(db_url: str = database_url):
     """Creates necessary tables if they don't exist"""
@@ -108,7 +139,50 @@ def initialize_database(db_url: str = database_url):
                 preference TEXT,
                 next_hop TEXT,
                 interface_next_hop TEXT,
-                metric TEXT
+                metric TEXT,
+                prefix_key BLOB,                    -- normalized prefix, see prefixes.py
+                age_seconds INTEGER,                -- see ages.py
+                installed_at INTEGER                -- epoch seconds, timestamp - age
+            )
+        """
+        )
+        _migrate_igp_routes(cursor)
+        # routes (re)installed in a time window of a snapshot
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS igp_routes_installed_at ON igp_routes (hostname, timestamp, installed_at)"
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS parse_stats (
+                hostname TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                source TEXT,
+                lines_scanned INTEGER,
+                entries_matched INTEGER,
+                skipped_in_table INTEGER,
+                skipped_outside_table INTEGER,
+                rejected INTEGER,
+                rejected_samples TEXT,               -- JSON list of lines
+                PRIMARY KEY (hostname, timestamp)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS circuit_breaker (
+                key TEXT PRIMARY KEY,                -- device:<hostname> or proxy:<addr>:<port>, see backoff.py
+                failures INTEGER NOT NULL,           -- consecutive failures
+                last_failure REAL,                   -- epoch seconds
+                last_error TEXT
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS device_durations (
+                hostname TEXT PRIMARY KEY,
+                seconds REAL NOT NULL,               -- moving average of the collection time, see sharding.py
+                samples INTEGER NOT NULL
             )
         """
         )
@@ -117,25 +191,43 @@ def initialize_database(db_url: str = database_url):
 
 
 
+def _route_prefix(route) -> tuple:
+    """(prefix, prefix_key) of a route, records normalized by the parser are not normalized again"""
+    prefix_key = getattr(route, "prefix_key", None)
+    if prefix_key is not None:
+        return route.route, prefix_key
+    return prefixes.normalize_prefix(route.get("route"))
+
+def _route_install_time(route, timestamp: str) -> tuple:
+    """(age_seconds, installed_at) of a route, records normalized by the parser are not converted again"""
+    age_seconds = getattr(route, "age_seconds", None)
+    installed_at = getattr(route, "installed_at", None)
+    if age_seconds is not None and installed_at is not None:
+        return age_seconds, installed_at
+    return ages.install_time(route.get("age"), timestamp)
+
 def save_routes(
     timestamp: str, routes: list,
 ) -> None:
-    """Stores routes with a given timestamp in the SQLite database"""
+    """Stores routes with a given timestamp in the SQLite database, with their prefixes normalized"""
     logger.debug("save_routes")
+    if not routes:
+        logger.debug(f"No routes to save with timestamp {timestamp}")
+        return
     with DatabaseConnection.get_instance().get_connection() as database_connection:
         cursor = database_connection.cursor()
         logger.debug(f"Saving routes with timestamp {timestamp}")
         logger.debug(f"first route: {routes[0]}")
         cursor.executemany(
             """
-            INSERT INTO igp_routes (hostname, service, timestamp, route, flags, route_type, route_protocol, age, preference, next_hop, interface_next_hop, metric) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            INSERT INTO igp_routes (hostname, service, timestamp, route, prefix_key, flags, route_type, route_protocol, age, preference, next_hop, interface_next_hop, metric, age_seconds, installed_at) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
             [
                 (
                     route.get("hostname"),
                     route.get("service"),
                     timestamp,
-                    route.get("route"),
+                    *_route_prefix(route),
                     route.get("flags", ""),
                     route.get("route_type", ""),
                     route.get("route_protocol", ""),
@@ -144,6 +236,7 @@ def save_routes(
                     route.get("next_hop", ""),
                     route.get("interface_next_hop", ""),
                     route.get("metric", ""),
+                    *_route_install_time(route, timestamp),
                 )
                 for route in routes
             ],
@@ -154,23 +247,198 @@ def save_routes(
 
 
 def get_routes(hostname:str, service:str, timestamp: str, ) -> list:
-    """Retrieves routes for a hostname at a specific timestamp from the SQLite database"""
+    """
+    Retrieves routes for a hostname at a specific timestamp from the SQLite database
+    Each route is returned as a RouteRecord, rows are converted while the cursor is read
+    so the full list of rows and the list of routes never exist at the same time.
+    """
     logger.debug("get_routes")
     with DatabaseConnection.get_instance().get_connection() as database_connection:
         cursor = database_connection.cursor()
         try:
-            cursor.execute("SELECT * FROM igp_routes WHERE hostname=? AND service=? AND timestamp=?", (hostname, service, timestamp,))
-            results = cursor.fetchall()
+            cursor.execute(
+                f"SELECT {', '.join(ROUTE_FIELDS + COMPUTED_ATTRIBUTES)} FROM igp_routes WHERE hostname=? AND service=? AND timestamp=? ORDER BY id",
+                (hostname, service, timestamp,),
+            )
+            routes = [RouteRecord.from_row(row) for row in cursor]
         except sqlite3.Error as e:
             logger.error(f"Error getting changed routes: {e}")
             raise 
 
-    routes = [
-        dict(zip([column[0] for column in cursor.description], row)) for row in results
-    ]
+    return routes
 
+def iter_route_history(hostname: str, service: str, start: str = None, end: str = None,
+                       fields: tuple = ("route", "next_hop", "metric", "route_protocol", "installed_at"),
+                       timestamps: list = None):
+    """
+    Streams the checkpoints of a device and service in a single query, from the oldest to the newest.
+    Yields (timestamp, rows) per checkpoint, the rows are tuples of fields. Only one checkpoint is in memory.
+    :param start: The first timestamp of the window, included. From the oldest checkpoint when None.
+    :param end: The last timestamp of the window, included. Up to the newest checkpoint when None.
+    :param timestamps: Only these checkpoints, all the checkpoints of the window when None.
+    """
+    logger.debug("iter_route_history")
+    query = f"SELECT timestamp, {', '.join(fields)} FROM igp_routes WHERE hostname=? AND service=?"
+    parameters = (hostname, service)
+    if timestamps is not None:
+        query += f" AND timestamp IN ({', '.join('?' * len(timestamps))})"
+        parameters += tuple(timestamps)
+    if start is not None:
+        query += " AND timestamp>=?"
+        parameters += (start,)
+    if end is not None:
+        query += " AND timestamp<=?"
+        parameters += (end,)
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute(query + " ORDER BY timestamp", parameters)
+        for timestamp, rows in itertools.groupby(cursor, key=operator.itemgetter(0)):
+            yield timestamp, [row[1:] for row in rows]
+
+def get_latest_checkpoints(service: str, timestamp: str = None) -> dict:
+    """
+    The latest checkpoint of every device with routes of a service, {hostname: timestamp}.
+    :param timestamp: The latest checkpoint taken at or before this timestamp, the latest one when None.
+    """
+    logger.debug("get_latest_checkpoints")
+    query = "SELECT hostname, MAX(timestamp) FROM igp_routes WHERE service=?"
+    parameters = (service,)
+    if timestamp is not None:
+        query += " AND timestamp<=?"
+        parameters += (timestamp,)
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute(query + " GROUP BY hostname ORDER BY hostname", parameters)
+        return dict(cursor.fetchall())
+
+def get_recently_installed_routes(hostname: str, timestamp: str, seconds: int, service: str = None) -> list:
+    """
+    Retrieves the routes of a snapshot (re)installed in the seconds before its timestamp, newest first.
+    The query is a range scan of the igp_routes_installed_at index.
+    """
+    logger.debug("get_recently_installed_routes")
+    epoch = ages.timestamp_to_epoch(timestamp)
+    if epoch is None:
+        logger.error(f"{timestamp} is not a valid timestamp")
+        return []
+    query = f"SELECT {', '.join(ROUTE_FIELDS + COMPUTED_ATTRIBUTES)} FROM igp_routes WHERE hostname=? AND timestamp=? AND installed_at>=?"
+    parameters = (hostname, timestamp, epoch - seconds)
+    if service is not None:
+        query += " AND service=?"
+        parameters += (service,)
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute(query + " ORDER BY installed_at DESC", parameters)
+        routes = [RouteRecord.from_row(row) for row in cursor]
     return routes
 
+def save_parse_stats(hostname: str, timestamp: str, stats: dict, source: str = None) -> None:
+    """
+    Stores the parse statistics of a snapshot (netparser.ParseStats.to_dict()), one row per
+    hostname and timestamp, a new load of the same snapshot replaces them
+    """
+    logger.debug("save_parse_stats")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO parse_stats (hostname, timestamp, source, lines_scanned, entries_matched,
+                skipped_in_table, skipped_outside_table, rejected, rejected_samples)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                hostname,
+                timestamp,
+                source,
+                stats["lines_scanned"],
+                stats["entries_matched"],
+                stats["skipped_in_table"],
+                stats["skipped_outside_table"],
+                stats["rejected"],
+                json.dumps(stats["rejected_samples"]),
+            ),
+        )
+        database_connection.commit()
+
+
+def get_parse_stats(hostname: str, timestamp: str) -> dict:
+    """Returns the parse statistics saved with a snapshot, None if there are none"""
+    logger.debug("get_parse_stats")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute(
+            """
+            SELECT source, lines_scanned, entries_matched, skipped_in_table, skipped_outside_table, rejected, rejected_samples
+            FROM parse_stats WHERE hostname=? AND timestamp=?""",
+            (hostname, timestamp),
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return {
+        "source": row[0],
+        "lines_scanned": row[1],
+        "entries_matched": row[2],
+        "skipped_in_table": row[3],
+        "skipped_outside_table": row[4],
+        "rejected": row[5],
+        "rejected_samples": json.loads(row[6]),
+    }
+
+def get_circuit_states() -> dict:
+    """Returns the failures of the devices and proxies, {key: (failures, last_failure, last_error)}, see backoff.CircuitBreaker"""
+    logger.debug("get_circuit_states")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute("SELECT key, failures, last_failure, last_error FROM circuit_breaker")
+        return {key: (failures, last_failure, last_error) for key, failures, last_failure, last_error in cursor}
+
+
+def save_circuit_states(states: dict) -> None:
+    """Stores the failures of the devices and proxies, the keys with None are removed"""
+    logger.debug("save_circuit_states")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO circuit_breaker (key, failures, last_failure, last_error) VALUES (?, ?, ?, ?)",
+            [(key,) + tuple(state) for key, state in states.items() if state is not None],
+        )
+        cursor.executemany(
+            "DELETE FROM circuit_breaker WHERE key=?",
+            [(key,) for key, state in states.items() if state is None],
+        )
+        database_connection.commit()
+
+
+def get_device_durations() -> dict:
+    """Returns the average collection time of the devices, {hostname: seconds}"""
+    logger.debug("get_device_durations")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.execute("SELECT hostname, seconds FROM device_durations")
+        return dict(cursor.fetchall())
+
+
+def save_device_durations(durations: dict, weight: float = 0.5) -> None:
+    """
+    Adds the collection times of a run to the averages of the devices.
+    :param durations: {hostname: seconds} of the run.
+    :param weight: Weight of the new time in the moving average, the older runs weigh less with every run.
+    """
+    logger.debug("save_device_durations")
+    with DatabaseConnection.get_instance().get_connection() as database_connection:
+        cursor = database_connection.cursor()
+        cursor.executemany(
+            """
+            INSERT INTO device_durations (hostname, seconds, samples) VALUES (?, ?, 1)
+            ON CONFLICT (hostname) DO UPDATE SET
+                seconds = seconds * (1 - ?) + excluded.seconds * ?,
+                samples = samples + 1
+            """,
+            [(hostname, seconds, weight, weight) for hostname, seconds in durations.items()],
+        )
+        database_connection.commit()
+
+
 def remove_routes(
     hostname: str,
     timestamp: str,
@@ -182,6 +450,7 @@ def remove_routes(
     with DatabaseConnection.get_instance().get_connection() as database_connection:
         cursor = database_connection.cursor()
         rows_deleted = cursor.execute("DELETE FROM igp_routes WHERE hostname=? AND timestamp=?", (hostname, timestamp,)).rowcount
+        cursor.execute("DELETE FROM parse_stats WHERE hostname=? AND timestamp=?", (hostname, timestamp,))
         database_connection.commit()
     return rows_deleted
 
@@ -283,9 +552,9 @@ def changed_routes(
     routes1_by_route = {}
     routes2_by_route = {}
     for route in routes1:
-        routes1_by_route.setdefault(route["route"], []).append(route)
+        routes1_by_route.setdefault(route.route, []).append(route)
     for route in routes2:
-        routes2_by_route.setdefault(route["route"], []).append(route)
+        routes2_by_route.setdefault(route.route, []).append(route)
 
     changed_routes = []
     for route, routes1_entries in routes1_by_route.items():
@@ -299,12 +568,12 @@ def changed_routes(
         # Check for differences in the set of next hops and metrics
         # by first getting a set of all meaningful keys 
         # for the entries of the route in both timestamps
-        next_hops1 = set(entry["next_hop"] for entry in routes1_entries)
-        next_hops2 = set(entry["next_hop"] for entry in routes2_entries)
-        metrics1 = set(entry["metric"] for entry in routes1_entries)
-        metrics2 = set(entry["metric"] for entry in routes2_entries)
-        protocols1 = set(entry["route_protocol"] for entry in routes1_entries)
-        protocols2 = set(entry["route_protocol"] for entry in routes2_entries)
+        next_hops1 = set(entry.next_hop for entry in routes1_entries)
+        next_hops2 = set(entry.next_hop for entry in routes2_entries)
+        metrics1 = set(entry.metric for entry in routes1_entries)
+        metrics2 = set(entry.metric for entry in routes2_entries)
+        protocols1 = set(entry.route_protocol for entry in routes1_entries)
+        protocols2 = set(entry.route_protocol for entry in routes2_entries)
 
         if next_hops1 != next_hops2 or metrics1 != metrics2 or protocols1 != protocols2:
             # Detect changes in the relevant fields
@@ -316,9 +585,9 @@ def changed_routes(
                     (
                         r2
                         for r2 in routes2_entries
-                        if r2["next_hop"] == r1["next_hop"]
-                        and r2["metric"] == r1["metric"]
-                        and r2["route_protocol"] == r1["route_protocol"]
+                        if r2.next_hop == r1.next_hop
+                        and r2.metric == r1.metric
+                        and r2.route_protocol == r1.route_protocol
                     ),
                     None,
                 )
@@ -326,9 +595,9 @@ def changed_routes(
                     (
                         r2
                         for r2 in routes2_entries
-                        if r2["next_hop"] != r1["next_hop"]
-                        or r2["metric"] != r1["metric"]
-                        or r2["route_protocol"] != r1["route_protocol"]
+                        if r2.next_hop != r1.next_hop
+                        or r2.metric != r1.metric
+                        or r2.route_protocol != r1.route_protocol
                     ),
                     None,
                 )
@@ -336,12 +605,12 @@ def changed_routes(
                 if not r2_match:
                     changed_route = {
                         "route": route,
-                        "next_hop_before": r1["next_hop"],
-                        "next_hop_after": r2.get("next_hop") if r2 else None,
-                        "metric_before": r1["metric"],
-                        "metric_after": r2.get("metric") if r2 else None,
-                        "route_protocol_before": r1["route_protocol"],
-                        "route_protocol_after": r2.get("route_protocol") if r2 else None,
+                        "next_hop_before": r1.next_hop,
+                        "next_hop_after": r2.next_hop if r2 else None,
+                        "metric_before": r1.metric,
+                        "metric_after": r2.metric if r2 else None,
+                        "route_protocol_before": r1.route_protocol,
+                        "route_protocol_after": r2.route_protocol if r2 else None,
                     }
                     changed_routes.append(changed_route)
 
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The application modules import each other as top level modules (running
+# "python app/cli.py" puts app/ on sys.path), make them importable the same way in the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
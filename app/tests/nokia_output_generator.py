@@ -0,0 +1,204 @@
+"""
+Generator of synthetic Nokia SR OS outputs for benchmarks and tests.
+
+The outputs are generated line by line, so captures of millions of routes can be written
+to disk without being held in memory. They cover the variants the grammars in
+nokia/grammar.py support:
+- show router route-table: flags, route types, protocols, the three age formats
+  (10h49m31s, 25d20h48m, 0241d11h), IPv4 and interface next hops and all the tunneled next hops
+- show router bgp routes vpn-ipv4: status codes, both route distinguisher formats,
+  MED / None, AS paths and "No As-Path"
+and the structured (JSON) version of the route table read by nokia/structured.py.
+
+The output is deterministic for a given seed.
+"""
+
+import json
+import random
+
+SEPARATOR_EQUAL = "=" * 79
+SEPARATOR_DASH = "-" * 79
+
+FLAGS = [None, "B", "L", "n"]
+# (route_type, route_protocol, preference)
+ROUTE_KINDS = [
+    ("Remote", "BGP_LABEL", 170),
+    ("Remote", "ISIS", 18),
+    ("Remote", "Static", 5),
+    ("Remote", "BGP VPN", 170),
+    ("Remote", "BGP", 170),
+    ("Remote", "Aggr", 130),
+    ("Local", "Local", 0),
+    ("Blackh*", "Static", 5),
+]
+TUNNELS = [None, "tunneled", "tunneled:BGP", "tunneled:SR-ISIS:{}", "tunneled:SR-TE:{}", "tunneled:RSVP:{}"]
+INTERFACE_NEXT_HOPS = ["INTERFACE-NAME_{}", "To REMOTE-HOSTNAME-{}", "Local VRF [1000000:INTERFACE_NAME_short_{}]"]
+BGP_STATUS_CODES = ["u*>i", "u*>?", "*i", "u*>e", "x*", "ub*>i"]
+
+JSON_PROTOCOLS = {
+    "BGP_LABEL": "bgp-label",
+    "ISIS": "isis",
+    "Static": "static",
+    "BGP VPN": "bgp-vpn",
+    "BGP": "bgp",
+    "Aggr": "aggregate",
+    "Local": "local",
+}
+JSON_TUNNELS = {"SR-ISIS": "sr-isis", "SR-TE": "sr-te", "RSVP": "rsvp", "BGP": "bgp"}
+
+
+def _prefix(index: int) -> str:
+    return f"{10 + index // 16777216 % 200}.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}/32"
+
+
+def _age(randomizer) -> str:
+    age_format = randomizer.randrange(3)
+    if age_format == 0:
+        return f"{randomizer.randrange(24):02d}h{randomizer.randrange(60):02d}m{randomizer.randrange(60):02d}s"
+    if age_format == 1:
+        return f"{randomizer.randrange(1, 100):02d}d{randomizer.randrange(24):02d}h{randomizer.randrange(60):02d}m"
+    return f"{randomizer.randrange(100, 1000):04d}d{randomizer.randrange(24):02d}h"
+
+
+def generate_routes(num_routes: int, seed: int = 0):
+    """Yields route dictionaries (the fields of the route-table grammar) for num_routes routes"""
+    randomizer = random.Random(seed)
+    for index in range(num_routes):
+        route_type, route_protocol, preference = ROUTE_KINDS[index % len(ROUTE_KINDS)]
+        flags = FLAGS[randomizer.randrange(len(FLAGS))]
+        interface_next_hop = None
+        if route_type == "Blackh*":
+            next_hop = "Black Hole"
+        elif route_type == "Local":
+            next_hop = INTERFACE_NEXT_HOPS[randomizer.randrange(len(INTERFACE_NEXT_HOPS))].format(index % 1000)
+        else:
+            next_hop = f"10.{randomizer.randrange(1, 255)}.{randomizer.randrange(256)}.{randomizer.randrange(1, 255)}"
+            tunnel = TUNNELS[index // len(ROUTE_KINDS) % len(TUNNELS)]
+            if tunnel is not None:
+                interface_next_hop = tunnel.format(randomizer.randrange(1, 600000))
+        yield {
+            "route": _prefix(index),
+            "flags": flags,
+            "route_type": route_type,
+            "route_protocol": route_protocol,
+            "age": _age(randomizer),
+            "preference": str(preference),
+            "next_hop": next_hop,
+            "interface_next_hop": interface_next_hop,
+            "metric": str(randomizer.randrange(0, 20000)),
+        }
+
+
+def iter_route_table_lines(num_routes: int, service: str = "Base", seed: int = 0):
+    """Yields the lines of 'show router route-table' with num_routes routes"""
+    router_or_service = "Router" if service == "Base" else "Service"
+    yield SEPARATOR_EQUAL + "\n"
+    yield f"Route Table ({router_or_service}: {service})\n"
+    yield SEPARATOR_EQUAL + "\n"
+    yield "Dest Prefix[Flags]                            Type    Proto     Age        Pref\n"
+    yield "      Next Hop[Interface Name]                                    Metric   \n"
+    yield SEPARATOR_DASH + "\n"
+    for route in generate_routes(num_routes, seed):
+        prefix_flags = route["route"] + (f" [{route['flags']}]" if route["flags"] else "")
+        next_hop = route["next_hop"] + (f" ({route['interface_next_hop']})" if route["interface_next_hop"] else "")
+        yield f"{prefix_flags:<46}{route['route_type']:<8}{route['route_protocol']:<10}{route['age']:<11}{route['preference']}\n"
+        yield f"       {next_hop:<61}{route['metric']}\n"
+    yield SEPARATOR_DASH + "\n"
+    yield f"No. of Routes: {num_routes}\n"
+    yield "Flags: n = Number of times nexthop is repeated\n"
+    yield "       B = BGP backup route available\n"
+    yield "       L = LFA nexthop available\n"
+    yield "       S = Sticky ECMP requested\n"
+    yield SEPARATOR_EQUAL + "\n"
+
+
+def iter_bgp_vpn_ipv4_lines(num_routes: int, seed: int = 0):
+    """Yields the lines of 'show router bgp routes vpn-ipv4' with num_routes routes"""
+    randomizer = random.Random(seed)
+    yield SEPARATOR_EQUAL + "\n"
+    yield " BGP Router ID:192.0.2.146      AS:65500       Local AS:65500      \n"
+    yield SEPARATOR_EQUAL + "\n"
+    yield " Legend -\n"
+    yield " Status codes  : u - used, s - suppressed, h - history, d - decayed, * - valid\n"
+    yield "                 l - leaked, x - stale, > - best, b - backup, p - purge\n"
+    yield " Origin codes  : i - IGP, e - EGP, ? - incomplete\n"
+    yield "\n"
+    yield SEPARATOR_EQUAL + "\n"
+    yield "BGP VPN-IPv4 Routes\n"
+    yield SEPARATOR_EQUAL + "\n"
+    yield "Flag  Network                                            LocalPref   MED\n"
+    yield "      Nexthop (Router)                                   Path-Id     IGP Cost\n"
+    yield "      As-Path                                                        Label\n"
+    yield SEPARATOR_DASH + "\n"
+    for index in range(num_routes):
+        status_code = BGP_STATUS_CODES[index % len(BGP_STATUS_CODES)]
+        if index % 2:
+            rd = f"65500:{randomizer.randrange(1, 5000)}"
+        else:
+            rd = f"192.0.2.{randomizer.randrange(1, 255)}:{randomizer.randrange(1, 5000)}"
+        prefix = f"{rd}:{_prefix(index)}"
+        med = "None" if index % 3 else str(randomizer.randrange(0, 1000))
+        next_hop = f"10.20.{randomizer.randrange(256)}.{randomizer.randrange(1, 255)}"
+        if index % 5 == 0:
+            path = "No As-Path"
+        else:
+            path = " ".join(str(randomizer.randrange(64512, 65535)) for _ in range(index % 4 + 1))
+        yield f"{status_code:<6}{prefix:<51}{randomizer.choice([90, 100, 200]):<12}{med}\n"
+        yield f"      {next_hop:<51}{randomizer.randrange(1, 999999999):<12}{randomizer.randrange(0, 20000)}\n"
+        yield f"      {path:<63}{randomizer.randrange(16, 1048575)}\n"
+    yield SEPARATOR_DASH + "\n"
+    yield f"Routes : {num_routes}\n"
+    yield SEPARATOR_EQUAL + "\n"
+
+
+def _age_seconds(age: str) -> int:
+    seconds = 0
+    number = ""
+    for character in age:
+        if character.isdigit():
+            number += character
+            continue
+        seconds += int(number) * {"d": 86400, "h": 3600, "m": 60, "s": 1}[character]
+        number = ""
+    return seconds
+
+
+def iter_route_table_json(num_routes: int, service: str = "Base", seed: int = 0):
+    """
+    Yields the text of the MD-CLI 'info json' output of the route-table state with
+    the same routes as iter_route_table_lines for the same seed
+    """
+    name_key = "router-name" if service == "Base" else "service-name"
+    yield '{\n    "%s": "%s",\n    "nokia-state:route-table": {"unicast": {"ipv4": {"route": [\n' % (name_key, service)
+    for index, route in enumerate(generate_routes(num_routes, seed)):
+        nexthop = {}
+        if route["route_type"] == "Remote":
+            nexthop["ip-address"] = route["next_hop"]
+        else:
+            nexthop["interface-name"] = route["next_hop"]
+        if route["interface_next_hop"]:
+            tunnel = route["interface_next_hop"].split(":")
+            nexthop["tunnel"] = {"type": JSON_TUNNELS.get(tunnel[1], "ldp") if len(tunnel) > 1 else "ldp"}
+            if len(tunnel) > 2:
+                nexthop["tunnel"]["tunnel-id"] = int(tunnel[2])
+        json_route = {
+            "ipv4-prefix": route["route"],
+            "type": route["route_type"].lower(),
+            "protocol": f"nokia-state:{JSON_PROTOCOLS[route['route_protocol']]}",
+            "flags": route["flags"],
+            "age": route["age"] if route["age"].endswith("h") and len(route["age"]) == 8 else _age_seconds(route["age"]),
+            "preference": int(route["preference"]),
+            "metric": int(route["metric"]),
+            "nexthop": [nexthop],
+        }
+        yield ("        " if index == 0 else "        ,") + json.dumps(json_route) + "\n"
+    yield "    ]}}}\n}\n"
+
+
+def write_capture(filename: str, lines) -> int:
+    """Writes the generated lines to filename, returns the size in bytes"""
+    size = 0
+    with open(filename, "w", encoding="utf-8") as f:
+        for line in lines:
+            size += f.write(line)
+    return size
@@ -0,0 +1,390 @@
+"""
+Farm of simulated Nokia SR OS devices served over SSH, for the tests and benchmarks of the collection.
+
+Every device listens on its own port of 127.0.0.1 and runs a paramiko SSH server with a classic
+CLI prompt (A:<hostname>#). It echoes the commands and answers
+- show version
+- show router route-table, a synthetic route table from nokia_output_generator
+- environment ... (the commands netmiko sends to prepare the session), with no output
+and closes the session on logout. The behaviour of a device is set by its DeviceProfile:
+- routes, seed          the route table returned
+- login_latency         seconds the authentication takes
+- command_latency       seconds before the output of a command starts
+- bandwidth             bytes per second the outputs are sent at, no limit when None
+- failure               None, "auth" (the password is rejected), "timeout" (the connection is
+                        accepted but the SSH banner never sent) or "disconnect" (the connection
+                        is dropped after disconnect_after of the route table is sent)
+
+An optional jump host (jump_host=True) accepts the direct-tcpip channels to the devices, see
+app/bastions.py.
+
+The servers run in threads of the process, or in child processes (processes=N) so they don't share
+the CPU and the memory measured for the collector:
+    with SSHFarm([DeviceProfile(f"PE{index}", routes=1000) for index in range(100)], processes=2) as farm:
+        responses = collector.collect_devices(farm.devices())
+"""
+
+import io
+import logging
+import multiprocessing
+import selectors
+import socket
+import threading
+import time
+
+import paramiko
+
+import app.tests.nokia_output_generator as generator
+
+logger = logging.getLogger(__name__)
+
+USERNAME = "admin"
+PASSWORD = "admin"
+JUMP_HOST_USERNAME = "jump"
+VERSION = "TiMOS-C-23.10.R1 cpm/x86_64 Nokia 7750 SR Copyright (c) 2000-2023 Nokia.\n"
+FAILURES = (None, "auth", "timeout", "disconnect")
+CHUNK_SIZE = 16384
+HEADER_LINES = 6  # lines of the route table before the first route
+
+_host_key = None
+_host_key_lock = threading.Lock()
+
+
+def host_key() -> paramiko.RSAKey:
+    """The key of all the servers, generated once"""
+    global _host_key
+    with _host_key_lock:
+        if _host_key is None:
+            _host_key = paramiko.RSAKey.generate(2048)
+        return _host_key
+
+
+class DeviceProfile:
+    """The behaviour of a simulated device, see the module documentation"""
+
+    def __init__(self, hostname: str, routes: int = 100, seed: int = 0, login_latency: float = 0.0,
+                 command_latency: float = 0.0, bandwidth: float = None, failure: str = None,
+                 disconnect_after: float = 0.5):
+        if failure not in FAILURES:
+            raise ValueError(f"Unknown failure {failure}, expected one of {FAILURES}")
+        self.hostname = hostname
+        self.routes = routes
+        self.seed = seed
+        self.login_latency = login_latency
+        self.command_latency = command_latency
+        self.bandwidth = bandwidth
+        self.failure = failure
+        self.disconnect_after = disconnect_after
+
+    @property
+    def prompt(self) -> str:
+        return f"A:{self.hostname}# "
+
+    def route_table(self) -> str:
+        """The output of show router route-table"""
+        return "".join(generator.iter_route_table_lines(self.routes, seed=self.seed))
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, profile: DeviceProfile, jump_host: bool = False):
+        self.profile = profile
+        self.jump_host = jump_host
+        self.shell = threading.Event()
+        self.forwards = {}
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.profile.login_latency:
+            time.sleep(self.profile.login_latency)
+        expected_username = JUMP_HOST_USERNAME if self.jump_host else USERNAME
+        if self.profile.failure == "auth" or (username, password) != (expected_username, PASSWORD):
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session" and not self.jump_host:
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        if not self.jump_host:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        try:
+            self.forwards[chanid] = socket.create_connection(destination, timeout=5)
+        except OSError:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+def _send(channel, data: str, profile: DeviceProfile, start: float, sent: int) -> int:
+    encoded = data.encode()
+    channel.sendall(encoded)
+    sent += len(encoded)
+    if profile.bandwidth:
+        time.sleep(max(0.0, sent / profile.bandwidth - (time.perf_counter() - start)))
+    return sent
+
+
+def _send_output(channel, profile: DeviceProfile, command: str) -> bool:
+    """Sends the output of a command, False if the connection was dropped"""
+    if command.startswith(("environment", "//environment")):
+        return True
+    if profile.command_latency:
+        time.sleep(profile.command_latency)
+    start = time.perf_counter()
+    if command == "show version":
+        _send(channel, VERSION, profile, start, 0)
+        return True
+    if command != "show router route-table":
+        _send(channel, "                  ^\nError: Bad command.\n", profile, start, 0)
+        return True
+
+    disconnect_line = None
+    if profile.failure == "disconnect":
+        disconnect_line = HEADER_LINES + 2 * int(profile.routes * profile.disconnect_after)
+    chunk = []
+    chunk_size = 0
+    sent = 0
+    for number, line in enumerate(generator.iter_route_table_lines(profile.routes, seed=profile.seed)):
+        if number == disconnect_line:
+            _send(channel, "".join(chunk), profile, start, sent)
+            channel.get_transport().close()
+            return False
+        chunk.append(line)
+        chunk_size += len(line)
+        if chunk_size >= CHUNK_SIZE:
+            sent = _send(channel, "".join(chunk), profile, start, sent)
+            chunk = []
+            chunk_size = 0
+    _send(channel, "".join(chunk), profile, start, sent)
+    return True
+
+
+def _run_shell(channel, profile: DeviceProfile):
+    try:
+        channel.sendall(f"\n{profile.prompt}".encode())
+        buffer = ""
+        while True:
+            data = channel.recv(4096)
+            if not data:
+                return
+            # netmiko checks the session is alive writing null characters
+            text = data.decode(errors="replace").replace("\x00", "")
+            channel.sendall(text.replace("\r", "").encode())
+            buffer += text
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                command = line.strip()
+                if command in ("logout", "exit"):
+                    channel.close()
+                    return
+                if command and not _send_output(channel, profile, command):
+                    return
+                channel.sendall(f"\n{profile.prompt}".encode() if command else profile.prompt.encode())
+    except (OSError, EOFError, paramiko.SSHException):
+        return
+
+
+def _pump(source, destination):
+    try:
+        while True:
+            data = source.recv(CHUNK_SIZE)
+            if not data:
+                break
+            destination.sendall(data)
+    except (OSError, EOFError, paramiko.SSHException):
+        pass
+    finally:
+        for endpoint in (source, destination):
+            try:
+                endpoint.close()
+            except OSError:
+                pass
+
+
+class _FarmServer:
+    """The listening sockets and the SSH servers of a set of devices"""
+
+    def __init__(self, profiles: list, key: paramiko.RSAKey, jump_host: bool = False):
+        self.profiles = profiles
+        self.key = key
+        self.jump_host = jump_host
+        self.stopping = threading.Event()
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self.connections = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _listen(self, profile, jump_host=False) -> int:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(128)
+        listener.setblocking(False)
+        self.listeners.append(listener)
+        self.selector.register(listener, selectors.EVENT_READ, (profile, jump_host))
+        return listener.getsockname()[1]
+
+    def start(self) -> dict:
+        """Starts listening, returns {hostname: port}, the jump host under None"""
+        ports = {profile.hostname: self._listen(profile) for profile in self.profiles}
+        if self.jump_host:
+            ports[None] = self._listen(DeviceProfile("JUMP"), jump_host=True)
+        self.thread = threading.Thread(target=self._accept, daemon=True)
+        self.thread.start()
+        return ports
+
+    def _accept(self):
+        while not self.stopping.is_set():
+            for key, _ in self.selector.select(timeout=0.2):
+                try:
+                    connection, _ = key.fileobj.accept()
+                except OSError:
+                    continue
+                connection.setblocking(True)
+                with self.lock:
+                    self.connections.append(connection)
+                profile, jump_host = key.data
+                threading.Thread(target=self._serve, args=(connection, profile, jump_host), daemon=True).start()
+
+    def _serve(self, connection, profile: DeviceProfile, jump_host: bool):
+        if profile.failure == "timeout":
+            # the SSH daemon of the device hangs, the client times out waiting for the banner
+            self.stopping.wait()
+            return
+        transport = paramiko.Transport(connection)
+        transport.add_server_key(self.key)
+        server = _Server(profile, jump_host)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, OSError):
+            return
+        while transport.is_active() and not self.stopping.is_set():
+            channel = transport.accept(timeout=0.5)
+            if channel is None:
+                continue
+            forward = server.forwards.pop(channel.get_id(), None)
+            if forward is not None:
+                threading.Thread(target=_pump, args=(channel, forward), daemon=True).start()
+                threading.Thread(target=_pump, args=(forward, channel), daemon=True).start()
+            elif server.shell.wait(10):
+                threading.Thread(target=_run_shell, args=(channel, profile), daemon=True).start()
+        transport.close()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        for listener in self.listeners:
+            self.selector.unregister(listener)
+            listener.close()
+        self.selector.close()
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+
+def _serve_process(profiles: list, key_text: str, jump_host: bool, pipe):
+    """Runs the servers of a share of the devices in a child process until the farm stops"""
+    server = _FarmServer(profiles, paramiko.RSAKey.from_private_key(io.StringIO(key_text)), jump_host)
+    pipe.send(server.start())
+    pipe.recv()
+    server.stop()
+
+
+class SSHFarm:
+    """The simulated devices, see the module documentation"""
+
+    def __init__(self, profiles: list, processes: int = 0, jump_host: bool = False):
+        """
+        :param profiles: The DeviceProfile of every device.
+        :param processes: Child processes the devices are served from, in threads of this process when 0.
+        :param jump_host: Serve a jump host as well, it forwards the direct-tcpip channels to the devices.
+        """
+        self.profiles = profiles
+        self.processes = processes
+        self.jump_host = jump_host
+        self.ports = {}
+        self._servers = []
+        self._children = []
+
+    def start(self):
+        key = host_key()
+        if not self.processes:
+            server = _FarmServer(self.profiles, key, self.jump_host)
+            self.ports = server.start()
+            self._servers.append(server)
+            return self
+        key_text = io.StringIO()
+        key.write_private_key(key_text)
+        context = multiprocessing.get_context("fork")
+        for index in range(self.processes):
+            parent_pipe, child_pipe = context.Pipe()
+            process = context.Process(target=_serve_process, daemon=True,
+                                      args=(self.profiles[index::self.processes], key_text.getvalue(),
+                                            self.jump_host and index == 0, child_pipe))
+            process.start()
+            self._children.append((process, parent_pipe))
+        for _, pipe in self._children:
+            self.ports.update(pipe.recv())
+        return self
+
+    def stop(self):
+        for server in self._servers:
+            server.stop()
+        for process, pipe in self._children:
+            pipe.send("stop")
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+        self._servers = []
+        self._children = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def jump_host_dict(self) -> dict:
+        """The jump host in the inventory format, see app/bastions.py"""
+        return {"host": "127.0.0.1", "port": self.ports[None], "username": JUMP_HOST_USERNAME, "password": PASSWORD}
+
+    def devices(self, commands=("show version", "show router route-table"), timeout: float = 5.0,
+                jump_host: bool = False) -> list:
+        """
+        The devices in the format of network_interface.collect_device.
+        :param timeout: Seconds to connect, to get the SSH banner and to authenticate.
+        :param jump_host: Reach the devices through the jump host of the farm.
+        """
+        return [
+            {
+                "hostname": profile.hostname,
+                "ip": "127.0.0.1",
+                "port": self.ports[profile.hostname],
+                "username": USERNAME,
+                "password": PASSWORD,
+                "device_type": "nokia_sros",
+                "commands": list(commands),
+                "conn_timeout": timeout,
+                "banner_timeout": timeout,
+                "auth_timeout": timeout,
+                **({"jump_host": self.jump_host_dict} if jump_host else {}),
+            }
+            for profile in self.profiles
+        ]
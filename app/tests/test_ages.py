@@ -0,0 +1,31 @@
+import pytest
+
+import app.ages as ages
+
+
+@pytest.mark.parametrize(
+    "age, expected",
+    [
+        ("10h49m31s", 10 * 3600 + 49 * 60 + 31),
+        ("25d20h48m", 25 * 86400 + 20 * 3600 + 48 * 60),
+        ("0241d11h", 241 * 86400 + 11 * 3600),
+        ("00h00m00s", 0),
+        (3600, 3600),
+        ("", None),
+        (None, None),
+        ("never", None),
+        ("10h49m31", None),
+    ]
+)
+def test_age_to_seconds(age, expected):
+    assert ages.age_to_seconds(age) == expected
+
+
+def test_install_time():
+    epoch = ages.timestamp_to_epoch("2024-05-09_08:00")
+
+    assert ages.epoch_to_timestamp(epoch) == "2024-05-09_08:00:00"
+    assert ages.install_time("01h02m03s", "2024-05-09_08:00") == (3723, epoch - 3723)
+    assert ages.epoch_to_timestamp(epoch - 3723) == "2024-05-09_06:57:57"
+    assert ages.install_time("01h02m03s", "not a timestamp") == (3723, None)
+    assert ages.install_time("unknown", "2024-05-09_08:00") == (None, None)
@@ -0,0 +1,187 @@
+import random
+import threading
+import time
+
+import pytest
+
+import app.backoff as backoff
+import app.collector as collector
+import app.storage as storage
+
+
+@pytest.fixture
+def database():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def device(hostname, proxy=None):
+    return {"hostname": hostname, "ip": "192.0.2.1", "commands": ["show version"],
+            **({"proxy": {"proxy_type": 2, "addr": proxy, "port": 1080}} if proxy else {})}
+
+
+def failure(error="Timeout,MaximumNumberRetriesReached"):
+    return {"hostname": "PE1", "ip": "192.0.2.1", "output": {}, "error": error}
+
+
+SUCCESS = {"hostname": "PE1", "ip": "192.0.2.1", "output": {"show version": ""}, "error": "", "timing": {"show version": 0.1}}
+
+
+def test_backoff_policy_delays_are_jittered_and_capped():
+    policy = backoff.BackoffPolicy(max_attempts=10, base_delay=1.0, max_delay=8.0, randomizer=random.Random(0))
+
+    delays = [[policy.delay(retry) for _ in range(200)] for retry in range(6)]
+
+    assert all(0 <= delay <= min(8.0, 2 ** retry) for retry, retry_delays in enumerate(delays) for delay in retry_delays)
+    assert max(delays[5]) > 7
+    assert len(set(delays[3])) == 200
+
+
+def test_backoff_policy_needs_an_attempt():
+    assert backoff.BackoffPolicy(max_attempts=1).max_attempts == 1
+    with pytest.raises(ValueError):
+        backoff.BackoffPolicy(max_attempts=0)
+
+
+def test_retry_budget():
+    budget = backoff.RetryBudget(100, ratio=0.1, minimum=5)
+    assert [budget.take() for _ in range(16)] == [True] * 15 + [False]
+
+
+def test_is_retryable():
+    assert backoff.is_retryable(failure())
+    assert not backoff.is_retryable(failure("AuthenticationFailed,MaximumNumberRetriesReached"))
+    assert not backoff.is_retryable(failure("ProxyAuthenticationError"))
+    # the device was connected, the error is of a command
+    assert not backoff.is_retryable(dict(SUCCESS, error="ReadTimeout:show version,"))
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    clock = Clock()
+    breaker = backoff.CircuitBreaker(threshold=3, cooldown=900, clock=clock)
+    pe1 = device("PE1")
+
+    for _ in range(3):
+        assert breaker.check(pe1) == (breaker.ALLOW, None)
+        breaker.record(pe1, failure())
+    assert breaker.check(pe1) == (breaker.SKIP, "device:PE1")
+
+    clock.now += 901
+    assert breaker.check(pe1) == (breaker.PROBE, "device:PE1")
+    breaker.record(pe1, failure())
+    # the cooldown doubles after a failed probe
+    clock.now += 901
+    assert breaker.check(pe1) == (breaker.SKIP, "device:PE1")
+    clock.now += 900
+    assert breaker.check(pe1) == (breaker.PROBE, "device:PE1")
+
+    breaker.record(pe1, SUCCESS)
+    assert breaker.check(pe1) == (breaker.ALLOW, None)
+    assert breaker.changed_states() == {"device:PE1": None}
+
+
+def test_circuit_breaker_proxy_failures_skip_every_device_behind_the_proxy():
+    breaker = backoff.CircuitBreaker(threshold=2, clock=Clock())
+
+    breaker.record(device("PE1", "proxy1"), failure("ProxyConnectionError"))
+    breaker.record(device("PE2", "proxy1"), failure("ProxyTimeout"))
+
+    assert breaker.check(device("PE3", "proxy1")) == (breaker.SKIP, "proxy:proxy1:1080")
+    assert breaker.check(device("PE3", "proxy2")) == (breaker.ALLOW, None)
+    assert breaker.check(device("PE1")) == (breaker.ALLOW, None)
+
+
+def test_circuit_breaker_doesnt_count_a_busy_jump_host():
+    breaker = backoff.CircuitBreaker(threshold=1, clock=Clock())
+
+    breaker.record(device("PE1"), failure("JumpHostBusy,JumpHostBusy,MaximumNumberRetriesReached"))
+    breaker.record(device("PE2"), failure("JumpHostBusy,JumpHostChannelError,MaximumNumberRetriesReached"))
+
+    assert breaker.check(device("PE1")) == (breaker.ALLOW, None)
+    assert breaker.check(device("PE2")) == (breaker.SKIP, "device:PE2")
+    assert list(breaker.changed_states()) == ["device:PE2"]
+
+
+def test_circuit_states_persist_across_runs(database):
+    clock = Clock()
+    breaker = backoff.CircuitBreaker(threshold=2, clock=clock)
+    for _ in range(2):
+        breaker.record(device("PE1"), failure())
+    breaker.record(device("PE2"), failure())
+    storage.save_circuit_states(breaker.changed_states())
+
+    next_run = backoff.CircuitBreaker(storage.get_circuit_states(), threshold=2, clock=clock)
+    assert next_run.check(device("PE1")) == (next_run.SKIP, "device:PE1")
+    next_run.record(device("PE2"), SUCCESS)
+    storage.save_circuit_states(next_run.changed_states())
+
+    assert storage.get_circuit_states() == {"device:PE1": (2, clock.now, "Timeout,MaximumNumberRetriesReached")}
+
+
+class FlakyFleet:
+    """PE0 never connects, PE1 connects at the third attempt, the rest connect at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.finished = []
+
+    def collect_device(self, device_dict):
+        hostname = device_dict["hostname"]
+        assert device_dict["connect_attempts"] == 1
+        with self.lock:
+            self.attempts[hostname] = self.attempts.get(hostname, 0) + 1
+            attempt = self.attempts[hostname]
+        time.sleep(0.01)
+        if hostname == "PE0" or (hostname == "PE1" and attempt < 3):
+            return {"hostname": hostname, "ip": device_dict["ip"], "output": {}, "error": "Timeout,MaximumNumberRetriesReached"}
+        if hostname == "PE2":
+            return {"hostname": hostname, "ip": device_dict["ip"], "output": {}, "error": "AuthenticationFailed,MaximumNumberRetriesReached"}
+        with self.lock:
+            self.finished.append(hostname)
+        return {"hostname": hostname, "ip": device_dict["ip"], "output": {"show version": ""}, "error": "", "timing": {"show version": 0.01}}
+
+
+def test_collector_retries_without_holding_the_slot():
+    fleet = FlakyFleet()
+    devices = [device(f"PE{index}") for index in range(10)]
+    breaker = backoff.CircuitBreaker()
+    policy = backoff.BackoffPolicy(max_attempts=3, base_delay=0.2, randomizer=random.Random(0))
+
+    start = time.perf_counter()
+    responses = collector.collect_devices(devices, concurrency=1, collect_function=fleet.collect_device,
+                                          backoff_policy=policy, circuit_breaker=breaker)
+    elapsed = time.perf_counter() - start
+
+    errors = {response["hostname"]: response["error"] for response in responses}
+    assert errors["PE0"] == "Timeout,MaximumNumberRetriesReached"
+    assert errors["PE1"] == ""
+    assert errors["PE2"].startswith("AuthenticationFailed")
+    assert fleet.attempts == {"PE0": 3, "PE1": 3, "PE2": 1, **{f"PE{index}": 1 for index in range(3, 10)}}
+    # with a single slot the live devices were collected while PE0 and PE1 waited their backoff
+    assert fleet.finished.index("PE9") < fleet.finished.index("PE1")
+    assert elapsed < 0.2 + 0.4 + 1
+    assert set(breaker.changed_states()) == {"device:PE0", "device:PE2"}
+
+
+def test_collector_skips_open_circuits():
+    fleet = FlakyFleet()
+    clock = Clock()
+    breaker = backoff.CircuitBreaker({"device:PE3": (5, clock.now - 60, "Timeout,")}, clock=clock)
+
+    responses = collector.collect_devices([device("PE3"), device("PE4")], collect_function=fleet.collect_device,
+                                          backoff_policy=backoff.BackoffPolicy(), circuit_breaker=breaker)
+
+    assert sorted((response["hostname"], response["error"]) for response in responses) == [
+        ("PE3", "CircuitOpen:device:PE3"), ("PE4", "")]
+    assert fleet.attempts == {"PE4": 1}
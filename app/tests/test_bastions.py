@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+import app.bastions as bastions
+import app.network_interface as network_interface
+
+JUMP_HOST = {"host": "192.0.2.250", "port": 22, "username": "user", "password": "secret"}
+
+
+class StandInChannel:
+    def __init__(self, transport, destination):
+        self.transport = transport
+        self.destination = destination
+        self.closed = False
+
+    def close(self):
+        with self.transport.lock:
+            if not self.closed:
+                self.closed = True
+                self.transport.open -= 1
+
+
+class StandInTransport:
+    """A transport to the jump host, counts the channels open at the same time"""
+
+    def __init__(self, unreachable=()):
+        self.lock = threading.Lock()
+        self.active = True
+        self.open = 0
+        self.max_open = 0
+        self.unreachable = unreachable
+
+    def is_active(self):
+        return self.active
+
+    def open_channel(self, kind, destination, source, timeout=None):
+        assert kind == "direct-tcpip"
+        time.sleep(0.005)
+        if destination[0] in self.unreachable:
+            raise ConnectionRefusedError(destination)
+        with self.lock:
+            self.open += 1
+            self.max_open = max(self.max_open, self.open)
+        return StandInChannel(self, destination)
+
+    def close(self):
+        self.active = False
+
+
+class StandInBastion:
+    def __init__(self, **transport_options):
+        self.transports = []
+        self.transport_options = transport_options
+
+    def connect(self, jump_host):
+        assert jump_host == JUMP_HOST
+        time.sleep(0.02)
+        transport = StandInTransport(**self.transport_options)
+        self.transports.append(transport)
+        return transport
+
+
+def test_bastion_pool_multiplexes_the_devices_on_a_few_transports():
+    bastion = StandInBastion()
+    pool = bastions.BastionPool(transports_per_bastion=2, channels_per_transport=4, connect_function=bastion.connect)
+    destinations = []
+
+    def connect(index):
+        channel = pool.open_channel(JUMP_HOST, f"192.0.2.{index}", 22)
+        destinations.append(channel.destination)
+        time.sleep(0.01)
+        channel.close()
+
+    threads = [threading.Thread(target=connect, args=(index,)) for index in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(destinations) == sorted((f"192.0.2.{index}", 22) for index in range(40))
+    assert pool.transports_opened == len(bastion.transports) == 2
+    assert pool.channels_opened == 40
+    assert all(transport.max_open <= 4 for transport in bastion.transports)
+    pool.close()
+    assert not any(transport.active for transport in bastion.transports)
+
+
+def test_bastion_pool_waits_for_a_free_channel():
+    pool = bastions.BastionPool(transports_per_bastion=1, channels_per_transport=1, wait_timeout=0.1,
+                                connect_function=StandInBastion().connect)
+    channel = pool.open_channel(JUMP_HOST, "192.0.2.1")
+
+    with pytest.raises(bastions.BastionError) as exc_info:
+        pool.open_channel(JUMP_HOST, "192.0.2.2")
+    assert exc_info.value.error == "JumpHostBusy"
+
+    channel.close()
+    assert pool.open_channel(JUMP_HOST, "192.0.2.2").destination == ("192.0.2.2", 22)
+    assert pool.transports_opened == 1
+
+
+def test_bastion_pool_replaces_dead_transports_and_frees_failed_channels():
+    bastion = StandInBastion(unreachable=("192.0.2.9",))
+    pool = bastions.BastionPool(transports_per_bastion=1, channels_per_transport=1, wait_timeout=0.1,
+                                connect_function=bastion.connect)
+
+    with pytest.raises(bastions.BastionError) as exc_info:
+        pool.open_channel(JUMP_HOST, "192.0.2.9")
+    assert exc_info.value.error == "JumpHostChannelError"
+    pool.open_channel(JUMP_HOST, "192.0.2.1")
+
+    bastion.transports[0].active = False
+    pool.open_channel(JUMP_HOST, "192.0.2.1")
+    assert pool.transports_opened == 2
+
+
+def test_connect_device_through_a_jump_host(monkeypatch):
+    # network_interface imports the modules of the app directory by their name
+    pool = network_interface.bastions.BastionPool(connect_function=StandInBastion(unreachable=("192.0.2.9",)).connect)
+    connected = []
+
+    def connect_handler(**kwargs):
+        connected.append(kwargs)
+        return type("Connection", (), {
+            "is_alive": lambda self: True, "_modify_connection_params": lambda self: None,
+            "establish_connection": lambda self: None, "_try_session_preparation": lambda self: None})()
+
+    monkeypatch.setattr(network_interface, "ConnectHandler", connect_handler)
+    monkeypatch.setattr(network_interface, "CONNECT_BACKOFF_DELAY", 0)
+    device_dict = {"ip": "192.0.2.1", "port": 830, "device_type": "nokia_sros", "jump_host": dict(JUMP_HOST)}
+
+    connection, error_response = network_interface.connect_device("PE1", device_dict, bastion_pool=pool)
+
+    assert connection is not None and error_response is None
+    assert "jump_host" not in connected[0]
+    assert connected[0]["sock"].destination == ("192.0.2.1", 830)
+
+    connection, error_response = network_interface.connect_device(
+        "PE9", {"ip": "192.0.2.9", "device_type": "nokia_sros", "jump_host": dict(JUMP_HOST)}, attempts=2, bastion_pool=pool)
+
+    assert connection is None
+    assert error_response["error"] == "JumpHostChannelError,JumpHostChannelError,MaximumNumberRetriesReached"
+    assert len(connected) == 1
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+
+import app.ages as ages
+import app.churn as churn
+import app.storage as storage
+
+TIMESTAMPS = ["2024-05-09_08:00", "2024-05-09_08:15", "2024-05-09_08:30", "2024-05-09_08:45", "2024-05-09_09:00"]
+
+
+@pytest.fixture(scope="function")
+def test_db():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def route(prefix, next_hop="10.20.30.40", age="10d00h00m", metric="10", service="VPRN10"):
+    return {
+        "hostname": "HOSTNAME1", "service": service, "route": prefix, "flags": None,
+        "route_type": "Remote", "route_protocol": "BGP", "age": age, "preference": "170",
+        "next_hop": next_hop, "interface_next_hop": None, "metric": metric,
+    }
+
+
+def save_history(checkpoints):
+    for timestamp, routes in zip(TIMESTAMPS, checkpoints):
+        storage.save_routes(timestamp, routes)
+
+
+def test_route_churn(test_db):
+    save_history([
+        [route("10.0.0.1/32"), route("10.0.0.2/32", "10.1.1.1"), route("10.0.0.3/32", age="00h01m00s"), route("10.0.0.4/32")],
+        [route("10.0.0.1/32"), route("10.0.0.2/32", "10.2.2.2"), route("10.0.0.3/32", age="00h16m00s"), route("10.0.0.4/32")],
+        [route("10.0.0.1/32"), route("10.0.0.2/32", "10.1.1.1"), route("10.0.0.3/32", age="00h02m00s")],
+        [route("10.0.0.1/32"), route("10.0.0.2/32", "10.2.2.2"), route("10.0.0.3/32", age="00h17m00s"), route("10.0.0.4/32")],
+        [route("10.0.0.1/32", metric="20"), route("10.0.0.2/32", "10.1.1.1"), route("10.0.0.3/32", age="00h03m00s"),
+         route("10.0.0.4/32", service="Base")],
+    ])
+
+    report = churn.route_churn(storage.iter_route_history("HOSTNAME1", "VPRN10"), min_count=1)
+
+    assert report["checkpoints"] == TIMESTAMPS
+    flapping = {summary["route"]: summary for summary in report["flapping"]}
+    assert list(flapping) == ["10.0.0.2/32", "10.0.0.4/32"]
+    assert flapping["10.0.0.2/32"]["changes"] == 4
+    assert flapping["10.0.0.2/32"]["next_hops"] == ["10.1.1.1"]
+    assert flapping["10.0.0.4/32"] == {
+        "route": "10.0.0.4/32", "changes": 3, "withdrawals": 2, "next_hop_oscillations": 0, "age_resets": 0,
+        "next_hops": ["10.20.30.40"], "present": False, "first_seen": TIMESTAMPS[0], "last_seen": TIMESTAMPS[3],
+    }
+    assert [(summary["route"], summary["next_hop_oscillations"]) for summary in report["oscillating"]] == [("10.0.0.2/32", 3)]
+    # reinstalled between 08:15 and 08:30 and between 08:45 and 09:00, at 08:45 it was only older
+    assert [(summary["route"], summary["age_resets"]) for summary in report["age_resets"]] == [("10.0.0.3/32", 2)]
+
+
+def test_route_churn_time_window(test_db):
+    save_history([
+        [route("10.0.0.1/32", "10.1.1.1")],
+        [route("10.0.0.1/32", "10.2.2.2")],
+        [route("10.0.0.1/32", "10.1.1.1")],
+        [route("10.0.0.1/32", "10.1.1.1")],
+        [route("10.0.0.1/32", "10.1.1.1")],
+    ])
+
+    window = churn.route_churn(storage.iter_route_history("HOSTNAME1", "VPRN10", TIMESTAMPS[2], TIMESTAMPS[4]), min_count=0)
+    history = churn.route_churn(storage.iter_route_history("HOSTNAME1", "VPRN10", end=TIMESTAMPS[2]), min_count=0)
+
+    assert window["checkpoints"] == TIMESTAMPS[2:]
+    assert window["flapping"] == []
+    assert history["checkpoints"] == TIMESTAMPS[:3]
+    assert [(summary["route"], summary["changes"]) for summary in history["flapping"]] == [("10.0.0.1/32", 2)]
+
+
+def test_churn_tracker_treats_ecmp_next_hops_as_a_set():
+    tracker = churn.ChurnTracker()
+    epoch = ages.timestamp_to_epoch(TIMESTAMPS[0])
+    tracker.add_checkpoint(TIMESTAMPS[0], [("10.0.0.1/32", "10.1.1.1", "10", "BGP", epoch - 600), ("10.0.0.1/32", "10.2.2.2", "10", "BGP", epoch - 600)])
+    tracker.add_checkpoint(TIMESTAMPS[1], [("10.0.0.1/32", "10.2.2.2", "10", "BGP", epoch - 600), ("10.0.0.1/32", "10.1.1.1", "10", "BGP", epoch - 600)])
+    tracker.add_checkpoint(TIMESTAMPS[2], [("10.0.0.1/32", "10.2.2.2", "10", "BGP", epoch - 600)])
+
+    state = tracker.prefixes["10.0.0.1/32"]
+    assert (state.changes, state.next_hop_oscillations, state.age_resets) == (1, 0, 0)
+    assert state.next_hops == frozenset(["10.2.2.2"])
+
+
+def test_route_churn_is_a_single_pass(test_db):
+    num_routes = 2000
+    num_checkpoints = 40
+    for checkpoint in range(num_checkpoints):
+        timestamp = f"2024-05-{1 + checkpoint // 24:02d}_{checkpoint % 24:02d}:00"
+        # every 100th route moves between two next hops on every checkpoint
+        storage.save_routes(timestamp, [
+            route(f"10.0.{index // 256}.{index % 256}/32", f"10.1.1.{checkpoint % 2 if index % 100 == 0 else 9}")
+            for index in range(num_routes)
+        ])
+
+    start = time.perf_counter()
+    report = churn.route_churn(storage.iter_route_history("HOSTNAME1", "VPRN10"), min_count=10)
+    elapsed = time.perf_counter() - start
+    print(f"\nChurn analysis of {num_checkpoints} checkpoints of {num_routes} routes: {elapsed:.3f} seconds, "
+          f"{num_routes * num_checkpoints / elapsed:.0f} routes/s")
+
+    assert len(report["checkpoints"]) == num_checkpoints
+    assert len(report["flapping"]) == len(report["oscillating"]) == num_routes // 100
+    assert all(summary["changes"] == num_checkpoints - 1 for summary in report["flapping"])
+    assert report["age_resets"] == []
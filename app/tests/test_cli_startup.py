@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli.py")
+
+# Budget for the sum of the import times of "cli.py compare --list", it only reads a few rows
+# so it must not pay for the collector (netmiko, paramiko, socks) nor the parsers (pyparsing, yaml)
+IMPORT_TIME_BUDGET_SECONDS = 0.2
+HEAVY_MODULES = ["netmiko", "paramiko", "socks", "pyparsing", "yaml"]
+
+
+def run_cli_importtime(args, cwd):
+    """Runs the CLI with -X importtime, returns {module: self import time in seconds}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", CLI_PATH] + args,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        timeout=60,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, _, module = line[len("import time:"):].split("|")
+        import_times[module.strip()] = int(self_time) / 1000000
+    return import_times
+
+
+def test_compare_list_startup_import_budget(tmp_path):
+    import_times = run_cli_importtime(["compare", "--list"], tmp_path)
+    total_import_time = sum(import_times.values())
+    print(f"\ncompare --list imported {len(import_times)} modules in {total_import_time:.4f} seconds")
+
+    assert "orchestrator" in import_times
+    for module in HEAVY_MODULES:
+        assert module not in import_times, f"{module} imported by compare --list"
+    assert total_import_time < IMPORT_TIME_BUDGET_SECONDS
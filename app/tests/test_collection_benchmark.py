@@ -0,0 +1,81 @@
+"""
+Collection benchmark suite.
+
+The devices of an ssh_farm (simulated Nokia SR OS devices served over SSH from FARM_PROCESSES
+child processes) are collected with collector.collect_devices and network_interface, the
+outputs streamed to a FileSink, as a checkpoint does. The collection runs in its own process
+and reports devices/s, the p50 and p99 of the time of a device (network_interface.collect_device:
+connect, commands and disconnect) and the CPU time and peak memory (RSS) the collection added to
+the process.
+
+By default the suite runs with 10 devices, set the sizes and the route table of the devices with
+    ROUTETABLE_FARM_SIZES=10,100,500,2000 ROUTETABLE_FARM_ROUTES=1000 python -m pytest app/tests/test_collection_benchmark.py -s
+ROUTETABLE_FARM_CONCURRENCY sets the concurrency of the collector (collector.DEFAULT_CONCURRENCY
+by default) and ROUTETABLE_FARM_PROCESSES the processes of the farm. The farm and the collector
+share the CPUs of the machine, the farm needs about as much CPU as the collector for the SSH
+handshakes and the encryption.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import resource
+import threading
+import time
+
+import pytest
+
+import app.collector as collector
+import app.metrics as metrics
+import app.network_interface as network_interface
+import app.output_sinks as output_sinks
+import app.tests.ssh_farm as ssh_farm
+
+BENCHMARK_SIZES = [int(size) for size in os.environ.get("ROUTETABLE_FARM_SIZES", "10").split(",")]
+ROUTES = int(os.environ.get("ROUTETABLE_FARM_ROUTES", "500"))
+CONCURRENCY = int(os.environ.get("ROUTETABLE_FARM_CONCURRENCY", collector.DEFAULT_CONCURRENCY))
+FARM_PROCESSES = int(os.environ.get("ROUTETABLE_FARM_PROCESSES", min(os.cpu_count() or 1, 4)))
+
+
+def run_collection(devices, directory):
+    """Runs in a child process, collects the devices and returns the measurements"""
+    device_seconds = []
+    lock = threading.Lock()
+
+    def collect_device(device_dict, sink=None):
+        start = time.perf_counter()
+        response = network_interface.collect_device(device_dict, sink)
+        with lock:
+            device_seconds.append(time.perf_counter() - start)
+        return response
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    responses = collector.collect_devices(devices, CONCURRENCY, collect_function=collect_device,
+                                          sink=output_sinks.FileSink(directory))
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_seconds = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    errors = sorted(response["error"] for response in responses if response["error"])
+    return (len(responses), errors, elapsed, device_seconds, cpu_seconds,
+            (usage_after.ru_maxrss - usage_before.ru_maxrss) / 1024)
+
+
+@pytest.mark.parametrize("num_devices", BENCHMARK_SIZES)
+def test_collection_benchmark(num_devices, tmp_path):
+    profiles = [ssh_farm.DeviceProfile(f"PE{index}", routes=ROUTES, seed=index) for index in range(num_devices)]
+
+    with ssh_farm.SSHFarm(profiles, processes=FARM_PROCESSES) as farm:
+        devices = farm.devices(timeout=60)
+        # A fresh process per measurement, so the CPU and memory of one collection don't add to the next one
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+            collected, errors, elapsed, device_seconds, cpu_seconds, peak_memory_mb = \
+                executor.submit(run_collection, devices, str(tmp_path)).result()
+
+    assert collected == num_devices
+    assert errors == []
+    assert len(os.listdir(tmp_path)) == num_devices
+    print(f"\n{num_devices} devices x {ROUTES} routes (concurrency {CONCURRENCY}, {FARM_PROCESSES} farm processes): "
+          f"{num_devices / elapsed:.1f} devices/s, device time p50 {metrics.percentile(device_seconds, 0.5):.2f}s "
+          f"p99 {metrics.percentile(device_seconds, 0.99):.2f}s, collector CPU {cpu_seconds:.1f}s, "
+          f"peak memory +{peak_memory_mb:.1f} MB")
@@ -0,0 +1,97 @@
+import collections
+import random
+import threading
+import time
+
+import app.collector as collector
+
+
+class StandInDevices:
+    """Stand-in for the SSH sessions, each device answers after its delay and the concurrency is recorded"""
+
+    def __init__(self, delays: dict):
+        self.delays = delays
+        self.lock = threading.Lock()
+        self.running = collections.Counter()
+        self.max_running = collections.Counter()
+
+    def _enter(self, keys):
+        with self.lock:
+            for key in keys:
+                self.running[key] += 1
+                self.max_running[key] = max(self.max_running[key], self.running[key])
+
+    def _exit(self, keys):
+        with self.lock:
+            for key in keys:
+                self.running[key] -= 1
+
+    def collect_device(self, device_dict):
+        assert "site" not in device_dict
+        hostname = device_dict["hostname"]
+        proxy = device_dict.get("proxy", {}).get("addr")
+        keys = ["all", f"proxy:{proxy}", f"site:{self.delays[hostname][1]}"]
+        self._enter(keys)
+        try:
+            time.sleep(self.delays[hostname][0])
+        finally:
+            self._exit(keys)
+        return {"hostname": hostname, "ip": device_dict["ip"], "output": {"show version": f"{hostname} up"}, "error": ""}
+
+
+def devices(number, sites=1, proxies=1):
+    return [
+        {
+            "hostname": f"PE{index}", "ip": f"192.0.2.{index % 250}", "device_type": "nokia_sros",
+            "username": "user", "password": "password", "commands": ["show version"],
+            "site": f"SITE{index % sites}", "proxy": {"proxy_type": 2, "addr": f"proxy{index % proxies}", "port": 1080},
+        }
+        for index in range(number)
+    ]
+
+
+def test_collect_devices_in_the_time_of_the_slowest_device():
+    device_list = devices(1000)
+    randomizer = random.Random(0)
+    stand_in = StandInDevices({device["hostname"]: (randomizer.uniform(0.05, 0.5), device["site"]) for device in device_list})
+
+    start = time.perf_counter()
+    responses = collector.collect_devices(device_list, concurrency=1000, collect_function=stand_in.collect_device)
+    elapsed = time.perf_counter() - start
+    slowest = max(delay for delay, _ in stand_in.delays.values())
+    print(f"\nCollected {len(responses)} devices in {elapsed:.2f} seconds, the slowest device takes {slowest:.2f} seconds")
+
+    assert sorted(response["hostname"] for response in responses) == sorted(device["hostname"] for device in device_list)
+    assert all(response["output"] == {"show version": f"{response['hostname']} up"} for response in responses)
+    assert elapsed < slowest + 2.0
+    # the devices given to the collector aren't modified
+    assert all("site" in device for device in device_list)
+
+
+def test_collect_devices_limits_per_proxy_and_site():
+    device_list = devices(60, sites=3, proxies=2)
+    stand_in = StandInDevices({device["hostname"]: (0.02, device["site"]) for device in device_list})
+
+    responses = collector.collect_devices(device_list, concurrency=10, per_proxy=4, per_site=3,
+                                          collect_function=stand_in.collect_device)
+
+    assert len(responses) == 60
+    # 2 proxies with 4 sessions each
+    assert stand_in.max_running["all"] <= 8
+    assert all(stand_in.max_running[f"proxy:proxy{proxy}"] <= 4 for proxy in range(2))
+    assert all(stand_in.max_running[f"site:SITE{site}"] <= 3 for site in range(3))
+    assert stand_in.max_running["all"] > 1
+
+
+def test_collect_devices_reports_errors():
+    def collect_device(device_dict):
+        if device_dict["hostname"] == "PE1":
+            raise OSError("connection reset")
+        if device_dict["hostname"] == "PE2":
+            return None
+        return {"hostname": device_dict["hostname"], "ip": device_dict["ip"], "output": {}, "error": ""}
+
+    responses = collector.collect_devices(devices(3), collect_function=collect_device)
+
+    assert sorted((response["hostname"], response["error"]) for response in responses) == [("PE0", ""), ("PE1", "UnknownError")]
+    assert collector.collect_devices([], collect_function=collect_device) == []
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+import app.consistency as consistency
+import app.storage as storage
+
+
+@pytest.fixture(scope="function")
+def test_db():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def route(hostname, prefix, next_hop="192.0.2.1", route_protocol="BGP VPN", service="VPRN10"):
+    return {
+        "hostname": hostname, "service": service, "route": prefix, "flags": None,
+        "route_type": "Remote", "route_protocol": route_protocol, "age": "01h00m00s", "preference": "170",
+        "next_hop": next_hop, "interface_next_hop": None, "metric": "10",
+    }
+
+
+def devices(service, timestamp=None):
+    for hostname, checkpoint in storage.get_latest_checkpoints(service, timestamp).items():
+        for _, rows in storage.iter_route_history(hostname, service, fields=consistency.FIELDS, timestamps=[checkpoint]):
+            yield hostname, rows
+
+
+def test_service_consistency(test_db):
+    common = ["10.0.0.0/24", "10.0.1.0/24", "2001:db8::/32"]
+    storage.save_routes("2024-05-09_08:00", [route("PE1", prefix) for prefix in common] + [route("PE1", "10.9.9.9/32", "to-CE1", "Local")])
+    storage.save_routes("2024-05-09_08:00", [route("PE2", prefix) for prefix in common[:2]] + [route("PE2", "2001:DB8:0::/32")])
+    storage.save_routes("2024-05-09_08:00", [route("PE3", prefix) for prefix in common[1:]] + [route("PE3", "10.0.0.0/24", "192.0.2.7")])
+    storage.save_routes("2024-05-09_08:00", [route("PE4", prefix) for prefix in common[1:]])
+    # PE4 has an older checkpoint with the missing prefix, the latest one is compared
+    storage.save_routes("2024-05-09_07:00", [route("PE4", prefix) for prefix in common])
+    storage.save_routes("2024-05-09_08:00", [route("PE5", "10.0.0.0/24", service="VPRN20")])
+
+    report = consistency.service_consistency(devices("VPRN10"))
+
+    assert report["devices"] == ["PE1", "PE2", "PE3", "PE4"]
+    assert report["missing"] == [{"route": "10.0.0.0/24", "present_on": 3, "missing_on": ["PE4"]}]
+    assert report["disagreements"] == [{
+        "route": "10.0.0.0/24", "majority": "BGP VPN 192.0.2.1", "majority_devices": 2, "differing": {"PE3": "BGP VPN 192.0.2.7"},
+    }]
+
+    earlier = consistency.service_consistency(devices("VPRN10", "2024-05-09_07:30"), compare_next_hops=False)
+    assert earlier["devices"] == ["PE4"]
+    assert earlier["missing"] == earlier["disagreements"] == []
+
+
+def test_service_consistency_of_many_devices():
+    num_devices = 100
+    num_routes = 5000
+
+    def device_rows(device):
+        for index in range(num_routes):
+            # every device misses a prefix, and PE0 learns the last 10 from another next hop
+            if index == device:
+                continue
+            key = b"\x04" + index.to_bytes(4, "big") + b"\x20"
+            yield (None, key, "BGP VPN", "192.0.2.7" if device == 0 and index >= num_routes - 10 else "192.0.2.1")
+
+    start = time.perf_counter()
+    report = consistency.service_consistency((f"PE{device}", device_rows(device)) for device in range(num_devices))
+    elapsed = time.perf_counter() - start
+    print(f"\nConsistency of {num_devices} devices of {num_routes} routes: {elapsed:.3f} seconds, "
+          f"{num_devices * num_routes / elapsed:.0f} routes/s")
+
+    assert len(report["missing"]) == num_devices
+    assert report["missing"][0] == {"route": "0.0.0.0/32", "present_on": num_devices - 1, "missing_on": ["PE0"]}
+    assert [entry["differing"] for entry in report["disagreements"]] == [{"PE0": "BGP VPN 192.0.2.7"}] * 10
@@ -0,0 +1,174 @@
+import threading
+import time
+
+import pytest
+
+import app.fetch as fetch
+import app.storage as storage
+import app.tests.nokia_output_generator as generator
+
+
+@pytest.fixture
+def database():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def devices(number):
+    return [
+        {"hostname": f"PE{index}", "ip": f"192.0.2.{index}", "device_type": "nokia_sros",
+         "commands": ["show version", "show router route-table"]}
+        for index in range(number)
+    ]
+
+
+class StandInFleet:
+    """Stand-in for the SSH sessions, each device streams its route table to the sink after its delay"""
+
+    def __init__(self, delays: dict, routes: int):
+        self.delays = delays
+        self.routes = routes
+        self.lock = threading.Lock()
+        self.finished = {}
+
+    def collect_device(self, device_dict, sink):
+        hostname = device_dict["hostname"]
+        time.sleep(self.delays[hostname])
+        device_output = sink.open_device(hostname)
+        device_output.start_command("show version")
+        device_output.write("TiMOS-C-23.10.R1 cpm/x86_64 Nokia 7750 SR")
+        device_output.end_command()
+        device_output.start_command("show router route-table")
+        for line in generator.iter_route_table_lines(self.routes, seed=int(hostname[2:])):
+            device_output.write(line)
+        device_output.end_command()
+        with self.lock:
+            self.finished[hostname] = time.perf_counter()
+        return {"hostname": hostname, "ip": device_dict["ip"], "output": {}, "error": "", "capture": device_output.close()}
+
+
+def test_parser_vendor():
+    assert fetch.parser_vendor("nokia_sros") == "nokia"
+    assert fetch.parser_vendor("nokia") == "nokia"
+    assert fetch.parser_vendor("juniper_junos") is None
+    assert fetch.parser_vendor(None) is None
+
+
+def test_fetch_checkpoint_saves_devices_while_others_are_collected(database, tmp_path):
+    device_list = devices(4)
+    # PE3 is the slow device, the others are parsed and saved while it is collected
+    fleet = StandInFleet({"PE0": 0.0, "PE1": 0.05, "PE2": 0.1, "PE3": 3.0}, routes=400)
+    saved = {}
+
+    def save_routes(timestamp, routes):
+        saved[routes[0].hostname] = time.perf_counter()
+        storage.save_routes(timestamp, routes)
+
+    result = fetch.fetch_checkpoint(device_list, save_routes, storage.save_parse_stats, timestamp="2024-05-09_08:00",
+                                    output_directory=str(tmp_path), compression="gzip", workers=2,
+                                    collect_function=fleet.collect_device)
+
+    assert result["timestamp"] == "2024-05-09_08:00"
+    assert result["routes"] == 1600
+    assert {hostname: device["routes"] for hostname, device in result["devices"].items()} == {f"PE{index}": 400 for index in range(4)}
+    assert all(device["error"] == "" for device in result["devices"].values())
+    assert result["devices"]["PE0"]["file"] == str(tmp_path / "PE0.txt.gz")
+    assert all(saved[f"PE{index}"] < fleet.finished["PE3"] for index in range(3))
+    assert storage.get_list_of_timestamps("PE3") == [("PE3", "Base", "2024-05-09_08:00")]
+    assert len(storage.get_routes("PE2", "Base", "2024-05-09_08:00")) == 400
+    assert storage.get_parse_stats("PE1", "2024-05-09_08:00")["entries_matched"] == 400
+    # the slow device is parsed and saved soon after it is collected
+    assert result["total_seconds"] < result["collect_seconds"] + 5
+
+
+def test_fetch_checkpoint_reports_device_errors(database):
+    def collect_device(device_dict, sink):
+        if device_dict["hostname"] == "PE0":
+            return {"hostname": "PE0", "ip": device_dict["ip"], "output": {}, "error": "AuthenticationFailed,"}
+        device_output = sink.open_device(device_dict["hostname"])
+        device_output.start_command("show router route-table")
+        device_output.write("".join(generator.iter_route_table_lines(10)))
+        device_output.end_command()
+        return {"hostname": device_dict["hostname"], "ip": device_dict["ip"], "output": {}, "error": "", "capture": device_output.close()}
+
+    device_list = devices(3)
+    device_list[2]["device_type"] = "juniper_junos"
+    result = fetch.fetch_checkpoint(device_list, storage.save_routes, timestamp="2024-05-09_08:00", collect_function=collect_device)
+
+    assert result["routes"] == 10
+    assert result["devices"]["PE0"] == {"error": "AuthenticationFailed,", "file": None, "routes": 0}
+    assert result["devices"]["PE1"]["routes"] == 10
+    assert result["devices"]["PE2"]["error"] == "UnsupportedVendor,"
+    assert storage.get_list_of_timestamps("PE2") == []
+
+
+def test_fetch_checkpoint_skips_route_tables_cut_short(database):
+    errors = {"PE0": "Disconnected:show router route-table,", "PE1": "ReadTimeout:show router route-table,",
+              "PE2": "ReadTimeout:show version,", "PE3": "Disconnected:show version,"}
+
+    def collect_device(device_dict, sink):
+        hostname = device_dict["hostname"]
+        device_output = sink.open_device(hostname)
+        device_output.start_command("show version")
+        device_output.end_command()
+        if hostname != "PE3":
+            device_output.start_command("show router route-table")
+            # PE0 and PE1 are cut in the middle of the table
+            lines = list(generator.iter_route_table_lines(10))
+            device_output.write("".join(lines[:len(lines) // 2] if hostname in ("PE0", "PE1") else lines))
+            device_output.end_command()
+        return {"hostname": hostname, "ip": device_dict["ip"], "output": {}, "error": errors[hostname],
+                "capture": device_output.close(complete=False)}
+
+    result = fetch.fetch_checkpoint(devices(4), storage.save_routes, timestamp="2024-05-09_08:00", collect_function=collect_device)
+
+    assert {hostname: device["error"] for hostname, device in result["devices"].items()} == {
+        "PE0": "Disconnected:show router route-table,IncompleteOutput,",
+        "PE1": "ReadTimeout:show router route-table,IncompleteOutput,",
+        "PE2": "ReadTimeout:show version,",
+        "PE3": "Disconnected:show version,IncompleteOutput,",
+    }
+    assert result["routes"] == 10
+    assert storage.get_list_of_timestamps("PE0") == storage.get_list_of_timestamps("PE1") == []
+    assert len(storage.get_routes("PE2", "Base", "2024-05-09_08:00")) == 10
+
+
+def test_fetch_checkpoint_saves_the_others_after_an_empty_route_table(database):
+    def collect_device(device_dict, sink):
+        hostname = device_dict["hostname"]
+        device_output = sink.open_device(hostname)
+        device_output.start_command("show version")
+        device_output.write("TiMOS-C-23.10.R1 cpm/x86_64 Nokia 7750 SR")
+        device_output.end_command()
+        if hostname != "PE1":
+            device_output.start_command("show router route-table")
+            device_output.write("".join(generator.iter_route_table_lines(0 if hostname == "PE0" else 10)))
+            device_output.end_command()
+        return {"hostname": hostname, "ip": device_dict["ip"], "output": {}, "error": "", "capture": device_output.close()}
+
+    # PE0 has an empty route table, PE1 doesn't run the route table command
+    device_list = devices(3)
+    device_list[1]["commands"] = ["show version"]
+    result = fetch.fetch_checkpoint(device_list, storage.save_routes, storage.save_parse_stats, timestamp="2024-05-09_08:00",
+                                    collect_function=collect_device)
+
+    assert {hostname: (device["error"], device["routes"]) for hostname, device in result["devices"].items()} == {
+        "PE0": ("", 0), "PE1": ("", 0), "PE2": ("", 10)}
+    assert result["routes"] == 10
+    assert storage.get_list_of_timestamps("PE0") == []
+    assert storage.get_parse_stats("PE0", "2024-05-09_08:00")["entries_matched"] == 0
+    assert len(storage.get_routes("PE2", "Base", "2024-05-09_08:00")) == 10
+
+
+def test_fetch_daemon_only_fetches_the_device_with_the_ip_address(monkeypatch):
+    import orchestrator
+
+    fetched = []
+    monkeypatch.setattr(orchestrator, "_load_device_list", lambda inventory_filename, command_filename: devices(3))
+    monkeypatch.setattr(orchestrator, "_fetch_checkpoint", lambda device_list, *args: fetched.append(device_list))
+
+    assert orchestrator.fetch_daemon("inventory.yml", "commands.yml", 15, cycles=1, ip_address="192.0.2.1") == 1
+    assert orchestrator.fetch_daemon("inventory.yml", "commands.yml", 15, cycles=1, ip_address="192.0.2.9") is None
+    assert [[device["hostname"] for device in device_list] for device_list in fetched] == [["PE1"]]
@@ -0,0 +1,134 @@
+import bz2
+import gzip
+import lzma
+
+import pytest
+
+import app.file_operations as file_operations
+import app.formatter as formatter
+import app.netparser as netparser
+import app.tests.nokia_output_generator as generator
+
+COMPRESSORS = {
+    "gzip": (".gz", gzip.open),
+    "xz": (".xz", lzma.open),
+    "bz2": (".bz2", bz2.open),
+}
+
+
+@pytest.fixture
+def route_table_lines():
+    return list(generator.iter_route_table_lines(500))
+
+
+@pytest.mark.parametrize("compression", COMPRESSORS.keys())
+def test_open_capture_decompresses_stream(compression, route_table_lines, tmp_path):
+    extension, compressor_open = COMPRESSORS[compression]
+    capture_file = str(tmp_path / f"route-table.txt{extension}")
+    with compressor_open(capture_file, "wt", encoding="utf-8") as f:
+        f.writelines(route_table_lines)
+
+    assert file_operations.detect_compression(capture_file) == compression
+    with file_operations.open_capture(capture_file) as f:
+        assert list(f) == route_table_lines
+    assert file_operations.is_json_capture(capture_file) is False
+
+
+def test_open_capture_detects_compression_by_magic_bytes(route_table_lines, tmp_path):
+    # archived with a misleading name, the content decides
+    capture_file = str(tmp_path / "route-table.txt")
+    with gzip.open(capture_file, "wt", encoding="utf-8") as f:
+        f.writelines(route_table_lines)
+
+    routes = [
+        route
+        for batch in netparser.iter_parse("nokia", file_operations.open_capture(capture_file), "HOSTNAME1", "2024-05-09_08:00")
+        for route in batch
+    ]
+    assert len(routes) == 500
+
+
+def test_open_capture_plain_file_with_compressed_extension(route_table_lines, tmp_path):
+    capture_file = tmp_path / "route-table.txt.gz"
+    capture_file.write_text("".join(route_table_lines))
+
+    assert file_operations.detect_compression(str(capture_file)) is None
+    with file_operations.open_capture(str(capture_file)) as f:
+        assert list(f) == route_table_lines
+
+
+def test_open_capture_zstd(route_table_lines, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    capture_file = tmp_path / "route-table.txt.zst"
+    capture_file.write_bytes(zstandard.ZstdCompressor().compress("".join(route_table_lines).encode("utf-8")))
+
+    assert file_operations.detect_compression(str(capture_file)) == "zstd"
+    with file_operations.open_capture(str(capture_file)) as f:
+        assert list(f) == route_table_lines
+
+
+def test_mapped_capture_iter_lines(route_table_lines, tmp_path, monkeypatch):
+    capture_file = tmp_path / "route-table.txt"
+    capture_file.write_text("".join(route_table_lines))
+    # small chunks so lines are decoded across many chunks
+    monkeypatch.setattr(file_operations.MappedCapture, "CHUNK_SIZE", 100)
+
+    with file_operations.MappedCapture(str(capture_file)) as capture:
+        assert len(capture) == capture_file.stat().st_size
+        assert list(capture.iter_lines()) == route_table_lines
+        # the mmap is closed on exit while a reader is still iterating, no view of it is left exported
+        lines = capture.iter_lines()
+        assert next(lines) == route_table_lines[0]
+
+
+@pytest.mark.parametrize("parts", [1, 2, 7, 64])
+def test_mapped_capture_split_offsets_on_entry_boundaries(parts, route_table_lines, tmp_path):
+    capture_file = tmp_path / "route-table.txt"
+    capture_file.write_text("".join(route_table_lines))
+
+    with file_operations.MappedCapture(str(capture_file)) as capture:
+        offsets = capture.split_offsets(parts)
+        slices = [list(capture.iter_lines(start, end)) for start, end in offsets]
+
+    assert offsets[0][0] == 0
+    assert offsets[-1][1] == capture_file.stat().st_size
+    assert all(previous[1] == following[0] for previous, following in zip(offsets, offsets[1:]))
+    assert [line for lines in slices for line in lines] == route_table_lines
+    # every slice starts with a line that doesn't continue an entry
+    assert all(not lines[0].startswith(" ") for lines in slices)
+
+
+def test_mapped_capture_empty_and_compressed_files(tmp_path):
+    empty_file = tmp_path / "empty.txt"
+    empty_file.write_text("")
+    with file_operations.MappedCapture(str(empty_file)) as capture:
+        assert list(capture.iter_lines()) == []
+        assert capture.split_offsets(4) == []
+
+    compressed_file = str(tmp_path / "route-table.txt.gz")
+    with gzip.open(compressed_file, "wt") as f:
+        f.write("text")
+    with pytest.raises(ValueError):
+        with file_operations.MappedCapture(compressed_file):
+            pass
+
+
+def test_iter_command_sections(route_table_lines, tmp_path):
+    [(_, scrape_output)] = formatter.scrape_output_per_device([{
+        "hostname": "HOSTNAME1",
+        "output": {"show version": "TiMOS-C-23.10.R1\n", "show router route-table": "".join(route_table_lines)},
+    }])
+    scrape_file = tmp_path / "HOSTNAME1.txt"
+    scrape_file.write_text(scrape_output)
+
+    assert file_operations.is_scrape_capture(str(scrape_file))
+    with file_operations.open_capture(str(scrape_file)) as f:
+        sections = [(command, list(lines)) for command, lines in file_operations.iter_command_sections(f)]
+    assert [command for command, _ in sections] == ["show version", "show router route-table"]
+    assert sections[0][1] == ["TiMOS-C-23.10.R1\n", "\n"]
+    assert sections[1][1] == route_table_lines + ["\n"]
+
+    # Unconsumed sections are skipped
+    commands = [command for command, _ in file_operations.iter_command_sections(scrape_output.splitlines(keepends=True))]
+    assert commands == ["show version", "show router route-table"]
+    assert list(file_operations.iter_command_sections(["line\n"]))[0][0] is None
@@ -0,0 +1,81 @@
+import json
+
+import app.collector as collector
+import app.metrics as metrics
+import app.tests.ssh_farm as ssh_farm
+
+
+def response(hostname, error="", total_seconds=1.0, attempts=1, commands=None):
+    return {
+        "hostname": hostname,
+        "error": error,
+        "metrics": {
+            "connect": [{"attempt": attempt, "seconds": 0.1, "error": ""} for attempt in range(1, attempts + 1)],
+            "connect_seconds": 0.1,
+            "prompt_seconds": 0.2,
+            "commands": commands or {},
+            "total_seconds": total_seconds,
+        },
+    }
+
+
+def test_classify_error():
+    assert metrics.classify_error("") == "ok"
+    assert metrics.classify_error("AuthenticationFailed,MaximumNumberRetriesReached") == "auth"
+    assert metrics.classify_error("Timeout,Timeout,MaximumNumberRetriesReached") == "connect_timeout"
+    assert metrics.classify_error("ReadTimeout:show router route-table,") == "read_timeout"
+    assert metrics.classify_error("Disconnected:show version,") == "disconnected"
+    assert metrics.classify_error("JumpHostChannelError,MaximumNumberRetriesReached") == "jump_host"
+    assert metrics.classify_error("ProxyConnectionError,MaximumNumberRetriesReached") == "proxy"
+    assert metrics.classify_error("CircuitOpen") == "circuit_open"
+    assert metrics.classify_error("Something") == "unknown"
+
+
+def test_summarize(tmp_path):
+    command = {"show version": {"seconds": 0.5, "first_byte_seconds": 0.1, "characters": 100, "error": ""}}
+    responses = [response(f"PE{index}", total_seconds=float(index), commands=command) for index in range(1, 101)]
+    responses.append(response("PE101", "Timeout,Timeout,MaximumNumberRetriesReached", 30.0, attempts=2))
+
+    summary = metrics.summarize(responses, wall_seconds=50.0, slowest=3)
+
+    assert summary["devices"] == 101
+    assert summary["devices_per_second"] == 2.02
+    assert summary["errors"] == {"ok": 100, "connect_timeout": 1}
+    assert (summary["connect_attempts"], summary["retried_devices"]) == (102, 1)
+    assert summary["device_seconds"] == {"count": 101, "p50": 49.0, "p90": 90.0, "p99": 99.0, "max": 100.0}
+    assert [device["hostname"] for device in summary["slowest_devices"]] == ["PE100", "PE99", "PE98"]
+    assert summary["commands"]["show version"]["characters"] == 10000
+    assert summary["commands"]["show version"]["characters_per_second"] == 200.0
+    assert "connect_timeout 1" in metrics.format_summary(summary)
+
+    metrics.write_summary(summary, tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text()) == summary
+
+
+def test_collection_metrics_from_the_farm():
+    profiles = [
+        ssh_farm.DeviceProfile("PE0", routes=100),
+        ssh_farm.DeviceProfile("PE1", routes=100, login_latency=0.3),
+        ssh_farm.DeviceProfile("PE2", routes=100, command_latency=0.3),
+        ssh_farm.DeviceProfile("PE3", failure="auth"),
+    ]
+
+    with ssh_farm.SSHFarm(profiles) as farm:
+        devices = farm.devices(timeout=1)
+        for device in devices:
+            device["connect_attempts"] = 1
+        responses = {response["hostname"]: response for response in collector.collect_devices(devices, concurrency=4)}
+
+    for hostname in ("PE0", "PE1", "PE2"):
+        device_metrics = responses[hostname]["metrics"]
+        assert [attempt["error"] for attempt in device_metrics["connect"]] == [""]
+        assert device_metrics["connect_seconds"] > 0 and device_metrics["prompt_seconds"] > 0
+        assert device_metrics["commands"]["show router route-table"]["characters"] >= len(profiles[0].route_table().strip())
+        assert device_metrics["total_seconds"] >= device_metrics["connect_seconds"] + device_metrics["prompt_seconds"]
+    assert responses["PE1"]["metrics"]["connect_seconds"] >= 0.3
+    assert responses["PE2"]["metrics"]["commands"]["show router route-table"]["first_byte_seconds"] >= 0.3
+    assert [attempt["error"] for attempt in responses["PE3"]["metrics"]["connect"]] == ["AuthenticationFailed"]
+
+    summary = metrics.summarize(list(responses.values()))
+    assert summary["errors"] == {"ok": 3, "auth": 1}
+    assert summary["connect_seconds"]["count"] == 3
@@ -0,0 +1,155 @@
+import pytest
+
+import app.ages as ages
+import app.formatter as formatter
+import app.netparser as netparser
+import app.route_record as route_record
+import app.tests.nokia_output_generator as generator
+from app.tests.test_nokia_route_table import route_table
+
+
+def test_registered_parser_module_is_imported_on_first_use(monkeypatch):
+    monkeypatch.setitem(netparser.VENDOR_PARSERS, "test_vendor", [])
+    entry = netparser.register_parser("TEST_VENDOR", "test_vendor_missing.grammar", commands=[r"show route"])
+
+    # Registering and selecting the parser doesn't import the module
+    assert netparser.get_parser_entry("test_vendor") is entry
+    assert netparser.get_parser_entry("test_vendor", "show route vrf 10") is entry
+    # The module is only imported when the parser is used
+    with pytest.raises(ModuleNotFoundError):
+        entry.module
+
+
+@pytest.mark.parametrize(
+    "command, expected_table",
+    [
+        ("show router route-table", "route"),
+        ("show router 10 route-table", "route"),
+        ("show  router 10  route-table 10.0.0.0/8 longer", "route"),
+        ("show router bgp routes vpn-ipv4", "bgp"),
+        ("show router 10 bgp routes vpn-ipv4", "bgp"),
+    ]
+)
+def test_get_parser_entry_by_command(command, expected_table):
+    entry = netparser.get_parser_entry("Nokia", command)
+    assert entry.table == expected_table
+    assert entry.streaming
+    assert entry.parallel == (expected_table == "route")
+
+
+def test_get_parser_entry_unknown():
+    assert netparser.get_parser_entry("nokia", "show version") is None
+    assert netparser.get_parser_entry("unknown_vendor") is None
+    with pytest.raises(ValueError):
+        netparser.parse("unknown_vendor", "", "HOSTNAME1", "2024-05-09_08:00")
+
+
+@pytest.mark.parametrize("batch_lines", [1, 5, 1000])
+def test_iter_parse_matches_parse(route_table, batch_lines):
+    routes = netparser.parse("nokia", route_table, "HOSTNAME1", "2024-05-09_08:00")
+    streamed_routes = [
+        route
+        for batch in netparser.iter_parse("nokia", route_table.splitlines(keepends=True), "HOSTNAME1", "2024-05-09_08:00", batch_lines=batch_lines)
+        for route in batch
+    ]
+
+    assert len(routes) == 17
+    assert streamed_routes == routes
+    assert all(route.service == "Base" for route in streamed_routes)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_iter_parse_parallel_matches_iter_parse(workers, tmp_path):
+    capture_file = str(tmp_path / "route-table.txt")
+    generator.write_capture(capture_file, generator.iter_route_table_lines(3000, service="VPRN10"))
+
+    with open(capture_file) as f:
+        routes = [route for batch in netparser.iter_parse("nokia", f, "HOSTNAME1", "2024-05-09_08:00") for route in batch]
+    parallel_routes = [
+        route
+        for batch in netparser.iter_parse_parallel("nokia", capture_file, "HOSTNAME1", "2024-05-09_08:00", workers, slices_per_worker=3)
+        for route in batch
+    ]
+
+    assert len(parallel_routes) == 3000
+    assert parallel_routes == routes
+    assert all(route.service == "VPRN10" for route in parallel_routes)
+
+
+def test_iter_parse_parallel_matches_iter_parse_sections_field_by_field(tmp_path):
+    capture_file = str(tmp_path / "route-table.txt")
+    generator.write_capture(capture_file, generator.iter_route_table_lines(1000, service="VPRN10", seed=2))
+    attributes = route_record.FIELDS + route_record.COMPUTED_ATTRIBUTES
+
+    with open(capture_file) as f:
+        routes = [route for batch in netparser.iter_parse_sections("nokia", f, "HOSTNAME1", "2024-05-09_08:00") for route in batch]
+    parallel_routes = [
+        route
+        for batch in netparser.iter_parse_parallel("nokia", capture_file, "HOSTNAME1", "2024-05-09_08:00", 2, slices_per_worker=3)
+        for route in batch
+    ]
+
+    assert len(routes) == 1000
+    assert [[getattr(route, attribute) for attribute in attributes] for route in parallel_routes] == \
+        [[getattr(route, attribute) for attribute in attributes] for route in routes]
+    assert all(route.route and route.service == "VPRN10" for route in parallel_routes)
+
+
+def test_iter_parse_parallel_rejects_other_tables(tmp_path):
+    capture_file = str(tmp_path / "bgp.txt")
+    generator.write_capture(capture_file, generator.iter_bgp_vpn_ipv4_lines(50))
+
+    assert not netparser.get_parser_entry("nokia", table="bgp").parallel
+    with pytest.raises(ValueError, match="bgp"):
+        list(netparser.iter_parse_parallel("nokia", capture_file, "HOSTNAME1", "2024-05-09_08:00", 2, table="bgp"))
+
+
+def test_iter_parse_sections_parses_every_route_table(tmp_path):
+    [(_, scrape_output)] = formatter.scrape_output_per_device([{
+        "hostname": "HOSTNAME1",
+        "output": {
+            "show version": "TiMOS-C-23.10.R1 cpm/x86_64 Nokia 7750 SR\n",
+            "show router route-table": "".join(generator.iter_route_table_lines(50)),
+            "show router bgp routes vpn-ipv4": "".join(generator.iter_bgp_vpn_ipv4_lines(20)),
+            "show router 10 route-table": "".join(generator.iter_route_table_lines(30, service="VPRN10", seed=1)),
+        },
+    }])
+
+    routes = [
+        route
+        for batch in netparser.iter_parse_sections("nokia", scrape_output.splitlines(keepends=True), "HOSTNAME1", "2024-05-09_08:00")
+        for route in batch
+    ]
+
+    assert len(routes) == 80
+    assert [route.service for route in routes] == ["Base"] * 50 + ["VPRN10"] * 30
+    expected = netparser.parse("nokia", "".join(generator.iter_route_table_lines(30, service="VPRN10", seed=1)), "HOSTNAME1", "2024-05-09_08:00")
+    assert routes[50:] == expected
+
+
+@pytest.mark.parametrize("slices_per_worker", [1, 5, 40])
+def test_iter_parse_parallel_finds_table_regions_of_slices(slices_per_worker, tmp_path):
+    capture_file = str(tmp_path / "route-tables.txt")
+    lines = list(generator.iter_route_table_lines(200, service="Base"))
+    lines += list(generator.iter_route_table_lines(300, service="VPRN10", seed=1))
+    generator.write_capture(capture_file, lines)
+
+    epoch = ages.timestamp_to_epoch("2024-05-09_08:00")
+    stats = netparser.ParseStats()
+    routes = [route for batch in netparser.iter_parse("nokia", lines, "HOSTNAME1", "2024-05-09_08:00", stats=stats) for route in batch]
+    parallel_stats = netparser.ParseStats()
+    parallel_routes = [
+        route
+        for batch in netparser.iter_parse_parallel("nokia", capture_file, "HOSTNAME1", "2024-05-09_08:00", 2,
+                                                   slices_per_worker=slices_per_worker, stats=parallel_stats)
+        for route in batch
+    ]
+
+    assert [route.service for route in routes] == ["Base"] * 200 + ["VPRN10"] * 300
+    assert parallel_routes == routes
+    assert [route.prefix_key for route in parallel_routes] == [route.prefix_key for route in routes]
+    assert all(route.prefix_key for route in routes)
+    assert [route.installed_at for route in parallel_routes] == [route.installed_at for route in routes]
+    assert all(route.installed_at == epoch - ages.age_to_seconds(route.age) for route in routes)
+    assert parallel_stats.to_dict() == stats.to_dict()
+    assert stats.rejected == 0
@@ -0,0 +1,163 @@
+import inspect
+import os
+import time
+
+import netmiko
+import pytest
+from netmiko.base_connection import BaseConnection
+from netmiko.exceptions import ReadTimeout
+
+import app.network_interface as network_interface
+import app.yaml_operations as yaml_operations
+
+
+class FakeConnection:
+    """The channel of a netmiko connection, the output of a command is returned in chunks"""
+
+    RETURN = "\n"
+    RESPONSE_RETURN = "\n"
+    base_prompt = "A:PE1"
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.written = []
+        self.reads = 0
+
+    def write_channel(self, data):
+        self.written.append(data)
+
+    def read_channel(self):
+        self.reads += 1
+        return self.chunks.pop(0) if self.chunks else ""
+
+    def strip_command(self, command_string, output):
+        return output.split(self.RESPONSE_RETURN, 1)[1] if output.startswith(command_string) else output
+
+    def strip_prompt(self, a_string):
+        lines = a_string.split(self.RESPONSE_RETURN)
+        return self.RESPONSE_RETURN.join(lines[:-1]) if self.base_prompt in lines[-1] else a_string
+
+
+def test_read_until_prompt_finds_a_prompt_split_between_reads():
+    connection = FakeConnection(["show router route-table\n", "", "line 1\nline 2\n", "A:P", "E1# "])
+
+    output = network_interface.read_until_prompt(connection, "show router route-table")
+
+    assert connection.written == ["show router route-table\n"]
+    assert output == "line 1\nline 2"
+    assert connection.chunks == []
+
+
+def test_read_until_prompt_skips_the_command_echo():
+    # the echo of the command matches the expect string, the output ends at the next match
+    connection = FakeConnection(["show ro", "uter route-table\nline 1\n", "route-table done\nA:PE1# "])
+
+    output = network_interface.read_until_prompt(connection, "show router route-table", expect_string=r"route-table")
+
+    assert output == "line 1\nroute-table done"
+
+
+def test_read_until_prompt_skips_a_prompt_left_before_the_echo():
+    # the prompt of the last command of the session preparation arrives after the buffer was cleared
+    connection = FakeConnection(["\nA:PE1# ", "show version\n", "TiMOS-C-23.10.R1\n", "A:PE1# "])
+
+    output = network_interface.read_until_prompt(connection, "show version")
+
+    assert output == "TiMOS-C-23.10.R1"
+
+
+def test_read_until_prompt_timeout():
+    connection = FakeConnection(["show version\n", "TiMOS-C-23.10.R1\n"])
+
+    with pytest.raises(ReadTimeout):
+        network_interface.read_until_prompt(connection, "show version", read_timeout=0.05)
+
+
+def test_read_until_prompt_reads_large_outputs_at_line_rate():
+    line = "10.0.0.0/24                                   Remote  BGP VPN   25d20h48m  170\n"
+    chunks = ["show router route-table\n"] + [line * 400] * 5000 + ["A:PE1# "]
+    connection = FakeConnection(chunks)
+
+    start = time.perf_counter()
+    output = network_interface.read_until_prompt(connection, "show router route-table")
+    elapsed = time.perf_counter() - start
+    print(f"\nRead {len(output) / 1024 / 1024:.0f} MB in {elapsed:.3f} seconds, {len(output) / 1024 / 1024 / elapsed:.0f} MB/s")
+
+    assert len(output) == len(line) * 400 * 5000 - 1
+    # no wait between reads with data
+    assert connection.reads == len(chunks)
+    assert elapsed < 5
+
+
+def test_generate_device_list_command_options():
+    inventory = {"PE1": {"vendor": "nokia_sros", "roles": "pe", "site": "SITE1",
+                         "connection": {"default": {"mgmt_ip": "192.0.2.1"}}}}
+    commands = {
+        "all": ["show version"],
+        "pe": [
+            {"command": "show router route-table", "read_timeout": 900, "expect_string": r"A:\S+# $"},
+            {"command": "environment more false", "mode": "timing"},
+            "show version",
+        ],
+    }
+
+    [device] = yaml_operations.generate_device_list(inventory, commands)
+
+    assert device["commands"] == ["show router route-table", "environment more false", "show version"]
+    assert device["command_options"] == {
+        "show router route-table": {"read_timeout": 900, "expect_string": r"A:\S+# $"},
+        "environment more false": {"mode": "timing"},
+    }
+    assert device["site"] == "SITE1"
+
+
+def test_connect_device_connects_the_proxy_socket(monkeypatch):
+    sockets = []
+
+    class StandInSocket:
+        def set_proxy(self, **proxy):
+            self.proxy = proxy
+
+        def connect(self, address):
+            self.address = address
+
+    def socksocket():
+        sockets.append(StandInSocket())
+        return sockets[-1]
+
+    monkeypatch.setattr(network_interface.socks, "socksocket", socksocket)
+    monkeypatch.setattr(network_interface, "ConnectHandler", lambda **kwargs: type("Connection", (), {
+        "is_alive": lambda self: True, "sock": kwargs["sock"], "_modify_connection_params": lambda self: None,
+        "establish_connection": lambda self: None, "_try_session_preparation": lambda self: None})())
+    proxy = {"proxy_type": 2, "addr": "192.0.2.250", "port": 1080}
+
+    connection, error_response = network_interface.connect_device("PE1", {"ip": "192.0.2.1", "port": 22, "proxy": proxy})
+
+    assert error_response is None
+    assert connection.sock is sockets[0]
+    assert (sockets[0].proxy, sockets[0].address) == (proxy, ("192.0.2.1", 22))
+
+
+def test_open_connection_steps_match_the_pinned_netmiko():
+    # open_connection calls private methods of netmiko, a new pin must be checked against them
+    with open(os.path.join(os.path.dirname(network_interface.__file__), "requirements.txt")) as f:
+        assert f"netmiko=={network_interface.NETMIKO_VERSION}" in f.read().split()
+    assert netmiko.__version__ == network_interface.NETMIKO_VERSION
+    steps = [line.strip() for line in inspect.getsource(BaseConnection._open).splitlines() if line.strip().startswith("self.")]
+    assert steps == [f"self.{step}()" for step in network_interface.NETMIKO_OPEN_STEPS]
+
+
+def test_open_connection_without_the_netmiko_steps(monkeypatch):
+    handlers = []
+
+    def connect_handler(**kwargs):
+        handlers.append(kwargs)
+        return type("Connection", (), {})()
+
+    monkeypatch.setattr(network_interface, "ConnectHandler", connect_handler)
+    metrics = {}
+
+    network_interface.open_connection({"ip": "192.0.2.1", "sock": "channel"}, metrics)
+
+    assert handlers == [{"ip": "192.0.2.1", "sock": "channel", "auto_connect": False}, {"ip": "192.0.2.1", "sock": "channel"}]
+    assert list(metrics) == ["connect_seconds"]
@@ -1,6 +1,8 @@
 import pytest
 
+import app.netparser as netparser
 import app.nokia.grammar as ngrammar
+import app.tests.nokia_output_generator as generator
 
 @pytest.fixture
 def route_table():
@@ -255,3 +257,92 @@ def test_nokia_igp_route_table_parse(route_table,):
 
 
 
+def test_nokia_iter_table_lines_skips_non_table_text():
+    bgp_output = "".join(generator.iter_bgp_vpn_ipv4_lines(2))
+    lines = list(ngrammar.iter_table_lines(bgp_output.splitlines(keepends=True)))
+
+    assert lines[0].strip().startswith("BGP Router ID")
+    assert "BGP VPN-IPv4 Routes\n" in lines
+    # the legend, the column headers and the footer are not table text
+    assert not any("Legend" in line or "Status codes" in line for line in lines)
+    assert not any(line.startswith("Flag  Network") for line in lines)
+    assert not any(line.startswith("Routes :") for line in lines)
+    assert len(lines) == 2 + 2 * 3
+
+
+def test_nokia_iter_table_lines_keeps_consecutive_tables():
+    output = "".join(generator.iter_route_table_lines(3, service="Base"))
+    output += "".join(generator.iter_route_table_lines(4, service="VPRN10", seed=1))
+    lines = list(ngrammar.iter_table_lines(output.splitlines(keepends=True)))
+
+    assert [line for line in lines if line.startswith("Route Table")] == [
+        "Route Table (Router: Base)\n",
+        "Route Table (Service: VPRN10)\n",
+    ]
+    assert len(lines) == 2 + 2 * (3 + 4)
+    assert [route["service_name"] for route in ngrammar.parse_service("".join(lines))] == ["Base", "VPRN10"]
+
+
+def test_nokia_iter_table_lines_without_separators(route_table):
+    body = route_table.split("-" * 79 + "\n")[1]
+    assert "".join(ngrammar.iter_table_lines(body.splitlines(keepends=True))) == body
+    assert len(ngrammar.parse_output(body)) == len(expected_result)
+
+
+def test_nokia_parse_stats_report_rejected_routes(route_table):
+    unknown_protocol = (
+        "10.99.0.1/32                                  Remote  OSPF      00h08m44s  10\n"
+        "       10.190.144.128                                               5\n"
+    )
+    header, body = route_table.split("-" * 79 + "\n")
+    output = header + "-" * 79 + "\n" + unknown_protocol + body
+    stats = netparser.ParseStats()
+
+    result = ngrammar.parse_output(output, stats=stats)
+
+    assert len(result) == len(expected_result)
+    assert stats.entries_matched == len(expected_result)
+    assert stats.lines_scanned == len(output.splitlines())
+    # the route line and its next hop line
+    assert stats.skipped_in_table == 2
+    assert stats.rejected == 1
+    assert stats.rejected_samples == [unknown_protocol.splitlines()[0].rstrip()]
+    # the separators, the title is in the table text but isn't skipped, and the two header lines
+    assert stats.skipped_outside_table == 3 + 2
+
+
+def test_nokia_parse_stats_without_rejected_routes():
+    stats = netparser.ParseStats()
+    output = "".join(generator.iter_bgp_vpn_ipv4_lines(30))
+    for _ in ngrammar.iter_parse_bgp_output(output.splitlines(keepends=True), batch_lines=10, stats=stats):
+        pass
+
+    assert stats.entries_matched == 30
+    assert stats.skipped_in_table == stats.rejected == 0
+    assert stats.lines_scanned == len(output.splitlines())
+    assert stats.skipped_outside_table == stats.lines_scanned - 30 * 3 - 2
+
+
+def test_nokia_ipv6_and_mask_quads_route_table():
+    output = """===============================================================================
+Route Table (Router: Base)
+===============================================================================
+Dest Prefix[Flags]                            Type    Proto     Age        Pref
+      Next Hop[Interface Name]                                    Metric   
+-------------------------------------------------------------------------------
+2001:DB8:0:0::/48                             Remote  BGP       00h01m02s  170
+       2001:db8:ffff::1                                             10
+2001:db8:10::5/64 [B]                         Remote  ISIS      25d20h48m  18
+       fe80::1-"to-core"                                            20
+::/0                                          Remote  Static    0241d11h   5
+       2001:db8:ffff::2 (tunneled:SR-ISIS:1000)                     1
+10.0.0.5/255.255.255.0                        Local   Local     0241d11h   0
+       INTERFACE-NAME_1                                             0
+-------------------------------------------------------------------------------
+"""
+    result = ngrammar.parse_output(output)
+
+    assert [entry.get("route") for entry in result] == ["2001:DB8:0:0::/48", "2001:db8:10::5/64", "::/0", "10.0.0.5/255.255.255.0"]
+    assert [entry.get("next_hop") for entry in result] == ["2001:db8:ffff::1", 'fe80::1-"to-core"', "2001:db8:ffff::2", "INTERFACE-NAME_1"]
+    assert result[1].get("flags") == "B"
+    assert result[2].get("interface_next_hop") == "tunneled:SR-ISIS:1000"
@@ -0,0 +1,181 @@
+import os
+import random
+import threading
+import tracemalloc
+
+import pytest
+
+import app.file_operations as file_operations
+import app.netparser as netparser
+import app.network_interface as network_interface
+import app.output_sinks as output_sinks
+import app.tests.nokia_output_generator as generator
+from app.tests.test_network_interface import FakeConnection
+
+
+def write_device(sink, hostname, outputs, piece_size=7):
+    device_output = sink.open_device(hostname)
+    for command, output in outputs.items():
+        device_output.start_command(command)
+        for start in range(0, len(output), piece_size):
+            device_output.write(output[start:start + piece_size])
+        device_output.end_command()
+    return device_output.close()
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "xz", "bz2"])
+def test_file_sink_writes_scrape_captures(compression, tmp_path):
+    outputs = {"show version": "TiMOS-C-23.10.R1\n", "show router route-table": "".join(generator.iter_route_table_lines(20))}
+    sink = output_sinks.FileSink(str(tmp_path / "captures"), compression)
+
+    metadata = write_device(sink, "PE1", outputs)
+
+    assert metadata["file"] == sink.filename("PE1")
+    assert metadata["characters"] == {command: len(output) for command, output in outputs.items()}
+    assert file_operations.detect_compression(metadata["file"]) == compression
+    assert file_operations.is_scrape_capture(metadata["file"])
+    with file_operations.open_capture(metadata["file"]) as f:
+        sections = {command: "".join(lines) for command, lines in file_operations.iter_command_sections(f)}
+    assert sections == {command: output + "\n" for command, output in outputs.items()}
+    assert not (tmp_path / "captures" / "PE1.txt.part").exists()
+
+
+def test_file_sink_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        output_sinks.FileSink(str(tmp_path), "rar")
+
+
+def test_parser_sink_matches_iter_parse_sections(tmp_path):
+    outputs = {
+        "show version": "TiMOS-C-23.10.R1\n",
+        "show router route-table": "".join(generator.iter_route_table_lines(300)),
+        "show router 10 route-table": "".join(generator.iter_route_table_lines(200, service="VPRN10", seed=1)),
+    }
+    routes = []
+    lock = threading.Lock()
+
+    def on_routes(hostname, batch):
+        assert hostname == "PE1"
+        with lock:
+            routes.extend(batch)
+
+    sink = output_sinks.TeeSink(
+        output_sinks.FileSink(str(tmp_path)),
+        output_sinks.ParserSink("nokia", "2024-05-09_08:00", on_routes),
+    )
+    metadata = write_device(sink, "PE1", outputs, piece_size=997)
+
+    with file_operations.open_capture(metadata["file"]) as f:
+        expected = [route for batch in netparser.iter_parse_sections("nokia", f, "PE1", "2024-05-09_08:00") for route in batch]
+    assert len(expected) == 500
+    assert routes == expected
+    assert metadata["routes"] == 500
+    assert "parse_error" not in metadata
+
+
+def test_parser_sink_reports_parse_errors():
+    sink = output_sinks.ParserSink("unknown_vendor", "2024-05-09_08:00", lambda hostname, routes: None)
+
+    metadata = write_device(sink, "PE1", {"show router route-table": "x" * 100000}, piece_size=10)
+
+    assert metadata["routes"] == 0
+    assert metadata["parse_error"].startswith("ValueError")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_read_until_prompt_streams_the_output_it_returns(seed):
+    output = "".join(generator.iter_route_table_lines(50, seed=seed))
+    data = "show router route-table\n" + output + "A:PE1# "
+    randomizer = random.Random(seed)
+    cuts = sorted(randomizer.sample(range(1, len(data)), 40))
+    chunks = [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+    pieces = []
+    assert network_interface.read_until_prompt(FakeConnection(chunks), "show router route-table", write=pieces.append) is None
+
+    assert "".join(pieces) == network_interface.read_until_prompt(FakeConnection(chunks), "show router route-table")
+    assert "".join(pieces) == output[:-1]
+
+
+def test_streamed_output_memory_is_independent_of_its_size(tmp_path):
+    line = "10.0.0.0/24                                   Remote  BGP VPN   25d20h48m  170\n"
+    chunk = line * 400
+    connection = FakeConnection(["show router route-table\n"] + [chunk] * 5000 + ["A:PE1# "])
+    sink = output_sinks.FileSink(str(tmp_path))
+
+    tracemalloc.start()
+    device_output = sink.open_device("PE1")
+    device_output.start_command("show router route-table")
+    network_interface.read_until_prompt(connection, "show router route-table", write=device_output.write)
+    device_output.end_command()
+    metadata = device_output.close()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"\nStreamed {metadata['characters']['show router route-table'] / 1024 / 1024:.0f} MB to disk, peak memory {peak_memory / 1024:.0f} KB")
+
+    assert metadata["characters"]["show router route-table"] == len(chunk) * 5000 - 1
+    assert peak_memory < 10 * len(chunk)
+
+
+class FakeDevice(FakeConnection):
+
+    def __init__(self, outputs):
+        super().__init__([])
+        self.outputs = outputs
+
+    def write_channel(self, data):
+        super().write_channel(data)
+        command = data.strip()
+        self.chunks = [data, self.outputs[command], "\nA:PE1# "]
+
+    def is_alive(self):
+        return True
+
+    # The steps of netmiko BaseConnection._open, network_interface.open_connection times them
+    def _modify_connection_params(self):
+        pass
+
+    def establish_connection(self):
+        pass
+
+    def _try_session_preparation(self):
+        pass
+
+
+def test_collect_device_with_a_sink(tmp_path, monkeypatch):
+    outputs = {"show version": "TiMOS-C-23.10.R1", "show router route-table": "".join(generator.iter_route_table_lines(10))}
+    monkeypatch.setattr(network_interface, "ConnectHandler", lambda **device: FakeDevice(outputs))
+    device = {"hostname": "PE1", "ip": "192.0.2.1", "device_type": "nokia_sros", "commands": list(outputs)}
+
+    response = network_interface.collect_device(device, output_sinks.FileSink(str(tmp_path), "gzip"))
+
+    assert response["output"] == {}
+    assert response["error"] == ""
+    assert response["capture"]["file"] == str(tmp_path / "PE1.txt.gz")
+    with file_operations.open_capture(response["capture"]["file"]) as f:
+        sections = {command: "".join(lines) for command, lines in file_operations.iter_command_sections(f)}
+    assert sections == {command: output + "\n" for command, output in outputs.items()}
+
+
+def test_collect_device_disconnected_leaves_a_partial_capture(tmp_path, monkeypatch):
+    outputs = {"show version": "TiMOS-C-23.10.R1", "show router route-table": "".join(generator.iter_route_table_lines(10))}
+    device_connection = FakeDevice(outputs)
+    write_channel = device_connection.write_channel
+
+    def write_channel_and_disconnect(data):
+        write_channel(data)
+        if data.startswith("show router route-table"):
+            # the device closes the connection in the middle of the route table
+            device_connection.chunks = [data, outputs["show router route-table"][:500]]
+
+    device_connection.write_channel = write_channel_and_disconnect
+    monkeypatch.setattr(network_interface, "ConnectHandler", lambda **device: device_connection)
+    monkeypatch.setattr(network_interface, "_is_closed", lambda connection: not connection.chunks)
+    device = {"hostname": "PE1", "ip": "192.0.2.1", "device_type": "nokia_sros", "commands": list(outputs)}
+
+    response = network_interface.collect_device(device, output_sinks.FileSink(str(tmp_path)))
+
+    assert response["error"] == "Disconnected:show router route-table,"
+    assert response["capture"]["complete"] is False
+    assert response["capture"]["file"] == str(tmp_path / "PE1.txt.part")
+    assert os.listdir(tmp_path) == ["PE1.txt.part"]
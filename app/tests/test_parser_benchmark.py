@@ -0,0 +1,154 @@
+"""
+Parser benchmark suite.
+
+Every parser registered for nokia in netparser is measured, with the full parse (the whole
+capture as a string) and, when the parser supports them, the streaming parse and the parallel
+parse (PARALLEL_WORKERS processes over a memory mapped capture), on synthetic captures from
+nokia_output_generator. Each measurement runs in its own process and reports routes/s, MB/s
+and the peak memory (RSS) the parse added to the process (the parallel workers not included).
+
+By default the suite runs with small captures, set the sizes with
+    ROUTETABLE_BENCH_SIZES=10000,100000,1000000,5000000 python -m pytest app/tests/test_parser_benchmark.py -s
+The results are reported against tests/benchmarks/parser_baseline.json, measured for every
+implementation at 2000 (the default run), 10000, 100000, 1000000 and 5000000 routes, the full
+parse up to FULL_PARSE_MAX_ROUTES. The baseline is measured on one machine, with
+ROUTETABLE_BENCH_CHECK_BASELINE=1 (on that machine) a measurement fails when its throughput
+drops or its memory grows over the tolerances. Record a new baseline with
+ROUTETABLE_BENCH_UPDATE_BASELINE=1.
+"""
+
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import pytest
+
+import app.netparser as netparser
+import app.file_operations as file_operations
+import app.tests.nokia_output_generator as generator
+
+BENCHMARK_SIZES = [int(size) for size in os.environ.get("ROUTETABLE_BENCH_SIZES", "2000").split(",")]
+UPDATE_BASELINE = os.environ.get("ROUTETABLE_BENCH_UPDATE_BASELINE") == "1"
+CHECK_BASELINE = os.environ.get("ROUTETABLE_BENCH_CHECK_BASELINE") == "1"
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "parser_baseline.json")
+
+THROUGHPUT_TOLERANCE = 0.5  # fails when routes/s drops under half of the baseline
+MEMORY_TOLERANCE = 2.0  # fails when the memory added by the parse doubles the baseline
+MEMORY_NOISE_MB = 32  # memory differences under this value are ignored
+FULL_PARSE_MAX_ROUTES = 100000  # the full parse holds the capture and all its results in memory
+PARALLEL_WORKERS = min(os.cpu_count() or 1, 4)
+
+CAPTURE_GENERATORS = {
+    ("route", "text"): generator.iter_route_table_lines,
+    ("bgp", "text"): generator.iter_bgp_vpn_ipv4_lines,
+    ("route", "json"): generator.iter_route_table_json,
+}
+
+
+def parser_implementations():
+    implementations = []
+    for entry in netparser.VENDOR_PARSERS["nokia"]:
+        implementations.append((entry.table, entry.input_format, "full"))
+        if entry.streaming:
+            implementations.append((entry.table, entry.input_format, "streaming"))
+        if entry.parallel and entry.input_format == "text":
+            implementations.append((entry.table, entry.input_format, "parallel"))
+    return implementations
+
+
+def run_parser(table, input_format, mode, capture_file):
+    """Runs in a child process, parses capture_file and returns the measurements"""
+    entry = netparser.get_parser_entry("nokia", table=table, input_format=input_format)
+    entry.module  # import the parser and build the grammar before measuring
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "full":
+        with open(capture_file, encoding="utf-8") as f:
+            routes = len(entry.parse(f.read()))
+    elif mode == "parallel":
+        routes = 0
+        for batch in netparser.iter_parse_parallel("nokia", capture_file, "HOSTNAME1", "2024-05-09_08:00",
+                                                   PARALLEL_WORKERS, table=table):
+            routes += len(batch)
+    else:
+        routes = 0
+        with file_operations.open_capture(capture_file) as f:
+            for _, entries in entry.iter_parse(f):
+                routes += len(entries)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return routes, elapsed, (rss_after - rss_before) / 1024
+
+
+@pytest.fixture(scope="module")
+def captures(tmp_path_factory):
+    """Generates the captures once per module, {(table, input_format, num_routes): (filename, size)}"""
+    directory = tmp_path_factory.mktemp("captures")
+    generated = {}
+
+    def get_capture(table, input_format, num_routes):
+        key = (table, input_format, num_routes)
+        if key not in generated:
+            filename = str(directory / f"{table}-{num_routes}.{input_format}")
+            size = generator.write_capture(filename, CAPTURE_GENERATORS[(table, input_format)](num_routes))
+            generated[key] = (filename, size)
+        return generated[key]
+
+    return get_capture
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline_results = json.load(f)
+    else:
+        baseline_results = {}
+    yield baseline_results
+    if UPDATE_BASELINE:
+        os.makedirs(os.path.dirname(BASELINE_FILE), exist_ok=True)
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baseline_results, f, indent=4, sort_keys=True)
+            f.write("\n")
+
+
+@pytest.mark.parametrize("num_routes", BENCHMARK_SIZES)
+@pytest.mark.parametrize("implementation", parser_implementations(), ids="/".join)
+def test_parser_benchmark(implementation, num_routes, captures, baseline):
+    table, input_format, mode = implementation
+    if mode == "full" and num_routes > FULL_PARSE_MAX_ROUTES:
+        pytest.skip(f"full parse is only measured up to {FULL_PARSE_MAX_ROUTES} routes")
+    capture_file, capture_size = captures(table, input_format, num_routes)
+
+    # A fresh process per measurement, so the peak memory of one parse doesn't hide the next one
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+        routes, elapsed, peak_memory_mb = executor.submit(run_parser, table, input_format, mode, capture_file).result()
+
+    assert routes == num_routes
+    result = {
+        "routes_per_second": round(routes / elapsed, 1),
+        "mb_per_second": round(capture_size / 1024 / 1024 / elapsed, 3),
+        "peak_memory_mb": round(peak_memory_mb, 1),
+    }
+    name = "/".join(implementation)
+    print(f"\n{name} {num_routes} routes: {result['routes_per_second']:.0f} routes/s, "
+          f"{result['mb_per_second']:.2f} MB/s, peak memory +{result['peak_memory_mb']:.1f} MB")
+
+    baseline_result = baseline.get(name, {}).get(str(num_routes))
+    if UPDATE_BASELINE:
+        baseline.setdefault(name, {})[str(num_routes)] = result
+        return
+    if baseline_result is None:
+        return
+    print(f"{name} {num_routes} routes baseline: {baseline_result['routes_per_second']:.0f} routes/s, "
+          f"peak memory +{baseline_result['peak_memory_mb']:.1f} MB")
+    if not CHECK_BASELINE:
+        return
+    assert result["routes_per_second"] >= baseline_result["routes_per_second"] * THROUGHPUT_TOLERANCE, \
+        f"{name} throughput regression, baseline {baseline_result['routes_per_second']} routes/s"
+    assert result["peak_memory_mb"] <= max(baseline_result["peak_memory_mb"] * MEMORY_TOLERANCE,
+                                           baseline_result["peak_memory_mb"] + MEMORY_NOISE_MB), \
+        f"{name} memory regression, baseline {baseline_result['peak_memory_mb']} MB"
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+import app.pipeline as pipeline
+from app.tests.test_structured_ingest import generate_routes, render_text
+
+
+def slow_batches(num_batches, batch_size, delay, produced):
+    for index in range(num_batches):
+        time.sleep(delay)
+        produced.append(index)
+        yield [index] * batch_size
+
+
+def test_rebatch():
+    batches = [[1, 2, 3], [], [4], [5, 6, 7, 8, 9]]
+    assert list(pipeline.rebatch(batches, 4)) == [[1, 2, 3, 4], [5, 6, 7, 8], [9]]
+
+
+def test_ingest_overlaps_parse_and_write():
+    num_batches, delay = 10, 0.05
+    produced = []
+    saved = []
+
+    def save_batch(batch):
+        time.sleep(delay)
+        saved.append(batch)
+
+    start = time.perf_counter()
+    counters = pipeline.ingest(slow_batches(num_batches, 100, delay, produced), save_batch, batch_size=100)
+    elapsed = time.perf_counter() - start
+
+    assert len(saved) == num_batches
+    assert counters["parse"]["routes"] == counters["write"]["routes"] == num_batches * 100
+    # Sequential steps would take num_batches * delay * 2
+    assert elapsed < num_batches * delay * 1.6
+
+
+def test_ingest_backpressure_bounds_queued_batches():
+    produced = []
+    max_ahead = []
+
+    def save_batch(batch):
+        time.sleep(0.01)
+        # batches parsed but not yet saved: queued + the one being saved + the one being put
+        max_ahead.append(len(produced) - batch[0])
+
+    pipeline.ingest(slow_batches(50, 10, 0, produced), save_batch, batch_size=10, queue_size=3)
+
+    assert max(max_ahead) <= 3 + 2
+
+
+def test_ingest_propagates_parser_errors():
+    def failing_batches():
+        yield [1, 2]
+        raise ValueError("parse error")
+
+    with pytest.raises(ValueError):
+        pipeline.ingest(failing_batches(), lambda batch: None, batch_size=1)
+
+
+def test_ingest_stops_producer_on_writer_errors():
+    produced = []
+
+    def save_batch(batch):
+        raise RuntimeError("database error")
+
+    with pytest.raises(RuntimeError):
+        pipeline.ingest(slow_batches(1000, 1, 0, produced), save_batch, batch_size=1, queue_size=2)
+
+    assert len(produced) < 1000
+
+
+def test_load_routes_from_file_pipeline(tmp_path, monkeypatch):
+    import orchestrator
+    import storage
+
+    storage.DatabaseConnection.reset_instance()
+    monkeypatch.setattr(orchestrator, "database_url", str(tmp_path / "routes.sqlite3"))
+    monkeypatch.setattr(orchestrator, "_database_initialized", False)
+    capture_file = tmp_path / "route-table.txt"
+    capture_file.write_text(render_text(generate_routes(3000)))
+
+    try:
+        counters = orchestrator.load_routes_from_file(str(capture_file), "HOSTNAME1", "2024-05-09_08:00", "nokia")
+        routes = storage.get_routes("HOSTNAME1", "Base", "2024-05-09_08:00")
+        parse_stats = storage.get_parse_stats("HOSTNAME1", "2024-05-09_08:00")
+    finally:
+        storage.DatabaseConnection.reset_instance()
+
+    assert counters["parse"]["routes"] == counters["write"]["routes"] == 3000
+    assert len(routes) == 3000
+    assert parse_stats["source"] == str(capture_file)
+    assert parse_stats["entries_matched"] == 3000
+    assert parse_stats["rejected"] == 0
+    assert {key: parse_stats[key] for key in counters["parse_stats"]} == counters["parse_stats"]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_load_routes_from_file_unsupported_vendor(tmp_path, monkeypatch, workers):
+    import orchestrator
+    import storage
+
+    storage.DatabaseConnection.reset_instance()
+    monkeypatch.setattr(orchestrator, "database_url", str(tmp_path / "routes.sqlite3"))
+    monkeypatch.setattr(orchestrator, "_database_initialized", False)
+    capture_file = tmp_path / "route-table.txt"
+    capture_file.write_text(render_text(generate_routes(10)))
+
+    try:
+        with pytest.raises(ValueError, match="Unsupported vendor"):
+            orchestrator.load_routes_from_file(str(capture_file), "HOSTNAME1", "2024-05-09_08:00", "juniper", workers)
+    finally:
+        storage.DatabaseConnection.reset_instance()
@@ -0,0 +1,47 @@
+import ipaddress
+import random
+
+import pytest
+
+import app.prefixes as prefixes
+
+
+@pytest.mark.parametrize(
+    "prefix, expected",
+    [
+        ("10.32.219.5/24", "10.32.219.0/24"),
+        ("10.32.219.0/255.255.255.0", "10.32.219.0/24"),
+        ("10.38.147.9/29", "10.38.147.8/29"),
+        ("1.1.1.1", "1.1.1.1/32"),
+        ("0.0.0.0/0", "0.0.0.0/0"),
+        ("2001:DB8:0:0::1/64", "2001:db8::/64"),
+        ("2001:0db8:0000:0000:0000:0000:0000:0000/32", "2001:db8::/32"),
+        ("::/0", "::/0"),
+        ("fe80::1", "fe80::1/128"),
+    ]
+)
+def test_normalize_prefix(prefix, expected):
+    canonical, key = prefixes.normalize_prefix(prefix)
+    assert canonical == expected == str(ipaddress.ip_network(prefix, strict=False))
+    assert prefixes.prefix_from_key(key) == expected
+
+
+@pytest.mark.parametrize(
+    "prefix",
+    ["65500:10:1.2.3.4/32", "10.0.0.0/255.0.255.0", "10.0.0.0/33", "2001:db8::/129", "10.0.0/24", "Black Hole", "", None],
+)
+def test_normalize_prefix_keeps_invalid_prefixes(prefix):
+    assert prefixes.normalize_prefix(prefix) == (prefix, None)
+
+
+def test_prefix_keys_sort_numerically():
+    randomizer = random.Random(0)
+    networks = [
+        ipaddress.ip_network(f"{randomizer.randrange(256)}.{randomizer.randrange(256)}.0.0/{randomizer.randrange(8, 33)}", strict=False)
+        for _ in range(500)
+    ]
+    networks += [ipaddress.ip_network(f"2001:db8:{randomizer.randrange(65536):x}::/{randomizer.randrange(32, 129)}", strict=False) for _ in range(500)]
+    keys = sorted(prefixes.normalize_prefix(str(network))[1] for network in networks)
+
+    expected = sorted(networks, key=lambda network: (network.version, network.network_address, network.prefixlen))
+    assert [prefixes.prefix_from_key(key) for key in keys] == [str(network) for network in expected]
@@ -0,0 +1,76 @@
+import pytest
+
+import app.formatter as formatter
+import app.route_matrix as route_matrix
+import app.storage as storage
+
+TIMESTAMPS = ["2024-05-09_08:00", "2024-05-09_08:30", "2024-05-09_09:00", "2024-05-10_08:00"]
+
+
+@pytest.fixture(scope="function")
+def test_db():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def route(prefix, next_hop="10.20.30.40", metric="10", route_protocol="BGP"):
+    return {
+        "hostname": "HOSTNAME1", "service": "VPRN10", "route": prefix, "flags": None,
+        "route_type": "Remote", "route_protocol": route_protocol, "age": "01h00m00s", "preference": "170",
+        "next_hop": next_hop, "interface_next_hop": None, "metric": metric,
+    }
+
+
+@pytest.fixture(scope="function")
+def change_window(test_db):
+    # pre-change, mid-change, post-change and the next morning
+    storage.save_routes(TIMESTAMPS[0], [route("10.0.0.1/32"), route("10.0.0.2/32"), route("10.0.0.3/32", "10.1.1.1")])
+    storage.save_routes(TIMESTAMPS[1], [route("10.0.0.1/32"), route("10.0.0.3/32", "10.2.2.2")])
+    storage.save_routes(TIMESTAMPS[2], [route("10.0.0.1/32"), route("10.0.0.2/32"), route("10.0.0.3/32", "10.2.2.2"),
+                                        route("10.0.0.3/32", "10.1.1.1")])
+    storage.save_routes(TIMESTAMPS[3], [route("10.0.0.1/32", metric="20"), route("10.0.0.2/32"), route("10.0.0.3/32", "10.1.1.1"),
+                                        route("10.0.0.3/32", "10.2.2.2"), route("10.0.0.4/32", route_protocol="Static")])
+
+
+def matrix(timestamps, changed_only=False):
+    snapshots = storage.iter_route_history("HOSTNAME1", "VPRN10", fields=route_matrix.FIELDS, timestamps=timestamps)
+    timestamps_found, rows = route_matrix.iter_route_matrix(snapshots, changed_only)
+    return timestamps_found, list(rows)
+
+
+def test_route_matrix(change_window):
+    timestamps, rows = matrix(TIMESTAMPS)
+
+    assert timestamps == TIMESTAMPS
+    assert [(row["route"], "".join(row["changes"])) for row in rows] == [
+        ("10.0.0.1/32", "==~"),
+        ("10.0.0.2/32", "-+="),
+        ("10.0.0.3/32", "~~="),
+        ("10.0.0.4/32", "  +"),
+    ]
+    assert [route_matrix.format_state(state) for state in rows[2]["states"]] == [
+        "BGP 10.1.1.1 10", "BGP 10.2.2.2 10", "BGP 10.1.1.1 10;BGP 10.2.2.2 10", "BGP 10.1.1.1 10;BGP 10.2.2.2 10",
+    ]
+    assert rows[3]["states"][:3] == [None, None, None]
+
+
+def test_route_matrix_of_some_checkpoints(change_window):
+    timestamps, rows = matrix([TIMESTAMPS[3], TIMESTAMPS[0], "2024-05-11_08:00"], changed_only=True)
+
+    assert timestamps == [TIMESTAMPS[0], TIMESTAMPS[3]]
+    assert [(row["route"], row["changes"]) for row in rows] == [
+        ("10.0.0.1/32", ["~"]), ("10.0.0.3/32", ["~"]), ("10.0.0.4/32", ["+"]),
+    ]
+
+
+@pytest.mark.parametrize("output_format", ["text", "csv", "json"])
+def test_route_matrix_output(change_window, output_format):
+    timestamps, rows = matrix(TIMESTAMPS[:2])
+    lines = list(formatter.matrix_formatter_function[output_format](timestamps, iter(rows), "HOSTNAME1", "VPRN10"))
+
+    assert all(line.endswith("\n") for line in lines)
+    assert TIMESTAMPS[1] in lines[0] + lines[1] + lines[2]
+    assert "10.0.0.2/32" in lines[-2]
+    assert "10.2.2.2" in lines[-1]
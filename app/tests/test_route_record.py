@@ -0,0 +1,89 @@
+import random
+import tracemalloc
+
+import pytest
+import app.storage as storage
+from app.route_record import RouteRecord, FIELDS
+
+
+@pytest.fixture(scope="function")
+def test_db():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def generate_route(index):
+    return {
+        "hostname": "HOSTNAME1",
+        "service": "SERVICE1",
+        "route": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}/32",
+        "flags": random.choice(["B", "L"]),
+        "route_type": random.choice(["Local", "Remote"]),
+        "route_protocol": random.choice(["BGP VPN", "BGP_LABEL", "ISIS", "Static"]),
+        "age": f"{random.randint(0, 99)}h{random.randint(0, 59)}m{random.randint(0, 59)}s",
+        "preference": random.choice(["0", "5", "18", "170"]),
+        "next_hop": f"10.20.30.{random.randint(1, 20)}",
+        "interface_next_hop": random.choice([None, "tunneled:SR-ISIS:530001", "tunneled:BGP"]),
+        "metric": f"{random.randint(1, 100)}",
+    }
+
+
+def test_route_record_mapping_interface():
+    route_dict = generate_route(1)
+    route = RouteRecord.from_dict(route_dict)
+
+    assert route["route"] == route_dict["route"]
+    assert route.next_hop == route_dict["next_hop"]
+    assert route.get("id") is None
+    assert route.get("id", "") == ""
+    assert route.get("unknown_key", "default") == "default"
+    assert list(route.keys()) == list(FIELDS)
+    assert dict(route) == route.to_dict()
+    assert RouteRecord.from_dict(dict(route)) == route
+    with pytest.raises(KeyError):
+        route["unknown_key"]
+    with pytest.raises(AttributeError):
+        route.unknown_key = "value"
+
+
+def test_route_record_interns_low_cardinality_fields():
+    # Build the strings at runtime, literals would be shared by the compiler anyway
+    route1 = RouteRecord(route="1.1.1.1/32", route_protocol="".join(["BGP", " VPN"]), next_hop=".".join(["10", "1", "1", "1"]))
+    route2 = RouteRecord(route="1.1.1.2/32", route_protocol="".join(["BGP ", "VPN"]), next_hop=".".join(["10", "1", "1", "1"]))
+
+    assert route1.route_protocol is route2.route_protocol
+    assert route1.next_hop is route2.next_hop
+
+
+@pytest.mark.parametrize("num_routes", [20000, ])
+def test_get_routes_memory_reduction(num_routes, test_db):
+    """
+    Measure with tracemalloc the memory used by the routes of a snapshot
+    read as dictionaries (as storage.get_routes used to do) and read as RouteRecord
+    """
+    timestamp = "2024-05-09_08:00"
+    storage.save_routes(timestamp, [generate_route(i) for i in range(num_routes)],)
+
+    connection = storage.DatabaseConnection.get_instance().get_connection()
+
+    tracemalloc.start()
+    cursor = connection.cursor()
+    cursor.execute("SELECT * FROM igp_routes WHERE hostname=? AND service=? AND timestamp=?", ("HOSTNAME1", "SERVICE1", timestamp,))
+    results = cursor.fetchall()
+    dict_routes = [dict(zip([column[0] for column in cursor.description], row)) for row in results]
+    del results
+    dict_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del dict_routes
+
+    tracemalloc.start()
+    record_routes = storage.get_routes("HOSTNAME1", "SERVICE1", timestamp,)
+    record_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(record_routes) == num_routes
+    print(f"\nMemory used by {num_routes} routes as dict: {dict_memory / 1024 / 1024:.2f} MB")
+    print(f"Memory used by {num_routes} routes as RouteRecord: {record_memory / 1024 / 1024:.2f} MB")
+    assert record_memory < dict_memory * 0.6
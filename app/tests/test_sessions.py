@@ -0,0 +1,112 @@
+import app.sessions as sessions
+from app.tests.test_output_sinks import FakeDevice
+
+
+class StandInConnections:
+    """Connects the devices to FakeDevice sessions and counts the connections"""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.connected = []
+
+    def connect_device(self, hostname, device_dict, attempts, metrics=None):
+        assert "hostname" not in device_dict and "commands" not in device_dict
+        assert device_dict["keepalive"] == sessions.KEEPALIVE_SECONDS
+        connection = FakeDevice(self.outputs)
+        connection.alive = True
+        connection.is_alive = lambda: connection.alive
+        connection.disconnected = False
+        connection.disconnect = lambda: setattr(connection, "disconnected", True)
+        self.connected.append((hostname, connection))
+        return connection, None
+
+
+def devices(number, command_options=None):
+    return [
+        {"hostname": f"PE{index}", "ip": f"192.0.2.{index}", "device_type": "nokia_sros", "username": "user",
+         "commands": ["show version"], **({"command_options": command_options} if command_options else {})}
+        for index in range(number)
+    ]
+
+
+def test_session_pool_reuses_the_sessions():
+    stand_in = StandInConnections({"show version": "TiMOS-C-23.10.R1"})
+    pool = sessions.SessionPool(stand_in.connect_device)
+
+    for _ in range(3):
+        responses = pool.execute_devices_commands(devices(20), concurrency=5)
+        assert sorted(response["hostname"] for response in responses) == sorted(f"PE{index}" for index in range(20))
+        assert all(response["output"] == {"show version": "TiMOS-C-23.10.R1"} for response in responses)
+
+    assert len(stand_in.connected) == 20
+    assert (pool.connects, pool.reuses, pool.reconnects) == (20, 40, 0)
+    assert len(pool) == 20
+    pool.close()
+    assert len(pool) == 0
+    assert all(connection.disconnected for _, connection in stand_in.connected)
+
+
+def test_session_pool_reconnects_dead_sessions():
+    stand_in = StandInConnections({"show version": "TiMOS-C-23.10.R1"})
+    pool = sessions.SessionPool(stand_in.connect_device, health_check_seconds=0)
+    pool.execute_devices_commands(devices(3))
+    dead = {hostname: connection for hostname, connection in stand_in.connected if hostname != "PE1"}
+    for connection in dead.values():
+        connection.alive = False
+
+    # the dead session of PE0 is found when it is used, the one of PE2 by the health check
+    [response] = pool.execute_devices_commands(devices(1))
+    assert pool.check_sessions() == 1
+
+    assert response["output"] == {"show version": "TiMOS-C-23.10.R1"}
+    assert (pool.connects, pool.reuses, pool.reconnects) == (4, 0, 1)
+    assert all(connection.disconnected for connection in dead.values())
+    assert len(pool) == 2
+
+
+def test_session_pool_closes_sessions_after_errors():
+    stand_in = StandInConnections({"show version": "TiMOS-C-23.10.R1"})
+    pool = sessions.SessionPool(stand_in.connect_device)
+
+    # the prompt never shows up, the read times out
+    [response] = pool.execute_devices_commands(devices(1, {"show version": {"expect_string": "never", "read_timeout": 0.05}}))
+
+    assert response["error"] == "ReadTimeout:show version,"
+    assert len(pool) == 0
+    assert stand_in.connected[0][1].disconnected
+
+
+def test_run_daemon():
+    stand_in = StandInConnections({"show version": "TiMOS-C-23.10.R1"})
+    pool = sessions.SessionPool(stand_in.connect_device)
+    collected = []
+    sleeps = []
+
+    cycles = sessions.run_daemon(pool, lambda cycle: collected.append(pool.execute_devices_commands(devices(4))), 900,
+                                 cycles=3, sleep=sleeps.append)
+
+    assert cycles == 3
+    assert [len(responses) for responses in collected] == [4, 4, 4]
+    assert len(sleeps) == 2 and all(890 < seconds <= 900 for seconds in sleeps)
+    assert pool.connects == 4
+    assert len(pool) == 0
+
+
+def test_run_daemon_goes_on_after_a_failed_cycle():
+    stand_in = StandInConnections({"show version": "TiMOS-C-23.10.R1"})
+    pool = sessions.SessionPool(stand_in.connect_device)
+    collected = []
+    sleeps = []
+
+    def collect_cycle(cycle):
+        if cycle == 1:
+            raise OSError("No space left on device")
+        collected.append(pool.execute_devices_commands(devices(2)))
+
+    cycles = sessions.run_daemon(pool, collect_cycle, 900, cycles=3, sleep=sleeps.append)
+
+    assert cycles == 3
+    assert [len(responses) for responses in collected] == [2, 2]
+    assert len(sleeps) == 2
+    assert (pool.connects, pool.reuses) == (2, 2)
+    assert len(pool) == 0
@@ -0,0 +1,94 @@
+import pickle
+
+import pytest
+
+import app.backoff as backoff
+import app.sharding as sharding
+import app.storage as storage
+import app.tests.ssh_farm as ssh_farm
+
+
+@pytest.fixture
+def database():
+    storage.DatabaseConnection.set_database_url(":memory:")
+    storage.initialize_database()
+    yield
+    storage.DatabaseConnection.destroy_database()
+
+
+def device(hostname, **kwargs):
+    return dict(hostname=hostname, ip="192.0.2.1", **kwargs)
+
+
+def hostnames(shard):
+    return sorted(device["hostname"] for device in shard["devices"])
+
+
+def test_partition_balances_the_shards_with_the_durations():
+    durations = {"PE0": 10.0, "PE1": 8.0, "PE2": 6.0, "PE3": 5.0, "PE4": 4.0, "PE5": 1.0}
+    devices = [device(hostname) for hostname in durations]
+
+    shards = sharding.partition(devices, 2, durations)
+
+    assert [hostnames(shard) for shard in shards] == [["PE0", "PE3", "PE5"], ["PE1", "PE2", "PE4"]]
+    assert [shard["estimated_seconds"] for shard in shards] == [16.0, 18.0]
+
+
+def test_partition_without_history_and_with_proxies():
+    jump_host = {"host": "192.0.2.250", "username": "admin", "password": "admin"}
+    proxy = {"proxy_type": 2, "addr": "192.0.2.251", "port": 1080}
+    devices = [device(f"PE{index}") for index in range(4)]
+    devices += [device(f"JH{index}", jump_host=jump_host) for index in range(3)]
+    devices += [device(f"PX{index}", proxy=proxy) for index in range(2)]
+
+    shards = sharding.partition(devices, 3, {"PE0": 2.0, "PE1": 4.0})
+
+    # the devices without history count as the median of the known ones, 3 seconds
+    assert sorted(shard["estimated_seconds"] for shard in shards) == [9.0, 9.0, 9.0]
+    assert sorted(hostnames(shard) for shard in shards)[0] == ["JH0", "JH1", "JH2"]
+    assert all(len({hostname[:2] for hostname in hostnames(shard)} & {"PX"}) <= 1 for shard in shards)
+    assert sorted(sum((hostnames(shard) for shard in shards), [])) == sorted(device["hostname"] for device in devices)
+
+    grouped = sharding.partition(devices, 3, group_proxies=True)
+    assert ["PX0", "PX1"] in [[hostname for hostname in hostnames(shard) if hostname.startswith("PX")] for shard in grouped]
+    assert len(sharding.partition(devices[:2], 4)) == 2
+
+
+def test_device_durations_moving_average(database):
+    storage.save_device_durations({"PE1": 10.0, "PE2": 4.0})
+    storage.save_device_durations({"PE1": 20.0})
+
+    assert storage.get_device_durations() == {"PE1": 15.0, "PE2": 4.0}
+
+
+def test_circuit_breaker_goes_to_the_shards_and_back():
+    breaker = backoff.CircuitBreaker({"device:PE1": (1, 100.0, "Timeout")}, threshold=2)
+    copy = pickle.loads(pickle.dumps(breaker))
+    copy.record(device("PE1"), {"hostname": "PE1", "error": "Timeout"})
+    copy.record(device("PE2"), {"hostname": "PE2", "error": "Timeout"})
+
+    breaker.update(copy.changed_states())
+
+    assert {key: state[0] for key, state in breaker.changed_states().items()} == {"device:PE1": 2, "device:PE2": 1}
+    assert breaker.check(device("PE1"))[0] == backoff.CircuitBreaker.SKIP
+
+
+def test_collect_sharded_from_the_farm(tmp_path):
+    profiles = [ssh_farm.DeviceProfile(f"PE{index}", routes=50, seed=index) for index in range(4)]
+    profiles.append(ssh_farm.DeviceProfile("PE4", failure="auth"))
+    breaker = backoff.CircuitBreaker()
+
+    with ssh_farm.SSHFarm(profiles) as farm:
+        responses, shards = sharding.collect_sharded(
+            farm.devices(timeout=1), 2, {"PE0": 10.0, "PE1": 1.0, "PE2": 1.0, "PE3": 1.0, "PE4": 1.0}, concurrency=4, output_directory=str(tmp_path),
+            backoff_policy=backoff.BackoffPolicy(max_attempts=1), circuit_breaker=breaker,
+        )
+
+    responses = {response["hostname"]: response for response in responses}
+    assert sorted(responses) == ["PE0", "PE1", "PE2", "PE3", "PE4"]
+    assert all(responses[f"PE{index}"]["error"] == "" for index in range(4))
+    assert responses["PE4"]["error"].startswith("AuthenticationFailed")
+    assert all(responses[f"PE{index}"]["capture"]["file"].startswith(str(tmp_path)) for index in range(4))
+    assert sorted(shard["devices"] for shard in shards) == [1, 4]
+    assert all(shard["error"] == "" and shard["wall_seconds"] > 0 for shard in shards)
+    assert list(breaker.changed_states()) == ["device:PE4"]
@@ -0,0 +1,88 @@
+import app.collector as collector
+import app.network_interface as network_interface
+import app.sessions as sessions
+import app.tests.ssh_farm as ssh_farm
+
+
+def collect(farm, **kwargs):
+    devices = farm.devices(timeout=1, **kwargs)
+    for device in devices:
+        device["connect_attempts"] = 1
+    return {response["hostname"]: response for response in collector.collect_devices(devices, concurrency=8)}
+
+
+def test_collect_devices_from_the_farm():
+    profiles = [
+        ssh_farm.DeviceProfile("PE0", routes=300),
+        ssh_farm.DeviceProfile("PE1", failure="auth"),
+        ssh_farm.DeviceProfile("PE2", failure="timeout"),
+        ssh_farm.DeviceProfile("PE3", routes=2000, failure="disconnect"),
+        # ~60 KB of route table at 100 KB/s
+        ssh_farm.DeviceProfile("PE4", routes=400, command_latency=0.2, bandwidth=100000),
+    ]
+
+    with ssh_farm.SSHFarm(profiles) as farm:
+        responses = collect(farm)
+
+    assert responses["PE0"]["error"] == ""
+    assert responses["PE0"]["output"]["show version"] == ssh_farm.VERSION
+    assert responses["PE0"]["output"]["show router route-table"].strip() == profiles[0].route_table().strip()
+    assert responses["PE1"]["error"] == "AuthenticationFailed,MaximumNumberRetriesReached"
+    assert responses["PE2"]["error"] == "Timeout,MaximumNumberRetriesReached"
+    assert responses["PE3"]["error"] == "Disconnected:show router route-table,"
+    assert responses["PE4"]["error"] == ""
+    assert responses["PE4"]["timing"]["show router route-table"] >= 0.2 + 0.5
+
+
+def test_collect_devices_through_the_farm_jump_host(monkeypatch):
+    pool = network_interface.bastions.BastionPool(transports_per_bastion=1, channels_per_transport=4)
+    monkeypatch.setattr(network_interface.bastions, "_pool", pool)
+    profiles = [ssh_farm.DeviceProfile(f"PE{index}", routes=50, seed=index) for index in range(6)]
+
+    with ssh_farm.SSHFarm(profiles, processes=1, jump_host=True) as farm:
+        responses = collect(farm, jump_host=True)
+    pool.close()
+
+    assert all(response["error"] == "" for response in responses.values())
+    assert all(responses[profile.hostname]["output"]["show router route-table"].strip() == profile.route_table().strip()
+               for profile in profiles)
+    assert (pool.transports_opened, pool.channels_opened) == (1, 6)
+
+
+def test_collect_devices_frees_the_jump_host_channels(monkeypatch):
+    import network_interface as connections
+
+    pool = network_interface.bastions.BastionPool(transports_per_bastion=1, channels_per_transport=2, wait_timeout=5)
+    monkeypatch.setattr(network_interface.bastions, "_pool", pool)
+    # the sessions are kept referenced, the farm doesn't close them, only the disconnect frees a channel
+    sessions_opened = []
+    open_connection = connections.open_connection
+
+    def keep_connection(device_dict, metrics):
+        sessions_opened.append(open_connection(device_dict, metrics))
+        return sessions_opened[-1]
+
+    monkeypatch.setattr(connections, "open_connection", keep_connection)
+    profiles = [ssh_farm.DeviceProfile(f"PE{index}", routes=50, seed=index) for index in range(6)]
+
+    with ssh_farm.SSHFarm(profiles, jump_host=True) as farm:
+        responses = collect(farm, jump_host=True)
+        open_channels = [entry.open_channels() for bastion in pool._bastions.values() for entry in bastion.transports]
+    pool.close()
+
+    assert [response["error"] for response in responses.values()] == [""] * 6
+    assert (pool.transports_opened, pool.channels_opened, len(sessions_opened)) == (1, 6, 6)
+    assert open_channels == [0]
+
+
+def test_session_pool_reuses_the_farm_sessions():
+    profiles = [ssh_farm.DeviceProfile(f"PE{index}", routes=20) for index in range(3)]
+    pool = sessions.SessionPool()
+
+    with ssh_farm.SSHFarm(profiles) as farm:
+        for _ in range(2):
+            responses = pool.execute_devices_commands(farm.devices(timeout=1), concurrency=3)
+            assert sorted(response["error"] for response in responses) == ["", "", ""]
+        pool.close()
+
+    assert (pool.connects, pool.reuses) == (3, 3)
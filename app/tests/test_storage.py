@@ -4,6 +4,8 @@ import random
 import copy
 
 import pytest
+import app.ages as ages
+import app.prefixes as prefixes
 import app.storage as storage
 
 @pytest.fixture(scope="function")  # Create database once per test module
@@ -330,7 +332,8 @@ def generate_test_route(route_prefix):
     return {
         "hostname": f"HOSTNAME1",
         "service": f"SERVICE1",
-        "route": f"{route_prefix}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}/{random.randint(1, 32)}",
+        # prefixes are stored normalized, generate them without host bits so they stay different
+        "route": prefixes.normalize_prefix(f"{route_prefix}.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(0, 255)}/{random.randint(8, 32)}")[0],
         "flags": random.choice(["B", "L"]),
         "route_type" : random.choice(["Local", "Remote", "Blackh*"]),
         "route_protocol": random.choice(["BGP VPN", "BGP_LABEL", "ISIS", "Aggr", "Static", "OSPF", "Local", "BGP"]),
@@ -348,7 +351,11 @@ def generate_unique_routes_list(num_routes):
     population.extend(generate_test_route(random.choice([10, 20, 30, 40, 50])) for _ in range(int(num_routes / 4)))
     population.extend(generate_test_route(random.choice([10, 20, 30, 40, 50])) for _ in range(int(num_routes / 4)))
     population.extend(generate_test_route(random.choice([10, 20, 30, 40, 50])) for _ in range(int(num_routes / 4)))
-    return random.sample(population, num_routes)
+    unique_population = {route["route"]: route for route in population}
+    while len(unique_population) < num_routes:
+        route = generate_test_route(random.choice([10, 20, 30, 40, 50]))
+        unique_population.setdefault(route["route"], route)
+    return random.sample(list(unique_population.values()), num_routes)
 
 
 @pytest.mark.parametrize("num_routes", [10000, ])
@@ -716,3 +723,83 @@ def test_changed_route_detection_with_same_route_and_multiple_nexthops(routes_da
     
     # Assertions
     assert len(comparison_result['changed']) == 0 
+
+
+def test_dual_stack_prefixes_written_differently_are_the_same_route(test_db):
+    def route(prefix):
+        return {
+            "hostname": "HOSTNAME1", "service": "SERVICE1", "route": prefix, "flags": None,
+            "route_type": "Remote", "route_protocol": "BGP", "age": "00h01m02s", "preference": "170",
+            "next_hop": "10.20.30.40", "interface_next_hop": None, "metric": "10",
+        }
+
+    storage.save_routes("2024-05-09_08:00", [route("10.32.219.5/24"), route("2001:DB8:0::/32"), route("10.1.0.0/16")])
+    storage.save_routes("2024-05-09_08:15", [route("10.32.219.0/255.255.255.0"), route("2001:0db8::/32"), route("2001:db8:1::/48")])
+
+    result = storage.compare_routes("HOSTNAME1", "SERVICE1", "2024-05-09_08:00", "2024-05-09_08:15")
+    routes = storage.get_routes("HOSTNAME1", "SERVICE1", "2024-05-09_08:15")
+
+    assert [deleted["route"] for deleted in result["deleted"]] == ["10.1.0.0/16"]
+    assert [added["route"] for added in result["added"]] == ["2001:db8:1::/48"]
+    assert result["changed"] == []
+    assert [(stored.route, stored.prefix_key) for stored in routes] == [
+        prefixes.normalize_prefix(prefix) for prefix in ("10.32.219.0/24", "2001:db8::/32", "2001:db8:1::/48")
+    ]
+
+
+def test_initialize_database_normalizes_routes_saved_before_prefix_keys(tmp_path):
+    database_file = str(tmp_path / "routes.sqlite3")
+    with sqlite3.connect(database_file) as connection:
+        connection.execute(
+            "CREATE TABLE igp_routes (id INTEGER PRIMARY KEY AUTOINCREMENT, hostname TEXT NOT NULL, service TEXT NOT NULL, "
+            "timestamp TEXT NOT NULL, route TEXT NOT NULL, flags TEXT, route_type TEXT, route_protocol TEXT, age TEXT, "
+            "preference TEXT, next_hop TEXT, interface_next_hop TEXT, metric TEXT)"
+        )
+        connection.executemany(
+            "INSERT INTO igp_routes (hostname, service, timestamp, route, age) VALUES ('HOSTNAME1', 'SERVICE1', '2024-05-09_08:00', ?, ?)",
+            [("10.32.219.5/24", "00h10m00s"), ("2001:DB8::1/64", "01d00h00m"), ("65500:10:1.2.3.4/32", None)],
+        )
+    storage.DatabaseConnection.reset_instance()
+    storage.DatabaseConnection.set_database_url(database_file)
+    try:
+        storage.initialize_database(database_file)
+        routes = storage.get_routes("HOSTNAME1", "SERVICE1", "2024-05-09_08:00")
+    finally:
+        storage.DatabaseConnection.reset_instance()
+
+    assert [(route.route, route.prefix_key) for route in routes] == [
+        prefixes.normalize_prefix("10.32.219.0/24"), prefixes.normalize_prefix("2001:db8::/64"), ("65500:10:1.2.3.4/32", None)
+    ]
+    epoch = ages.timestamp_to_epoch("2024-05-09_08:00")
+    assert [(route.age_seconds, route.installed_at) for route in routes] == [(600, epoch - 600), (86400, epoch - 86400), (None, None)]
+
+
+def test_get_recently_installed_routes(test_db):
+    def route(prefix, service, age):
+        return {
+            "hostname": "HOSTNAME1", "service": service, "route": prefix, "flags": None,
+            "route_type": "Remote", "route_protocol": "BGP", "age": age, "preference": "170",
+            "next_hop": "10.20.30.40", "interface_next_hop": None, "metric": "10",
+        }
+
+    storage.save_routes("2024-05-09_08:00", [
+        route("10.0.0.1/32", "Base", "00h04m59s"),
+        route("10.0.0.2/32", "Base", "00h00m10s"),
+        route("10.0.0.3/32", "Base", "02d00h00m"),
+        route("10.0.0.4/32", "VPRN10", "00h01m00s"),
+    ])
+    storage.save_routes("2024-05-09_08:15", [route("10.0.0.5/32", "Base", "00h00m01s")])
+
+    routes = storage.get_recently_installed_routes("HOSTNAME1", "2024-05-09_08:00", 300)
+    base_routes = storage.get_recently_installed_routes("HOSTNAME1", "2024-05-09_08:00", 300, service="Base")
+
+    assert [route.route for route in routes] == ["10.0.0.2/32", "10.0.0.4/32", "10.0.0.1/32"]
+    assert [route.route for route in base_routes] == ["10.0.0.2/32", "10.0.0.1/32"]
+    assert routes[0].installed_at == ages.timestamp_to_epoch("2024-05-09_08:00") - 10
+    assert storage.get_recently_installed_routes("HOSTNAME1", "2024-05-09", 300) == []
+    with storage.DatabaseConnection.get_instance().get_connection() as connection:
+        plan = connection.execute(
+            "EXPLAIN QUERY PLAN SELECT route FROM igp_routes WHERE hostname=? AND timestamp=? AND installed_at>=?",
+            ("HOSTNAME1", "2024-05-09_08:00", 0),
+        ).fetchall()
+    assert "igp_routes_installed_at" in str(plan)
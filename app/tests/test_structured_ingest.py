@@ -0,0 +1,173 @@
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import random
+import time
+import tracemalloc
+
+import pytest
+
+import app.netparser as netparser
+import app.file_operations as file_operations
+
+TUNNELS = [
+    (None, None),
+    ("tunneled:SR-ISIS:530001", {"type": "sr-isis", "tunnel-id": 530001}),
+    ("tunneled:SR-TE:401", {"type": "sr-te", "tunnel-id": 401}),
+    ("tunneled:RSVP:85034", {"type": "rsvp", "tunnel-id": 85034}),
+    ("tunneled:BGP", {"type": "bgp"}),
+]
+PROTOCOLS = [("BGP VPN", "bgp-vpn"), ("BGP_LABEL", "bgp-label"), ("ISIS", "isis"), ("Static", "static")]
+
+
+def generate_routes(num_routes):
+    routes = []
+    for index in range(num_routes):
+        tunnel_text, tunnel_json = random.choice(TUNNELS)
+        protocol_text, protocol_json = random.choice(PROTOCOLS)
+        routes.append({
+            "prefix": f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}/32",
+            "protocol_text": protocol_text,
+            "protocol_json": protocol_json,
+            "age": random.randint(0, 86399),
+            "preference": random.choice([5, 18, 170]),
+            "next_hop": f"10.20.30.{random.randint(1, 250)}",
+            "tunnel_text": tunnel_text,
+            "tunnel_json": tunnel_json,
+            "metric": random.randint(1, 20000),
+        })
+    return routes
+
+
+def render_text(routes):
+    """Renders the routes as the output of 'show router route-table'"""
+    lines = [
+        "=" * 79,
+        "Route Table (Router: Base)",
+        "=" * 79,
+        "Dest Prefix[Flags]                            Type    Proto     Age        Pref",
+        "      Next Hop[Interface Name]                                    Metric   ",
+        "-" * 79,
+    ]
+    for route in routes:
+        hours, seconds = divmod(route["age"], 3600)
+        minutes, seconds = divmod(seconds, 60)
+        age = f"{hours:02d}h{minutes:02d}m{seconds:02d}s"
+        next_hop = route["next_hop"] + (f" ({route['tunnel_text']})" if route["tunnel_text"] else "")
+        lines.append(f"{route['prefix']:<46}Remote  {route['protocol_text']:<10}{age:<11}{route['preference']}")
+        lines.append(f"       {next_hop:<61}{route['metric']}")
+    lines.append("-" * 79)
+    lines.append(f"No. of Routes: {len(routes)}")
+    lines.append("=" * 79)
+    return "\n".join(lines) + "\n"
+
+
+def render_json(routes):
+    """Renders the routes as the MD-CLI 'info json' output of the route-table state"""
+    json_routes = []
+    for route in routes:
+        nexthop = {"ip-address": route["next_hop"]}
+        if route["tunnel_json"]:
+            nexthop["tunnel"] = route["tunnel_json"]
+        json_routes.append({
+            "ipv4-prefix": route["prefix"],
+            "protocol": f"nokia-state:{route['protocol_json']}",
+            "preference": route["preference"],
+            "metric": route["metric"],
+            "age": route["age"],
+            "nexthop": [nexthop],
+        })
+    return json.dumps({"router-name": "Base", "route-table": {"unicast": {"ipv4": {"nokia-state:route": json_routes}}}}, indent=4)
+
+
+def parse_all(stream, input_format, **kwargs):
+    return [
+        route
+        for batch in netparser.iter_parse("nokia", stream, "HOSTNAME1", "2024-05-09_08:00", input_format=input_format, **kwargs)
+        for route in batch
+    ]
+
+
+def test_iter_json_list_items_small_chunks():
+    content = '{"a": {"nokia-state:route": [{"x": 1}, {"x": "]"}]}, "b": [{"route": [ {"x": 3} ]}]}'
+    items = list(file_operations.iter_json_list_items(io.StringIO(content), "route", chunk_size=3))
+    assert items == [{"x": 1}, {"x": "]"}, {"x": 3}]
+
+
+def test_structured_gnmi_notifications():
+    notifications = [
+        {"update": [{"path": "/state/service/vprn[service-name=VPRN10]/route-table/unicast/ipv4",
+                     "val": {"route": [{"ipv4-prefix": "1.1.1.1/32", "protocol": "local", "preference": 0, "metric": 0,
+                                        "nexthop": [{"interface-name": "to-PE2"}]}]}}]},
+    ]
+    content = "\n".join(json.dumps(notification) for notification in notifications)
+    routes = parse_all(io.StringIO(content), "json")
+
+    assert len(routes) == 1
+    assert routes[0].service == "VPRN10"
+    assert routes[0].route_type == "Local"
+    assert routes[0].route_protocol == "Local"
+    assert routes[0].next_hop == "to-PE2"
+
+
+@pytest.mark.parametrize("num_routes", [5000, ])
+def test_structured_and_text_ingest_benchmark(num_routes):
+    routes = generate_routes(num_routes)
+    text_output = render_text(routes)
+    json_output = render_json(routes)
+
+    start_text = time.time()
+    text_routes = parse_all(io.StringIO(text_output), "text")
+    text_time = time.time() - start_text
+
+    start_json = time.time()
+    json_routes = parse_all(io.StringIO(json_output), "json")
+    json_time = time.time() - start_json
+
+    assert len(text_routes) == num_routes
+    assert json_routes == text_routes
+
+    print(f"\nText ingest of {num_routes} routes: {text_time:.4f} seconds, {num_routes / text_time:.0f} routes/s")
+    print(f"JSON ingest of {num_routes} routes: {json_time:.4f} seconds, {num_routes / json_time:.0f} routes/s")
+
+
+def measure_structured_ingest(capture_file):
+    """Runs in a child process, returns the routes parsed and the peak memory traced"""
+    tracemalloc.start()
+    routes_count = 0
+    with file_operations.open_capture(capture_file) as stream:
+        for batch in netparser.iter_parse("nokia", stream, "HOSTNAME1", "2024-05-09_08:00", input_format="json",
+                                          batch_size=500, chunk_size=64 * 1024):
+            routes_count += len(batch)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return routes_count, peak_memory
+
+
+@pytest.mark.parametrize("num_routes", [20000, ])
+def test_structured_ingest_is_memory_bounded(num_routes, tmp_path):
+    capture_file = tmp_path / "route-table.json"
+    capture_file.write_text(render_json(generate_routes(num_routes)))
+
+    # A fresh interpreter, the modules imported by other tests (netmiko) grow the table of interned
+    # strings and its resizes during the parse would be counted
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        routes_count, peak_memory = executor.submit(measure_structured_ingest, str(capture_file)).result()
+
+    assert routes_count == num_routes
+    print(f"\nPeak memory {peak_memory / 1024 / 1024:.2f} MB for a {capture_file.stat().st_size / 1024 / 1024:.2f} MB file")
+    assert peak_memory < capture_file.stat().st_size / 4
+
+
+@pytest.mark.parametrize("chunk_size", [256, 512, 1000])
+def test_service_name_split_between_chunks(chunk_size):
+    route = {"ipv4-prefix": "1.1.1.1/32", "protocol": "local", "preference": 0, "metric": 0,
+             "nexthop": [{"interface-name": "to-PE2"}]}
+    # the service name is skipped text, cut by every chunk boundary in turn, the list comes in a later read
+    for indent in range(chunk_size):
+        content = ("{" + " " * indent + '"router-name": "Management",' + " " * chunk_size
+                   + json.dumps({"route-table": {"route": [route]}})[1:])
+        routes = parse_all(io.StringIO(content), "json", chunk_size=chunk_size)
+
+        assert [route.service for route in routes] == ["Management"], indent
@@ -96,6 +96,34 @@ def load_commands(filename: str):
     logger.debug(f"{commands}")
     return commands
 
+COMMAND_OPTIONS = ("expect_string", "read_timeout", "mode")
+
+def _split_command_options(commands: list) -> tuple:
+    """
+    The commands can be strings or dictionaries with the command and its options, e.g.
+        - show version
+        - command: show router route-table
+          read_timeout: 900
+          expect_string: 'A:\\S+# $'
+    Returns the list of command strings and {command: options} of the commands with options
+    """
+    command_strings = []
+    command_options = {}
+    for command in commands:
+        if isinstance(command, dict):
+            options = {key: value for key, value in command.items() if key in COMMAND_OPTIONS}
+            unknown_options = set(command) - set(COMMAND_OPTIONS) - {"command"}
+            if unknown_options:
+                logger.warning(f"Unknown options {sorted(unknown_options)} of command {command.get('command')}")
+            command = command.get("command")
+            if not command:
+                logger.error(f"Command without the 'command' key: {options}")
+                continue
+            if options:
+                command_options.setdefault(command, options)
+        command_strings.append(command)
+    return command_strings, command_options
+
 def generate_device_list(inventory: dict, commands: dict) -> list:
     """
     Receives the inventory and commands YAML as dictionaries
@@ -111,6 +139,17 @@ def generate_device_list(inventory: dict, commands: dict) -> list:
         translated_device_dict["password"] = _get_var(device_dict.get("credentials", {}).get("password", ""))
         translated_device_dict["port"] = device_dict.get("connection", {}).get("default", {}).get("mgmt_port", 22)
         translated_device_dict["device_type"] = device_dict.get("vendor")
+        # optional, used by the collector to limit the sessions per proxy and per site
+        if device_dict.get("proxy"):
+            translated_device_dict["proxy"] = device_dict.get("proxy")
+        if device_dict.get("site"):
+            translated_device_dict["site"] = device_dict.get("site")
+        if device_dict.get("jump_host"):
+            jump_host = dict(device_dict.get("jump_host"))
+            for credential in ("username", "password"):
+                if jump_host.get(credential):
+                    jump_host[credential] = _get_var(jump_host[credential])
+            translated_device_dict["jump_host"] = jump_host
         # breakpoint()
         device_roles = [x.strip() for x in device_dict.get("roles", "").split(",")]
         device_roles = ["all"] if device_roles == [""] else device_roles
@@ -128,7 +167,10 @@ def generate_device_list(inventory: dict, commands: dict) -> list:
         
         # remove duplicated entries on the commands, each command is to be executed only one and
         # the first time it appears on the list of commands
-        translated_device_dict["commands"] = list(dict.fromkeys(translated_device_dict["commands"]))
+        command_strings, command_options = _split_command_options(translated_device_dict["commands"])
+        translated_device_dict["commands"] = list(dict.fromkeys(command_strings))
+        if command_options:
+            translated_device_dict["command_options"] = command_options
 
         logger.debug(f"Device {device} was translated as {translated_device_dict}")
         yield translated_device_dict